@@ -1,10 +1,4 @@
-from api.api_facebook import get_facebook_data
-from api.api_googleAds import get_googleAds_data
-from api.api_campaign_manager import get_cm_data
-from api.api_twitter import get_twitter_data
-
-from api.api_googleAnalytics import get_googleAnalytics_bm_data
-from api.api_googleAnalytics import get_googleAnalytics_cm_data
+from connectors import get_connector
 
 
 class Campaign:
@@ -22,23 +16,25 @@ class Campaign:
         self.bm_googleAnalytics = None
         self.cm_googleAnalytics = None
 
+    # Os módulos de cada plataforma só são importados quando o método correspondente é chamado.
+
     def get_facebook(self, accounts, start_date, end_date):
-        self.facebook = get_facebook_data(accounts, start_date, end_date)
+        self.facebook = get_connector('Facebook')(accounts, start_date, end_date)
 
     def get_googleAds(self, accounts, start_date, end_date):
-        self.googleAds = get_googleAds_data(accounts, start_date, end_date)
+        self.googleAds = get_connector('GoogleAds')(accounts, start_date, end_date)
 
     def get_twitter(self, campaigns, start_date, end_date):
-        self.twitter = get_twitter_data(self.campaign_path, campaigns, start_date, end_date)
+        self.twitter = get_connector('Twitter')(campaigns, start_date, end_date)
 
     def get_campaign_manager(self, campaigns, start_date, end_date):
-        self.campaign_manager = get_cm_data(self.campaign_path, campaigns, start_date, end_date)
+        self.campaign_manager = get_connector('CampaignManager')(self.campaign_path, campaigns, start_date, end_date)
         
     def get_bm_googleAnalytics(self, view, campaigns, start_date, end_date):
-        self.bm_googleAnalytics = get_googleAnalytics_bm_data(self.campaign_path, view, campaigns, start_date, end_date)
+        self.bm_googleAnalytics = get_connector('GoogleAnalyticsBM')(view, campaigns, start_date, end_date)
     
     def get_cm_googleAnalytics(self, view, campaigns, start_date, end_date):
-        self.cm_googleAnalytics = get_googleAnalytics_cm_data(self.campaign_path, view, campaigns, start_date, end_date)
+        self.cm_googleAnalytics = get_connector('GoogleAnalyticsCM')(view, campaigns, start_date, end_date)
 
 # def main():
 
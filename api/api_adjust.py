@@ -1,11 +1,35 @@
-import requests
 import os
 import json
 
 import pandas as pd
 
+import archive
+import http_client
+
 def get_adjust(start_date: str, end_date: str) -> pd.DataFrame:
 
+    with archive.context('Adjust', 'report', start_date, end_date):
+        report = archive.raw('report', lambda: request_report(start_date, end_date))
+
+    adjust = pd.DataFrame(report['rows'])
+    df = adjust[adjust['campaign_network'].str.contains('LL')].sort_values('day')
+
+    df.drop(columns = 'attr_dependency', inplace = True)
+
+    df.rename(columns = {column:column.replace('_network', '') for column in df.columns if '_network' in column}, inplace = True)
+    df.rename(columns = {'day': 'date'}, inplace = True)
+
+    number_int = ['impressions', 'clicks', 'installs', 'sessions', 'reattributions']
+    number_float = ['click_conversion_rate', 'impression_conversion_rate']
+
+    df[number_int] = df[number_int].astype(int)
+    df[number_float] = df[number_float].astype(float)
+    df['date'] = pd.to_datetime(df['date'])
+
+    return df
+
+def request_report(start_date: str, end_date: str) -> dict:
+
     credentials_path = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tokens', 'adjust_credentials.json'))
 
     with open(credentials_path, 'r') as f:
@@ -46,25 +70,11 @@ def get_adjust(start_date: str, end_date: str) -> pd.DataFrame:
         'cost_mode': 'network'
     }
 
-    response = requests.get(
+    response = http_client.get(
         url = 'https://dash.adjust.com/control-center/reports-service/report', 
         headers = {'Authorization': f'Bearer {api_token}'},
-        params = params
+        params = params,
+        platform = 'Adjust'
         )
 
-    adjust = pd.DataFrame(response.json()['rows'])
-    df = adjust[adjust['campaign_network'].str.contains('LL')].sort_values('day')
-
-    df.drop(columns = 'attr_dependency', inplace = True)
-
-    df.rename(columns = {column:column.replace('_network', '') for column in df.columns if '_network' in column}, inplace = True)
-    df.rename(columns = {'day': 'date'}, inplace = True)
-
-    number_int = ['impressions', 'clicks', 'installs', 'sessions', 'reattributions']
-    number_float = ['click_conversion_rate', 'impression_conversion_rate']
-
-    df[number_int] = df[number_int].astype(int)
-    df[number_float] = df[number_float].astype(float)
-    df['date'] = pd.to_datetime(df['date'])
-
-    return df
\ No newline at end of file
+    return response.json()
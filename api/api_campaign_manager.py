@@ -1,7 +1,6 @@
 from fileinput import filename
 import os
 import time
-import random
 import io
 import json
 
@@ -15,25 +14,37 @@ from datetime import timedelta
 
 import pandas as pd
 
+import retry
+import token_store
+import lookup_cache
+
 # LINK DOCUMENTAÇÃO
 # https://github.com/googleads/googleads-dfa-reporting-samples/tree/master/python/v3_5
 
-# As variáveis a seguir controlam o comportamento de tentativas enqaunto o relatório está sendo processado.
-# Mínimo de tempo entre requerimentos. Padrão de 10 segundos.
-MIN_RETRY_INTERVAL = 10
-# Máximo tempo entre requerimentos. Padrão de 1 minuto.
-MAX_RETRY_INTERVAL = 1 * 60
-# Máximo de tempo passando fazendo requerimentos. Padrão de 5 minutos.
-MAX_RETRY_ELAPSED_TIME = 5 * 60
+# Os intervalos de espera enquanto o relatório é processado ficam em retry.POLL_POLICIES['CampaignManager'].
 
 # Tamanho do chunk quando tiver fazendo download do relatório. Padrão 32MB.
 CHUNK_SIZE = 32 * 1024 * 1024
 
 def get_google_credentials() -> Credentials:
     '''Confirma / atualiza as credenciais de OAuth 2.0 para utilização das APIs.'''
+
+    # As credenciais são carregadas uma vez por processo e só renovadas quando o token expira.
+    credentials = token_store.shared('CampaignManager', load_google_credentials)
+
+    if not credentials.valid:
+        with token_store.file_lock('google_credentials.json'):
+            if not credentials.valid:
+                credentials.refresh(Request())
+                token_store.write_text('google_credentials.json', credentials.to_json())
+
+    return credentials
+
+def load_google_credentials() -> Credentials:
+    '''Lê as credenciais salvas ou, sem elas, faz a autorização pelo navegador.'''
    
-    secrets_path =  os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tokens', 'google_secret.json'))
-    credentials_path =  os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tokens', 'google_credentials.json'))
+    secrets_path = token_store.token_path('google_secret.json')
+    credentials_path = token_store.token_path('google_credentials.json')
 
     scopes = ['https://www.googleapis.com/auth/dfareporting', 
             'https://www.googleapis.com/auth/ddmconversions',
@@ -44,14 +55,10 @@ def get_google_credentials() -> Credentials:
     if os.path.exists(credentials_path):
         credentials = Credentials.from_authorized_user_file(credentials_path, scopes)
 
-    if not credentials or not credentials.valid:
-        if credentials and credentials.expired and credentials.refresh_token:
-            credentials.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(secrets_path, scopes)
-            credentials = flow.run_local_server()
-        with open(credentials_path, 'w') as token:
-                token.write(credentials.to_json())
+    if not credentials or (not credentials.valid and not (credentials.expired and credentials.refresh_token)):
+        flow = InstalledAppFlow.from_client_secrets_file(secrets_path, scopes)
+        credentials = flow.run_local_server()
+        token_store.write_text('google_credentials.json', credentials.to_json())
 
     return credentials
 
@@ -68,7 +75,12 @@ def start_service(credentials: Credentials):
 def get_profileId(service) -> str:
     '''Extrai o ID de perfil da conta, necessário para quase todas as operações.'''
 
-    userProfile = service.userProfiles().list().execute()
+    userProfile = lookup_cache.cached(
+        'CampaignManager',
+        'userProfiles',
+        lambda: retry.call_api('CampaignManager', '', lambda: service.userProfiles().list().execute()),
+        valid = lambda userProfile: bool(userProfile.get('items'))
+        )
     profile_id = userProfile['items'][0]['profileId']
 
     return profile_id
@@ -156,8 +168,8 @@ def add_filters(service, report, profile_id, campaign_list):
         'Google Ads: Display Remarketing', 'Google Ads', 'Instagram BR', 'Linkedin', 'Tik Tok BR'
     ]
 
-    sources = service.dimensionValues().query(profileId = profile_id, body = source_filter_request).execute()
-    campaigns = service.dimensionValues().query(profileId = profile_id, body = campaign_filter_request).execute()
+    sources = retry.call_api('CampaignManager', profile_id, lambda: service.dimensionValues().query(profileId = profile_id, body = source_filter_request).execute())
+    campaigns = retry.call_api('CampaignManager', profile_id, lambda: service.dimensionValues().query(profileId = profile_id, body = campaign_filter_request).execute())
 
     campaign_filter = [campaign for campaign in campaigns['items'] if campaign['value'] in campaign_list]
     source_filter = [source for source in sources['items'] if source['value'] not in exclude_sources]
@@ -169,44 +181,33 @@ def add_filters(service, report, profile_id, campaign_list):
 
 def create_report(service, report, profile_id):
     '''Cria o relatório no CM.'''
-    return service.reports().insert(profileId = profile_id, body = report).execute()
-
-def next_sleep_interval(previous_sleep_interval):
-  """Calcula o próximo intervalo de silêncio baseado no anterior."""
-
-  min_interval = previous_sleep_interval or MIN_RETRY_INTERVAL
-  max_interval = previous_sleep_interval * 3 or MIN_RETRY_INTERVAL
-  return min(MAX_RETRY_INTERVAL, random.randint(min_interval, max_interval))
-
+    return retry.call_api('CampaignManager', profile_id, lambda: service.reports().insert(profileId = profile_id, body = report).execute(), idempotent = False)
 
 def run_report(service, profile_id, report_id):
     '''Executa o relatório.'''
     
-    report_file = service.reports().run(profileId = profile_id, reportId = report_id).execute()
+    report_file = retry.call_api('CampaignManager', profile_id, lambda: service.reports().run(profileId = profile_id, reportId = report_id).execute(), idempotent = False)
     file_id = report_file['id']
 
-    sleep = 0
-    start_time = time.time()
-    
-    while True:
-        
-        report_file = service.files().get(reportId = report_id, fileId = file_id).execute()
-
-        status = report_file['status']
-
-        if status == 'REPORT_AVAILABLE':
-            print(f'[{status}] Relatório pronto pra download!')
-            return report_file
-        elif status != 'PROCESSING':
-            print(f'[{status}] Processo falhou!')
-            return
-        elif time.time() - start_time > MAX_RETRY_ELAPSED_TIME:
-            print('Tempo de processamento ultrapassou o limite')
-            return
-        
-        sleep = next_sleep_interval(sleep)
-        print(f'[{status}] Dormindo por {sleep} segundos.')
-        time.sleep(sleep)
+    try:
+        report_file = retry.poll(
+            'CampaignManager',
+            lambda: retry.call_api('CampaignManager', profile_id, lambda: service.files().get(reportId = report_id, fileId = file_id).execute()),
+            lambda report_file: report_file['status'] != 'PROCESSING',
+            lambda report_file: report_file['status']
+            )
+    except retry.PollTimeout:
+        print('Tempo de processamento ultrapassou o limite')
+        return
+
+    status = report_file['status']
+
+    if status == 'REPORT_AVAILABLE':
+        print(f'[{status}] Relatório pronto pra download!')
+        return report_file
+
+    print(f'[{status}] Processo falhou!')
+    return
 
 
 def download_report(campaign_path, service, report_file):
@@ -225,7 +226,7 @@ def download_report(campaign_path, service, report_file):
 
     download_finished = False
     while not download_finished:
-        _, download_finished = downloader.next_chunk()
+        _, download_finished = retry.call('CampaignManager', downloader.next_chunk)
 
     return
 
@@ -2,57 +2,125 @@
 from facebook_business.api import FacebookAdsApi
 from facebook_business.adobjects.adaccount import AdAccount
 from facebook_business.adobjects.adreportrun import AdReportRun
-from facebook_business.adobjects.adcreative import AdCreative
-from facebook_business.adobjects.ad import Ad
 
 
 import pandas as pd
+import numpy as np
 
 import os
 import json
-import requests
 import time
 import datetime
 
+from concurrent.futures import ThreadPoolExecutor
+from date_coverage import split_window
+
+import archive
+import column_buffers
+import entity_store
+import lookup_cache
+import rate_limit
+import retry
+import http_client
+import token_store
+
+# Validade do token longo quando a troca não informa expires_in.
+TOKEN_LIFETIME = 60 * 24 * 60 * 60
+
+GRAPH_URL = 'https://graph.facebook.com/v13.0'
+
+# Ids (criativos, anúncios) pedidos por chamada (?ids=, limite de 50 da Graph API) e lotes buscados ao mesmo tempo.
+IDS_BATCH_SIZE = 50
+MAX_PARALLEL_BATCHES = 4
+
+# Códigos de erro da Graph API para um id inválido ou inacessível: só eles fazem o lote ser pedido id a id.
+INVALID_ID_CODES = {100}
+
+# Períodos longos viram vários relatórios assíncronos de até INSIGHTS_WINDOW_DAYS dias, rodando em paralelo.
+INSIGHTS_WINDOW_DAYS = 90
+
+# Tentativas de cada janela; uma janela que falha é dividida ao meio e pedida de novo.
+MAX_WINDOW_ATTEMPTS = 3
+
+# Linhas do resultado de insights pedidas por página; o resultado é lido página a página direto para as colunas.
+INSIGHTS_PAGE_SIZE = 500
+
+# Tipo de cada campo dos insights nas colunas (column_buffers.py); os demais (ids, listas de ações) ficam como objetos.
+INSIGHTS_TYPES = {
+    'impressions': 'int',
+    'clicks': 'int',
+    'inline_post_engagement': 'int',
+    'spend': 'float',
+    'account_name': 'category',
+    'campaign_name': 'category',
+    'adset_name': 'category',
+    'ad_name': 'category',
+    'objective': 'category',
+    'publisher_platform': 'category',
+    'date_start': 'category',
+    'date_stop': 'category'
+}
+
+# Status finais de um relatório assíncrono de insights.
+JOB_FINISHED = ['Job Completed', 'Job Failed', 'Job Skipped']
+
+
+class InsightsJobFailed(Exception):
+    '''Relatório assíncrono de insights que terminou sem os dados.'''
+
+
+class FacebookGraphError(Exception):
+    '''Erro da Graph API em uma chamada feita fora do SDK (ex.: token vencido).'''
+
+
 def get_credentials() -> dict:
-    '''Carrega e atualiza as credenciais.'''
+    '''Carrega as credenciais, renovando o token longo só quando está perto de expirar.'''
 
-    credentials_path = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tokens', 'facebook_credentials.json'))
-    with open(credentials_path, 'r') as f:
-        credentials = json.load(f)
+    return token_store.get('facebook_credentials.json', refresh = exchange_token)
 
-    app_id = credentials['app_id']
-    app_secret = credentials['app_secret']
-    access_token = credentials['access_token']
+def exchange_token(credentials: dict) -> dict:
+    '''Troca o token longo atual por um novo.'''
 
     params = {
         'grant_type': 'fb_exchange_token',
-        'client_id': app_id,
-        'client_secret': app_secret,
-        'fb_exchange_token': access_token
+        'client_id': credentials['app_id'],
+        'client_secret': credentials['app_secret'],
+        'fb_exchange_token': credentials['access_token']
     }
 
     url = f'https://graph.facebook.com/v13.0/oauth/access_token'
-    new_access_token = requests.get(url, params = params).json()['access_token']
-    credentials['access_token'] = new_access_token
+    response = http_client.get(url, params = params, platform = 'Facebook').json()
 
-    with open(credentials_path, 'w') as f:
-        json.dump(credentials, f)
-
-    return credentials
+    return {
+        'access_token': response['access_token'],
+        'expires_at': time.time() + response.get('expires_in', TOKEN_LIFETIME)
+    }
 
 def facebook_init(credentials: dict) -> None:
-    '''Inicia a sessão com a API do faceobok.'''
+    '''
+    Inicia a sessão com a API do faceobok. Cada requisição http do SDK (inclusive cada página de um cursor)
+    passa pelo limite de chamadas da conta e informa o uso da cota pelos cabeçalhos da resposta (rate_limit.py).
+    '''
+
+    api = FacebookAdsApi.init(credentials['app_id'], credentials['app_secret'], credentials['access_token'])
 
-    FacebookAdsApi.init(credentials['app_id'], credentials['app_secret'], credentials['access_token'])
+    sdk_call = api.call
+    api.call = lambda *args, **kwargs: rate_limit.call_in_scope('Facebook', lambda: sdk_call(*args, **kwargs))
 
     return
 
 def get_accounts_ids(ad_accounts: list, credentials) -> list:
     '''Pega os ids das contas que serão utilizadas para montagem da base.'''
     
-    access_token = credentials['access_token']
-    response = requests.get(f'https://graph.facebook.com/v13.0/me/adaccounts?fields=name&limit=60&access_token={access_token}').json()
+    access_token = credentials['access_token'] if credentials else ''
+    names = {x.lower() for x in ad_accounts}
+
+    response = archive.raw('adaccounts', lambda: lookup_cache.cached(
+        'Facebook',
+        'me/adaccounts',
+        lambda: http_client.get(f'https://graph.facebook.com/v13.0/me/adaccounts?fields=name&limit=60&access_token={access_token}', platform = 'Facebook').json(),
+        valid = lambda response: names <= {account['name'].lower() for account in response.get('data', [])}
+        ))
 
     all_accounts = response['data']
     all_accounts = pd.DataFrame(all_accounts)
@@ -66,18 +134,9 @@ def init_account(account_id: str) -> AdAccount:
 
     return AdAccount(account_id)
 
-def get_analytics(account: AdAccount, init_date: str, end_date: str) -> pd.DataFrame:
-    '''
-    Faz o requerimento do relatório de insights para a API do Facebook.
-    - entradas: 
-        - objeto da conta do Facebook Ads
-        - data inical dos dados a serem coletados
-        - data final dos dados a serem coletados
+def insights_params(init_date: str, end_date: str) -> dict:
+    '''Parâmetros do relatório de insights por anúncio, dia e plataforma.'''
 
-    - saídas:
-        - dataframe do dados de métricas nos dias selecionados
-    '''
-    
     fields = [
         'created_time',
         'account_name',
@@ -111,26 +170,214 @@ def get_analytics(account: AdAccount, init_date: str, end_date: str) -> pd.DataF
         'action_breakdown': ['action_type']
     }
 
-    i_async_job = account.get_insights(params = params, is_async = True)
+    return params
 
-    while True:
-        job = i_async_job.api_get()
-        time.sleep(40) # Colocar condição para mudar o tempo dependendo da quantidade de dias para pegar os dados
-        if job:
-            break
-    
-    df = pd.DataFrame(i_async_job.get_result())
 
-    if df.empty:
-        return df
+class InsightsJobs:
+    '''
+    Relatórios assíncronos de insights de várias contas, criados todos de uma vez e acompanhados juntos.
+    - períodos longos são divididos em janelas de até INSIGHTS_WINDOW_DAYS dias, uma por relatório
+    - cada relatório é baixado assim que termina, sem esperar os demais
+    - uma janela que falha é pedida de novo sozinha (dividida ao meio), sem recomeçar o período inteiro
+    - o intervalo entre as consultas segue a estimativa de término pelo async_percent_completion,
+      dentro de retry.POLL_POLICIES['Facebook']
+    '''
 
-    df.drop(df[df['publisher_platform'] == 'unknown'].index, inplace = True)
-    df.reset_index(drop = True, inplace = True)
+    def __init__(self):
+        self.jobs = []
+        self.accounts = {}
 
-    return df
+    def submit(self, account: AdAccount, init_date: str, end_date: str) -> None:
+
+        start = datetime.datetime.strptime(init_date, '%Y-%m-%d').date()
+        end = datetime.datetime.strptime(end_date, '%Y-%m-%d').date()
+
+        # No replay valem as janelas da gravação, que podem ter outro tamanho ou ter sido divididas ao meio.
+        windows = (self.recorded_windows(account) if archive.is_replay() else None) or split_window(start, end, INSIGHTS_WINDOW_DAYS)
+
+        self.accounts[account['id']] = {'account': account, 'windows': {}, 'open': 0}
+
+        for window_start, window_end in windows:
+            # Um período que cabe em um relatório mantém o nome de antes no arquivo de respostas.
+            name = f'insights_{account["id"]}' if len(windows) == 1 else None
+            self.submit_window(account, window_start, window_end, 1, name)
+
+        return
+
+    def recorded_windows(self, account: AdAccount) -> list:
+        '''Janelas baixadas na gravação da conta, ou None em gravações anteriores à lista de janelas.'''
+
+        try:
+            windows = archive.raw(f'insights_{account["id"]}_windows', lambda: None)
+        except archive.ArchiveMissing:
+            return None
+
+        if not windows:
+            return None
+
+        return [tuple(datetime.datetime.strptime(day, '%Y-%m-%d').date() for day in window) for window in windows]
+
+    def submit_window(self, account: AdAccount, window_start: datetime.date, window_end: datetime.date, attempt: int, name: str = None) -> None:
+
+        job = {
+            'account': account,
+            'window': (window_start, window_end),
+            'attempt': attempt,
+            'name': name or f'insights_{account["id"]}_{window_start}_{window_end}',
+            'run': None,
+            'submitted_at': time.monotonic()
+        }
+
+        # No replay as linhas vêm do arquivo de respostas e nenhum relatório é criado.
+        if not archive.is_replay():
+            params = insights_params(window_start.strftime('%Y-%m-%d'), window_end.strftime('%Y-%m-%d'))
+            job['run'] = retry.call_sdk('Facebook', account['id'], lambda: account.get_insights(params = params, is_async = True), idempotent = False)
+
+        self.jobs.append(job)
+        self.accounts[account['id']]['open'] += 1
+
+        return
+
+    def resubmit(self, job: dict, status: str) -> None:
+        '''Pede de novo uma janela que falhou, dividida ao meio (relatórios grandes demais falham).'''
+
+        account = job['account']
+        window_start, window_end = job['window']
+
+        if job['attempt'] >= MAX_WINDOW_ATTEMPTS:
+            raise InsightsJobFailed(f"Relatório de insights da conta {account['id']} de {window_start} até {window_end} terminou com status {status}")
+
+        print(f"{job['name']}: {status}, pedindo de novo (tentativa {job['attempt'] + 1} de {MAX_WINDOW_ATTEMPTS})")
+
+        days = (window_end - window_start).days + 1
+        for half_start, half_end in split_window(window_start, window_end, (days + 1) // 2):
+            self.submit_window(account, half_start, half_end, job['attempt'] + 1)
+
+        return
+
+    def download(self, job: dict) -> column_buffers.ColumnBuffers:
+        '''
+        Lê o resultado página a página (INSIGHTS_PAGE_SIZE linhas por chamada) direto para as colunas tipadas,
+        então só uma página de objetos do SDK fica em memória. Com o arquivo de respostas ligado as linhas
+        cruas são guardadas (ou lidas, no replay) inteiras.
+        '''
+
+        def rows():
+            return (row.export_all_data() for row in job['run'].get_result(params = {'limit': INSIGHTS_PAGE_SIZE}))
+
+        if archive.is_active():
+            return insights_columns(archive.raw(job['name'], lambda: retry.call_sdk('Facebook', job['account']['id'], lambda: list(rows()))))
+
+        return retry.call_sdk('Facebook', job['account']['id'], lambda: insights_columns(rows()))
+
+    def next_interval(self, job: dict, percent: float, previous: int) -> int:
+        '''Espera até a próxima consulta: o tempo que falta pela velocidade do relatório até agora, ou espera crescente sem progresso.'''
+
+        min_interval, max_interval, _ = retry.POLL_POLICIES['Facebook']
+
+        if not percent:
+            return retry.next_sleep_interval(previous, min_interval, max_interval)
+
+        elapsed = time.monotonic() - job['submitted_at']
+
+        return int(min(max_interval, max(min_interval, elapsed * (100 - percent) / percent)))
+
+    def finish(self, job: dict, columns: column_buffers.ColumnBuffers):
+        '''Guarda as colunas da janela e retorna (conta, dataframe de todas as janelas em ordem de data) quando a conta termina.'''
+
+        account = self.accounts[job['account']['id']]
+        account['windows'][job['window']] = columns
+        account['open'] -= 1
+
+        if account['open']:
+            return None
+
+        # A lista de janelas baixadas vai para o arquivo de respostas: o replay não depende de INSIGHTS_WINDOW_DAYS.
+        if archive.is_active() and not archive.is_replay():
+            archive.raw(f'insights_{job["account"]["id"]}_windows', lambda: [[str(start), str(end)] for start, end in sorted(account['windows'])])
+
+        return account['account'], column_buffers.concat([account['windows'][window].frame() for window in sorted(account['windows'])])
+
+    def completed(self):
+        '''Percorre (conta, dataframe do relatório) na ordem em que as contas terminam.'''
+
+        _, _, max_elapsed = retry.POLL_POLICIES['Facebook']
+
+        start_time = time.monotonic()
+        sleep = 0
+
+        while self.jobs:
+            intervals = []
+
+            for job in list(self.jobs):
+                finished = None
+
+                if job['run'] is None:
+                    self.jobs.remove(job)
+                    finished = self.finish(job, self.download(job))
+
+                else:
+                    run = retry.call_sdk('Facebook', job['account']['id'], job['run'].api_get)
+                    status = run[AdReportRun.Field.async_status]
+                    percent = run[AdReportRun.Field.async_percent_completion]
+
+                    if status == 'Job Completed':
+                        self.jobs.remove(job)
+                        finished = self.finish(job, self.download(job))
+
+                    elif status in JOB_FINISHED:
+                        self.jobs.remove(job)
+                        self.accounts[job['account']['id']]['open'] -= 1
+                        self.resubmit(job, status)
+
+                    else:
+                        print(f"[{status} {percent}%] {job['name']}")
+                        intervals.append(self.next_interval(job, percent, sleep))
+
+                if finished:
+                    yield finished
+
+            if not intervals:
+                continue
+
+            if time.monotonic() - start_time > max_elapsed:
+                raise retry.PollTimeout(f'Facebook: tempo de processamento ultrapassou {max_elapsed}s')
+
+            sleep = min(intervals)
+            print(f'Dormindo por {sleep} segundos.')
+            time.sleep(sleep)
+
+
+def insights_columns(rows) -> column_buffers.ColumnBuffers:
+    '''Linhas do relatório de insights nas colunas tipadas (INSIGHTS_TYPES), sem as linhas de plataforma desconhecida.'''
+
+    columns = column_buffers.ColumnBuffers(INSIGHTS_TYPES)
+
+    return columns.extend(row for row in rows if row.get('publisher_platform') != 'unknown')
+
+def get_analytics(account: AdAccount, init_date: str, end_date: str) -> pd.DataFrame:
+    '''
+    Faz o requerimento do relatório de insights para a API do Facebook.
+    - entradas: 
+        - objeto da conta do Facebook Ads
+        - data inical dos dados a serem coletados
+        - data final dos dados a serem coletados
+
+    - saídas:
+        - dataframe do dados de métricas nos dias selecionados
+    '''
+
+    jobs = InsightsJobs()
+    jobs.submit(account, init_date, end_date)
+
+    return column_buffers.concat([df for _, df in jobs.completed()])
 
 def fix_actions(df: pd.DataFrame) -> pd.DataFrame:
-    '''Transforma a coluna actions do dataframe nas colunas respectivas de cada ação.'''
+    '''
+    Transforma a coluna actions do dataframe nas colunas respectivas de cada ação.
+    As listas de ações de todas as linhas são achatadas de uma vez e espalhadas em uma matriz (linha x action_type),
+    na ordem em que cada action_type aparece. Linhas sem lista de ações ficam com no_value = ''.
+    '''
 
     video_columns = [
         'video_p25_watched_actions',
@@ -150,40 +397,104 @@ def fix_actions(df: pd.DataFrame) -> pd.DataFrame:
         if column not in df.columns:
             df[column] = 0
         else:
-            df.loc[~df[column].isna(), column] = df.loc[~df[column].isna(), column].str[0].str['value']
+            filled = df[column].notna()
+            df.loc[filled, column] = pd.Series([actions[0].get('value') if len(actions) else None for actions in df.loc[filled, column]], index = df.index[filled], dtype = object)
 
-    df.fillna(0, inplace = True)
+    # As colunas categóricas dos insights (nomes, datas) não têm valores ausentes e não aceitam o 0.
+    filled = df.select_dtypes(exclude = 'category').columns
+    df[filled] = df[filled].fillna(0)
     df.rename(columns = dict(zip(video_columns, video_name)), inplace = True)
 
-    actions_dict = {}
-    actions_list = []
+    actions = df['actions'].to_numpy()
+    has_list = np.fromiter((isinstance(value, list) for value in actions), dtype = bool, count = len(actions))
+    lists = actions[has_list]
 
-    for _, row in df.iterrows():
-        if isinstance(row['actions'], list):
-            for action in row['actions']:
-                actions_dict[action['action_type']] = action['value']
-            actions_list.append(actions_dict)
-            actions_dict = {}
-        else:
-            actions_list.append({'no_value': ''})
+    # Uma posição por ação: linha do df, código do action_type (ordem de aparição) e valor.
+    rows = np.repeat(np.flatnonzero(has_list), [len(value) for value in lists])
+    flat = [action for value in lists for action in value]
+    codes, action_types = pd.factorize(pd.Series([action['action_type'] for action in flat], dtype = object))
+    values = np.array([action['value'] for action in flat], dtype = object)
+
+    # Ação repetida na mesma linha: vale o último valor.
+    positions = rows * len(action_types) + codes
+    last = ~pd.Series(positions).duplicated(keep = 'last').to_numpy()
+
+    matrix = np.full((len(actions), len(action_types)), 0, dtype = object)
+    matrix[rows[last], codes[last]] = values[last]
 
-    actions_df = pd.DataFrame(actions_list).fillna(0)
+    actions_df = pd.DataFrame(matrix, columns = list(action_types))
+
+    # no_value entra na posição em que apareceria pela primeira vez, entre os action_types.
+    if not has_list.all():
+        no_value = np.full(len(actions), 0, dtype = object)
+        no_value[~has_list] = ''
+
+        first_rows = rows[np.unique(codes, return_index = True)[1]]
+        actions_df.insert(int(np.searchsorted(first_rows, np.argmin(has_list))), 'no_value', no_value)
 
     fixed_df = pd.concat([df, actions_df], axis = 1)
 
     return fixed_df
 
 
-def get_creatives(df: pd.DataFrame, account: AdAccount) -> pd.DataFrame:
+def get_batch(ids: list, fields: list, access_token: str, account_id: str) -> list:
+    '''Campos de até IDS_BATCH_SIZE objetos (criativos, anúncios) em uma chamada (?ids=), no mesmo formato do api_get de cada um.'''
 
-    
+    params = {
+        'ids': ','.join(ids),
+        'fields': ','.join(fields),
+        'access_token': access_token
+    }
+
+    response = http_client.get(f'{GRAPH_URL}/', params = params, platform = 'Facebook', account = account_id).json()
+
+    if 'error' not in response:
+        return list(response.values())
+
+    # Só um id inválido ou inacessível (código 100) justifica pedir os ids do lote um a um; excesso de chamadas
+    # é pausado e repetido em rate_limit.call, e token vencido ou outros erros interrompem a coleta.
+    if response['error'].get('code') not in INVALID_ID_CODES:
+        raise FacebookGraphError(f"Erro da Graph API ao buscar ids da conta {account_id}: {response['error']}")
+
+    if len(ids) == 1:
+        print(f"Id {ids[0]} não encontrado: {response['error'].get('message', '')}")
+        return []
+
+    return [item for id in ids for item in get_batch([id], fields, access_token, account_id)]
+
+def get_by_ids(ids: list, fields: list, account_id: str) -> dict:
+    '''
+    Objetos da Graph API pelos ids, em lotes de IDS_BATCH_SIZE com até MAX_PARALLEL_BATCHES lotes ao mesmo tempo.
+    - entradas:
+        - ids e campos pedidos
+        - id da conta (limite de chamadas)
+
+    - saídas:
+        - {id: objeto}; ids que a plataforma não devolveu ficam de fora
+    '''
+
+    batches = [ids[start:start + IDS_BATCH_SIZE] for start in range(0, len(ids), IDS_BATCH_SIZE)]
+    access_token = get_credentials()['access_token']
+
+    with ThreadPoolExecutor(max_workers = MAX_PARALLEL_BATCHES) as executor:
+        results = executor.map(lambda batch: get_batch(batch, fields, access_token, account_id), batches)
+
+        return {item['id']: item for result in results for item in result}
+
+def get_creatives(df: pd.DataFrame, account: AdAccount) -> pd.DataFrame:
 
     ads_dict = {
         'ad_id': [],
         'creative_id': []
     }
 
-    ads = account.get_ads(fields = [Ad.Field.creative])
+    store = entity_store.get_store()
+
+    # Anúncio -> criativo só dos anúncios que aparecem nos insights: os que não estão no banco de entidades
+    # (ou venceram) são pedidos pelos ids, sem listar todos os anúncios da conta.
+    # O arquivo de respostas guarda todos os ids pedidos, para que o replay não dependa do banco de entidades.
+    ad_ids = list(df['ad_id'].unique())
+    ads = archive.raw(f'ads_{account["id"]}', lambda: list(store.fetch('Facebook', 'ad', ad_ids, lambda ids: get_by_ids(ids, ['creative'], account['id'])).values()))
 
     for ad in ads:
         ads_dict['ad_id'].append(ad['id'])
@@ -209,7 +520,7 @@ def get_creatives(df: pd.DataFrame, account: AdAccount) -> pd.DataFrame:
         'object_url'
     ]
 
-    creatives = [dict(AdCreative(creative).api_get(fields = creative_fields)) for creative in creative_ids]
+    creatives = archive.raw(f'creatives_{account["id"]}', lambda: list(store.fetch('Facebook', 'creative', creative_ids, lambda ids: get_by_ids(ids, creative_fields, account['id'])).values()))
 
     creative_dict = {
         'creative_id': [],
@@ -261,8 +572,13 @@ def get_creatives(df: pd.DataFrame, account: AdAccount) -> pd.DataFrame:
     return df
 
 def fix_types(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Converte as colunas para os tipos finais. As métricas que já vêm tipadas dos insights (int64, float64)
+    não são convertidas de novo; as categóricas viram texto, como as demais colunas de texto.
+    '''
 
-    df.fillna('', inplace = True)
+    filled = df.select_dtypes(exclude = 'category').columns
+    df[filled] = df[filled].fillna('')
 
     numeric_float = ['cost']   
 
@@ -271,18 +587,23 @@ def fix_types(df: pd.DataFrame) -> pd.DataFrame:
         'adset_name', 'campaign_id', 'campaign_name', 'creative_id', 
         'post_id', 'destination_url', 'media_url', 'objective',
         'post_text', 'object_type', 'source', 'source_url',
-        'medium', 'campaign', 'content'
+        'medium', 'campaign', 'content', 'publisher_platform'
         ] 
 
     date = ['date']
 
-    numeric_int = [column for column in df.columns if column not in (numeric_float + strings + date)]
+    numeric_int = [column for column in df.columns if column not in (numeric_float + strings + date) and not pd.api.types.is_integer_dtype(df[column])]
+    numeric_float = [column for column in numeric_float if not pd.api.types.is_float_dtype(df[column])]
 
-    df[numeric_int] = df[numeric_int].astype(int)
-    df[numeric_float] = df[numeric_float].astype(float)
+    if numeric_int:
+        df[numeric_int] = df[numeric_int].astype(int)
+    if numeric_float:
+        df[numeric_float] = df[numeric_float].astype(float)
     df[strings] = df[strings].astype(str)
 
-    df['date'] = pd.to_datetime(df['date'], format = '%Y-%m-%d')
+    # O to_datetime de uma coluna categórica devolveria outra coluna categórica.
+    dates = df['date'].astype(str) if isinstance(df['date'].dtype, pd.CategoricalDtype) else df['date']
+    df['date'] = pd.to_datetime(dates, format = '%Y-%m-%d')
 
     return df
 
@@ -315,8 +636,9 @@ def manipulate_dataframe(df: pd.DataFrame) -> pd.DataFrame:
 
     df = pd.concat([df, no_content], axis = 0, ignore_index = True)
 
+    # publisher_platform fica na base: facebook, audience_network e messenger viram todos source 'fb',
+    # e só com a plataforma a linha de um anúncio em um dia é única (chave do warehouse).
     columns_to_drop = [
-        'publisher_platform', 
         'message', 
         'thumbnail_url', 
         'clicks', 
@@ -349,31 +671,40 @@ def manipulate_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 def get_facebook(accounts: list, start_date: str, end_date: str) -> pd.DataFrame:
-    
-    credentials = get_credentials()
 
-    facebook_init(credentials)
+    with archive.context('Facebook', accounts, start_date, end_date):
+        return get_facebook_data(accounts, start_date, end_date)
 
-    accounts_ids = get_accounts_ids(accounts, credentials)
+def get_facebook_data(accounts: list, start_date: str, end_date: str) -> pd.DataFrame:
+
+    # No replay do arquivo de respostas não há chamadas de rede, então não é preciso renovar o token.
+    credentials = None
 
-    df_list = []
+    if not archive.is_replay():
+        credentials = get_credentials()
+        facebook_init(credentials)
+
+    accounts_ids = get_accounts_ids(accounts, credentials)
 
+    # Os relatórios de todas as contas são criados de uma vez; cada conta é tratada assim que o seu termina.
+    jobs = InsightsJobs()
     for id in accounts_ids:
+        jobs.submit(init_account(id), start_date, end_date)
 
-        account = init_account(id)
-        analytics_df = get_analytics(account, start_date, end_date)
+    df_dict = {}
 
+    for account, analytics_df in jobs.completed():
         if analytics_df.empty:
             print('Não há novos dados em Facebook.')
-            df_list.append(analytics_df)
+            df_dict[account['id']] = analytics_df
 
         else:
             fixed_df = fix_actions(analytics_df)
             df_creatives = get_creatives(fixed_df, account)
             clean_df = manipulate_dataframe(df_creatives)
-            df_list.append(clean_df)    
+            df_dict[account['id']] = clean_df
 
-    facebook_df = pd.concat(df_list)
+    facebook_df = pd.concat([df_dict[id] for id in accounts_ids])
 
     return facebook_df
 
@@ -5,6 +5,11 @@ import os
 import numpy as np
 import pandas as pd
 
+import archive
+import token_store
+import lookup_cache
+import retry
+
 def start_service() -> GoogleAdsClient:
 
     google_ads_token = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tokens', 'google-ads.yaml'))
@@ -22,19 +27,27 @@ def get_accounts_ids(service: GoogleAdsClient, ad_accounts: list) -> list:
         FROM customer_client
         WHERE customer_client.level <= 1"""
 
-    stream = service.search_stream(customer_id = '4157458866', query = query)
+    def fetch_accounts():
+        stream = service.search_stream(customer_id = '4157458866', query = query)
+
+        accounts_dict = {
+            'name': [],
+            'id': [] 
+            }
 
-    accounts_dict = {
-        'name': [],
-        'id': [] 
-        }
+        for batch in stream:
+            for row in batch.results:
+                accounts_dict['name'].append(row.customer_client.descriptive_name)
+                accounts_dict['id'].append(row.customer_client.id)
 
-    for batch in stream:
-        for row in batch.results:
-            accounts_dict['name'].append(row.customer_client.descriptive_name)
-            accounts_dict['id'].append(row.customer_client.id)
+        return accounts_dict
 
-    accounts = pd.DataFrame(accounts_dict)
+    accounts = pd.DataFrame(archive.raw('accounts', lambda: lookup_cache.cached(
+        'GoogleAds',
+        'customer_client/4157458866',
+        lambda: retry.call_api('GoogleAds', '', fetch_accounts),
+        valid = lambda accounts: set(ad_accounts) <= set(accounts['name'])
+        )))
     accounts['id'] = accounts['id'].astype(str)
 
     accounts_ids = list(accounts.loc[accounts['name'].isin(ad_accounts), 'id'].unique())
@@ -75,53 +88,59 @@ def get_report(service: GoogleAdsClient, ad_accounts: list, start_date: str, end
         WHERE segments.date BETWEEN '{start_date}' AND '{end_date}'
         """
 
-        stream = service.search_stream(customer_id = account_id, query = query)
-
-        report = {
-            'account_name': [],
-            'campaign_id': [],
-            'campaign': [],
-            'adset_id': [],
-            'adset_name': [],
-            'ad_name': [],
-            'ad_id': [],
-            'destination_url': [],
-            'content': [],
-            'impressions': [],
-            'post_engagement': [],
-            'date': [],
-            'clicks': [],
-            'cost': [],
-            'results': [],
-            'video_views': [],
-            'w25_views': [],
-            'w50_views': [],
-            'w75_views': [],
-            'w100_views': []
-        }
-
-        for batch in stream:
-            for row in batch.results:
-                report['account_name'].append(row.customer.descriptive_name)
-                report['campaign_id'].append(row.campaign.id)
-                report['campaign'].append(row.campaign.name)
-                report['date'].append(row.segments.date)
-                report['adset_id'].append(row.ad_group.id)
-                report['adset_name'].append(row.ad_group.name)
-                report['ad_id'].append(row.ad_group_ad.ad.id)
-                report['content'].append(row.ad_group_ad.ad.url_custom_parameters[0].value) if len(row.ad_group_ad.ad.url_custom_parameters) > 0 else report['content'].append('')
-                report['ad_name'].append(row.ad_group_ad.ad.name)
-                report['destination_url'].append(row.ad_group_ad.ad.final_urls[0]) if len(row.ad_group_ad.ad.final_urls) > 0 else report['destination_url'].append('')
-                report['impressions'].append(row.metrics.impressions)
-                report['post_engagement'].append(row.metrics.interactions)
-                report['clicks'].append(row.metrics.clicks)
-                report['cost'].append(row.metrics.cost_micros)
-                report['results'].append(row.metrics.conversions)
-                report['video_views'].append(row.metrics.video_views)
-                report['w25_views'].append(row.metrics.video_quartile_p25_rate)
-                report['w50_views'].append(row.metrics.video_quartile_p50_rate)
-                report['w75_views'].append(row.metrics.video_quartile_p75_rate)
-                report['w100_views'].append(row.metrics.video_quartile_p100_rate)
+        def fetch_report():
+            stream = service.search_stream(customer_id = account_id, query = query)
+
+            report = {
+                'account_name': [],
+                'campaign_id': [],
+                'campaign': [],
+                'adset_id': [],
+                'adset_name': [],
+                'ad_name': [],
+                'ad_id': [],
+                'destination_url': [],
+                'content': [],
+                'impressions': [],
+                'post_engagement': [],
+                'date': [],
+                'clicks': [],
+                'cost': [],
+                'results': [],
+                'video_views': [],
+                'w25_views': [],
+                'w50_views': [],
+                'w75_views': [],
+                'w100_views': []
+            }
+
+            for batch in stream:
+                for row in batch.results:
+                    report['account_name'].append(row.customer.descriptive_name)
+                    report['campaign_id'].append(row.campaign.id)
+                    report['campaign'].append(row.campaign.name)
+                    report['date'].append(row.segments.date)
+                    report['adset_id'].append(row.ad_group.id)
+                    report['adset_name'].append(row.ad_group.name)
+                    report['ad_id'].append(row.ad_group_ad.ad.id)
+                    report['content'].append(row.ad_group_ad.ad.url_custom_parameters[0].value) if len(row.ad_group_ad.ad.url_custom_parameters) > 0 else report['content'].append('')
+                    report['ad_name'].append(row.ad_group_ad.ad.name)
+                    report['destination_url'].append(row.ad_group_ad.ad.final_urls[0]) if len(row.ad_group_ad.ad.final_urls) > 0 else report['destination_url'].append('')
+                    report['impressions'].append(row.metrics.impressions)
+                    report['post_engagement'].append(row.metrics.interactions)
+                    report['clicks'].append(row.metrics.clicks)
+                    report['cost'].append(row.metrics.cost_micros)
+                    report['results'].append(row.metrics.conversions)
+                    report['video_views'].append(row.metrics.video_views)
+                    report['w25_views'].append(row.metrics.video_quartile_p25_rate)
+                    report['w50_views'].append(row.metrics.video_quartile_p50_rate)
+                    report['w75_views'].append(row.metrics.video_quartile_p75_rate)
+                    report['w100_views'].append(row.metrics.video_quartile_p100_rate)
+
+            return report
+
+        # As linhas do stream são objetos do SDK; o arquivo guarda as colunas já extraídas de cada linha.
+        report = archive.raw(f'report_{account_id}', lambda: retry.call_api('GoogleAds', account_id, fetch_report))
 
         report_df = pd.DataFrame(report).sort_values('date', ignore_index = True)
         report_df['cost'] = report_df['cost'] / 10**6
@@ -143,9 +162,10 @@ def get_report(service: GoogleAdsClient, ad_accounts: list, start_date: str, end
 
 def get_googleAds(accounts: list, start_date: str, end_date: str) -> pd.DataFrame:
 
-    service = start_service()
+    service = token_store.shared('GoogleAds', start_service) if not archive.is_replay() else None
 
-    googleAds_df = get_report(service, accounts, start_date, end_date)
+    with archive.context('GoogleAds', accounts, start_date, end_date):
+        googleAds_df = get_report(service, accounts, start_date, end_date)
 
     return googleAds_df
 
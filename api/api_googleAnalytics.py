@@ -9,6 +9,10 @@ from oauth2client import client
 from oauth2client import file
 from oauth2client import tools
 
+import archive
+import token_store
+import retry
+
 def initialize_analyticsreporting():
     """Initializes the analyticsreporting service object.
 
@@ -47,7 +51,7 @@ def get_overview(analytics, view_id: str, metrics: list, dimensions: list, campa
     date_diff = (pd.to_datetime(end_date).date() - pd.to_datetime(start_date).date()).days
     page_size = 200*(date_diff) if date_diff > 10 else 1000
 
-    response = analytics.reports().batchGet(
+    response = archive.raw('overview', lambda: retry.call_api('GoogleAnalytics', view_id, lambda: analytics.reports().batchGet(
         body={
             'reportRequests': [
             {
@@ -70,7 +74,7 @@ def get_overview(analytics, view_id: str, metrics: list, dimensions: list, campa
             ]
             }]
         }
-    ).execute()
+    ).execute()), key = campaigns)
 
     for report in response.get('reports', []):
         columnHeader = report.get('columnHeader', {})
@@ -99,7 +103,7 @@ def get_events(analytics, view_id: str, metrics: list, dimensions: list, campaig
     date_diff = (pd.to_datetime(end_date).date() - pd.to_datetime(start_date).date()).days
     page_size = 2000*(date_diff) if date_diff > 1 else 2000
 
-    response = analytics.reports().batchGet(
+    response = archive.raw('events', lambda: retry.call_api('GoogleAnalytics', view_id, lambda: analytics.reports().batchGet(
         body={
             'reportRequests': [
             {
@@ -144,7 +148,7 @@ def get_events(analytics, view_id: str, metrics: list, dimensions: list, campaig
             ]
             }]
         }
-    ).execute()
+    ).execute()), key = campaigns)
 
     for report in response.get('reports', []):
         columnHeader = report.get('columnHeader', {})
@@ -462,18 +466,20 @@ def manipulate_cm(cm_overview: pd.DataFrame, cm_events: pd.DataFrame) -> pd.Data
 
 def get_googleAnalytics_bm(view_id: str, campaigns_bm: list, start_date: str, end_date: str):
 
-    analytics = initialize_analyticsreporting()
+    analytics = token_store.shared('GoogleAnalytics', initialize_analyticsreporting, per_thread = True) if not archive.is_replay() else None
 
-    bm_overview, bm_events = bm_get_report(analytics, view_id, campaigns_bm, start_date, end_date)
+    with archive.context('GoogleAnalytics', view_id, start_date, end_date):
+        bm_overview, bm_events = bm_get_report(analytics, view_id, campaigns_bm, start_date, end_date)
     bm_overview, bm_events = manipulate_bm(bm_overview, bm_events)
 
     return bm_overview, bm_events
 
 def get_googleAnalytics_cm(view_id: str, campaigns_cm: list, start_date: str, end_date: str):
 
-    analytics = initialize_analyticsreporting()
+    analytics = token_store.shared('GoogleAnalytics', initialize_analyticsreporting, per_thread = True) if not archive.is_replay() else None
 
-    cm_overview, cm_events = cm_get_report(analytics, view_id, campaigns_cm, start_date, end_date)
+    with archive.context('GoogleAnalytics', view_id, start_date, end_date):
+        cm_overview, cm_events = cm_get_report(analytics, view_id, campaigns_cm, start_date, end_date)
     cm_overview, cm_events = manipulate_cm(cm_overview, cm_events)
 
     return cm_overview, cm_events
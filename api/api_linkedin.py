@@ -7,12 +7,21 @@ import numpy as np
 import os
 import json
 
+from concurrent.futures import ThreadPoolExecutor
+
+import archive
+import entity_store
+import token_store
+import lookup_cache
+import http_client
+
+# Chamadas simultâneas na busca de criativos, campanhas e anúncios (no máximo http_client.POOL_SIZE conexões por host).
+MAX_PARALLEL_LOOKUPS = 8
+
 
 def get_credentials() -> dict:
 
-    credentials_path = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tokens', 'linkedin_credentials.json'))
-    with open(credentials_path, 'r') as f:
-        credentials = json.load(f)
+    credentials = token_store.load('linkedin_credentials.json')
 
     # refresh_token = credentials['refresh_token']
     # client_id = credentials['client_id']
@@ -51,7 +60,14 @@ def get_account(credentials: dict, account_name: list) -> str:
         'search.status.values[0]': 'ACTIVE'
     }
 
-    accounts_r = requests.get('https://api.linkedin.com/v2/adAccountsV2?q=search', headers = header, params = params).json()
+    names = {x.lower() for x in account_name}
+
+    accounts_r = archive.raw('accounts', lambda: lookup_cache.cached(
+        'LinkedIn',
+        'adAccountsV2?q=search',
+        lambda: http_client.get('https://api.linkedin.com/v2/adAccountsV2?q=search', headers = header, params = params, platform = 'LinkedIn').json(),
+        valid = lambda accounts: names <= {account['name'].lower() for account in accounts.get('elements', [])}
+        ))
     
     accounts = pd.DataFrame(accounts_r['elements'])
     accounts = accounts[['name', 'id']]
@@ -102,7 +118,7 @@ def get_analytics(credentials: dict, account_id: str, start_date: str, end_date:
         'Authorization': f'Bearer {access_token}'
     }
 
-    r_response = requests.get('https://api.linkedin.com/v2/adAnalyticsV2?', headers = header, params = params).json()
+    r_response = archive.raw('analytics', lambda: http_client.get('https://api.linkedin.com/v2/adAnalyticsV2?', headers = header, params = params, platform = 'LinkedIn').json())
 
     for element in r_response['elements']:
         element_day = element['dateRange']['start']['day']
@@ -113,6 +129,30 @@ def get_analytics(credentials: dict, account_id: str, start_date: str, end_date:
     analytics = pd.DataFrame(r_response['elements'])
     return analytics
 
+def get_many(urls: list, header: dict) -> list:
+    '''Busca as urls em paralelo, cada url uma vez só, e retorna as respostas na ordem das urls.'''
+
+    unique_urls = list(dict.fromkeys(urls))
+
+    with ThreadPoolExecutor(max_workers = MAX_PARALLEL_LOOKUPS) as executor:
+        responses = dict(zip(unique_urls, executor.map(lambda url: http_client.get(url, headers = header, platform = 'LinkedIn').json(), unique_urls)))
+
+    return [responses[url] for url in urls]
+
+def get_entities(kind: str, name: str, url: str, ids: list, header: dict) -> dict:
+    '''
+    Criativos, campanhas ou anúncios pelo id, {id: resposta}. Só os ids que não estão no banco de
+    entidades (ou já venceram) são buscados na API; respostas de erro não são guardadas.
+    O arquivo de respostas guarda todos os ids pedidos, para que o replay não dependa do banco de entidades.
+    '''
+
+    def fetch_missing(missing: list) -> dict:
+        responses = get_many([f'{url}/{id}' for id in missing], header)
+
+        return {id: response for id, response in zip(missing, responses) if 'serviceErrorCode' not in response}
+
+    return archive.raw(name, lambda: entity_store.get_store().fetch('LinkedIn', kind, ids, fetch_missing))
+
 def get_info(credentials: dict, df: pd.DataFrame):
 
     access_token = credentials['access_token']
@@ -123,11 +163,9 @@ def get_info(credentials: dict, df: pd.DataFrame):
     creatives = list(df['pivotValue'].unique())
     creatives_id = [creative.split('e:')[1] for creative in creatives]
 
-    creative_list = []
-    for id in creatives_id:
-        creative_list.append(requests.get(f'https://api.linkedin.com/v2/adCreativesV2/{id}', headers = header).json())
+    creative_map = get_entities('creative', 'creatives', 'https://api.linkedin.com/v2/adCreativesV2', creatives_id, header)
 
-    creative_df = pd.DataFrame(creative_list)
+    creative_df = pd.DataFrame([creative_map.get(id, {}) for id in creatives_id])
     creative_df['creative_id'] = pd.Series(creatives)
     creative_df = creative_df[['reference', 'campaign', 'creative_id']] if 'reference' in creative_df.columns else creative_df[['campaign', 'creative_id']]
 
@@ -135,12 +173,9 @@ def get_info(credentials: dict, df: pd.DataFrame):
     campaigns = list(creative_df['campaign'].unique())
 
     campaigns_id = [campaign.split('n:')[2] for campaign in campaigns]
-    campaign_list = []
-
-    for id in campaigns_id:
-        campaign_list.append(requests.get(f'https://api.linkedin.com/v2/adCampaignsV2/{id}', headers = header).json())
+    campaign_list = get_entities('campaign', 'campaigns', 'https://api.linkedin.com/v2/adCampaignsV2', campaigns_id, header).values()
     
-    campaigns_df = pd.DataFrame(campaign_list)
+    campaigns_df = pd.DataFrame(list(campaign_list))
     creative_df['campaign_id'] = creative_df['campaign'].str[25:]
 
     campaigns_df = campaigns_df[['id', 'name']]
@@ -151,13 +186,10 @@ def get_info(credentials: dict, df: pd.DataFrame):
     temp_df = campaigns_df.merge(creative_df, on = 'campaign_id', how = 'left')
 
     if 'reference' in creative_df.columns:
-        ad_names = []
         references = list(creative_df['reference'].unique())
-        
-        for reference in references:
-            ad_names.append(requests.get(f'https://api.linkedin.com/v2/adDirectSponsoredContents/{reference}', headers = header).json())
+        ad_names = get_entities('reference', 'references', 'https://api.linkedin.com/v2/adDirectSponsoredContents', references, header).values()
 
-        references_df = pd.DataFrame(ad_names)
+        references_df = pd.DataFrame(list(ad_names))
         
         if 'name' in references_df.columns:
             references_df = references_df[['contentReference', 'name']]
@@ -198,17 +230,18 @@ def fix_df(df: pd.DataFrame) -> pd.DataFrame:
 
 def get_linkedin(account_name: list, start_date: str, end_date: str) -> pd.DataFrame:
 
-    credentials = get_credentials()
-    account_id = get_account(credentials, account_name)
-    analytics = get_analytics(credentials, account_id, start_date, end_date)
+    with archive.context('Linkedin', account_name, start_date, end_date):
+        credentials = get_credentials() if not archive.is_replay() else {'access_token': ''}
+        account_id = get_account(credentials, account_name)
+        analytics = get_analytics(credentials, account_id, start_date, end_date)
 
-    if analytics.empty:
-            print('Não há novos dados em Linkedin.')
-            linkedin = pd.DataFrame(analytics)
+        if analytics.empty:
+                print('Não há novos dados em Linkedin.')
+                linkedin = pd.DataFrame(analytics)
 
-    else:
-        linkedin = get_info(credentials, analytics)
-        linkedin = fix_df(linkedin)
+        else:
+            linkedin = get_info(credentials, analytics)
+            linkedin = fix_df(linkedin)
     
     return linkedin
 
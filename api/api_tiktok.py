@@ -1,12 +1,17 @@
+import io
 import json
-import requests
 import pandas as pd
-import os
 import time
 
 from six import string_types
 from six.moves.urllib.parse import urlencode, urlunparse
 
+import archive
+import token_store
+import lookup_cache
+import retry
+import http_client
+
 def build_url(path, query=""):
     # type: (str, str) -> str
     """
@@ -20,32 +25,38 @@ def build_url(path, query=""):
 
 def get_credentials() -> dict:
 
-    credentials_path = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tokens', 'tiktok_credentials.json'))
-    with open(credentials_path, 'r') as f:
-        credentials = json.load(f)
-    
-    return credentials
+    return token_store.load('tiktok_credentials.json')
 
 def get_account_id(ad_account: list) -> str:
 
     url_path = "/open_api/oauth2/advertiser/get/"
 
-    credentials = get_credentials()
-    access_token = credentials['access_token']
-    secret = credentials['secret']
-    app_id = credentials['app_id']
+    def fetch_advertisers():
+        credentials = get_credentials()
+        access_token = credentials['access_token']
+        secret = credentials['secret']
+        app_id = credentials['app_id']
 
-    query = '''{
-        \"access_token\": \"%s\", 
-        \"secret\": \"%s\", 
-        \"app_id\": \"%s\"
-        }''' % (access_token, secret, app_id)
+        query = '''{
+            \"access_token\": \"%s\", 
+            \"secret\": \"%s\", 
+            \"app_id\": \"%s\"
+            }''' % (access_token, secret, app_id)
 
-    args = json.loads(query)
-    query_string = urlencode({k: v if isinstance(v, string_types) else json.dumps(v) for k, v in args.items()})
-    url = build_url(url_path, query_string)
+        args = json.loads(query)
+        query_string = urlencode({k: v if isinstance(v, string_types) else json.dumps(v) for k, v in args.items()})
+        url = build_url(url_path, query_string)
+
+        return http_client.get(url, platform = 'TikTok').json()
 
-    response = requests.get(url).json()
+    names = {x.lower() for x in ad_account}
+
+    response = archive.raw('advertisers', lambda: lookup_cache.cached(
+        'TikTok',
+        'oauth2/advertiser/get',
+        fetch_advertisers,
+        valid = lambda response: names <= {advertiser['advertiser_name'].lower() for advertiser in response.get('data', {}).get('list', [])}
+        ))
 
     accounts_df = pd.DataFrame(response['data']['list'])
 
@@ -55,7 +66,7 @@ def get_account_id(ad_account: list) -> str:
 
 def get_sync(url: str, headers:dict) -> pd.DataFrame:
 
-    response = requests.get(url, headers = headers).json()
+    response = archive.raw('report', lambda: http_client.get(url, headers = headers, platform = 'TikTok').json())
 
     data_dict = {
         'date': [],
@@ -112,9 +123,14 @@ def get_sync(url: str, headers:dict) -> pd.DataFrame:
 
     return df
 
-def get_async(advertiser_id: str, url: str, headers: dict) -> pd.DataFrame:
+class ReportFailed(Exception):
+    '''Relatório assíncrono que terminou com status FAILED.'''
+
+
+def download_async(advertiser_id: str, url: str, headers: dict) -> bytes:
+    '''Cria o relatório assíncrono, espera ficar pronto e retorna o csv baixado.'''
 
-    response = requests.post(url, headers = headers).json()
+    response = http_client.post(url, headers = headers, platform = 'TikTok').json()
 
     task_id = response['data']['task_id']
 
@@ -130,28 +146,31 @@ def get_async(advertiser_id: str, url: str, headers: dict) -> pd.DataFrame:
     query_string = urlencode({k: v if isinstance(v, string_types) else json.dumps(v) for k, v in args.items()})
     check_url = build_url(check_path, query_string)
 
-    check_report = requests.get(check_url, headers = headers).json()
-    
-    while check_report['data']['status'] != 'SUCCESS':
-
-        print(check_report['data']['status'])
-        time.sleep(1)
-        check_report = requests.get(check_url, headers = headers).json()
+    check_report = retry.poll(
+        'TikTok',
+        lambda: http_client.get(check_url, headers = headers, platform = 'TikTok').json(),
+        lambda check: check['data']['status'] in ('SUCCESS', 'FAILED'),
+        lambda check: check['data']['status']
+        )
 
-        if check_report['data']['status'] == 'FAILED':
-            print(check_report['data']['message'])
-            return pd.DataFrame([])
+    if check_report['data']['status'] == 'FAILED':
+        print(check_report['data']['message'])
+        raise ReportFailed(check_report['data']['message'])
 
     download_url = build_url(download_path, query_string)
 
-    report = requests.get(download_url, headers = headers).content
+    return http_client.get(download_url, headers = headers, platform = 'TikTok').content
 
-    with open('tiktok_temp.csv', 'w', newline='\n', encoding='iso-8859-1') as f:
-        f.write(report.decode('iso-8859-1'))
+def get_async(advertiser_id: str, url: str, headers: dict) -> pd.DataFrame:
 
-    df = pd.read_csv('tiktok_temp.csv')
+    try:
+        report = archive.raw('report', lambda: download_async(advertiser_id, url, headers))
+    except ReportFailed:
+        return pd.DataFrame([])
 
-    os.remove('tiktok_temp.csv')
+    # O csv é lido da memória: campanhas em processos diferentes usam a mesma pasta de trabalho,
+    # e um arquivo temporário com nome fixo seria lido e apagado por outra conta.
+    df = pd.read_csv(io.BytesIO(report))
 
     df.fillna('', inplace = True)
     df.rename(columns = {column: column.lower().replace(' ', '_') if 'group' not in column.lower() else column.lower().replace(' ', '').replace('group', 'set_') for column in df.columns}, inplace = True)
@@ -182,7 +201,7 @@ def get_async(advertiser_id: str, url: str, headers: dict) -> pd.DataFrame:
 
 def get_response(account_id: str, start_date: str, end_date: str) -> pd.DataFrame:
 
-    access_token = get_credentials()['access_token']
+    access_token = get_credentials()['access_token'] if not archive.is_replay() else ''
 
     url_path = "/open_api/v1.2/reports/integrated/get/"
 
@@ -250,8 +269,9 @@ def get_response(account_id: str, start_date: str, end_date: str) -> pd.DataFram
 
 def get_tiktok(account: str, start_date: str, end_date: str) -> pd.DataFrame:
 
-    account_id = get_account_id(account)
-    df = get_response(account_id, start_date, end_date)
+    with archive.context('TikTok', account, start_date, end_date):
+        account_id = get_account_id(account)
+        df = get_response(account_id, start_date, end_date)
     
     return df
 
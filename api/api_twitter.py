@@ -13,15 +13,18 @@ import json
 import pandas as pd
 import numpy as np
 
+import archive
+import entity_store
+import token_store
+import retry
 
-def get_credentials() -> dict:
+# Dias de cada relatório assíncrono de métricas.
+STATS_WINDOW_DAYS = 30
 
-    credentials_path = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'tokens', 'twitter_credentials.json'))
 
-    with open(credentials_path, 'r') as f:
-        credentials = json.load(f)
+def get_credentials() -> dict:
 
-    return credentials
+    return token_store.load('twitter_credentials.json')
 
 def get_client() -> Client:
 
@@ -35,6 +38,21 @@ def get_client() -> Client:
 def get_tweets_basic_info(account: Client.accounts) -> pd.DataFrame:
     '''Pega as informações básicas de todos os tweets (ids, infos de campanha)'''
     
+    # Os objetos do SDK não são json; o arquivo guarda os dicionários montados abaixo.
+    entities = archive.raw('entities', lambda: fetch_entities(account))
+
+    tweets_df = pd.DataFrame(entities['tweets'])
+    line_items_df = pd.DataFrame(entities['line_items'])
+    campaigns_df = pd.DataFrame(entities['campaigns'])
+
+    tweets_df = tweets_df.merge(line_items_df, on = 'line_item_id', how = 'left')
+    tweets_df = tweets_df.merge(campaigns_df, on = 'campaign_id', how = 'left')
+
+    return tweets_df
+
+def fetch_entities(account: Client.accounts) -> dict:
+    '''Tweets promovidos, line items e campanhas da conta.'''
+
     tweets = list(account.promoted_tweets(with_draft = 'true', with_deleted = 'true'))
     line_items = list(account.line_items(with_draft = 'true', with_deleted = 'true'))
     campaigns = list(account.campaigns(with_draft = 'true', with_deleted = 'true'))
@@ -75,16 +93,8 @@ def get_tweets_basic_info(account: Client.accounts) -> pd.DataFrame:
     for campaign in campaigns:
         campaign_dict['campaign_id'].append(campaign.id)
         campaign_dict['campaign_name'].append(campaign.name)
-        
-
-    tweets_df = pd.DataFrame(tweet_dict)
-    line_items_df = pd.DataFrame(line_items_dict)
-    campaigns_df = pd.DataFrame(campaign_dict)
-
-    tweets_df = tweets_df.merge(line_items_df, on = 'line_item_id', how = 'left')
-    tweets_df = tweets_df.merge(campaigns_df, on = 'campaign_id', how = 'left')
 
-    return tweets_df
+    return {'tweets': tweet_dict, 'line_items': line_items_dict, 'campaigns': campaign_dict}
 
 def apply_campaign_filter(df: pd.DataFrame, campaigns: list) -> pd.DataFrame:
     '''Aplica o filtro de campanha.'''
@@ -122,7 +132,15 @@ def get_cards(df: pd.DataFrame, account: Client.accounts, client: Client) -> pd.
 
     tweet_ids = list(set(df['tweet_id']))
 
-    tweets = list(Tweets.all(account, tweet_type = TWEET_TYPE.PUBLISHED, tweet_ids = tweet_ids))
+    store = entity_store.get_store()
+
+    def fetch_tweets(ids: list) -> dict:
+        tweets = Tweets.all(account, tweet_type = TWEET_TYPE.PUBLISHED, tweet_ids = ids)
+
+        return {tweet['tweet_id']: tweet for tweet in tweets}
+
+    # O arquivo de respostas guarda todos os tweets pedidos (não só os que faltavam no banco de entidades).
+    tweets = archive.raw('tweets', lambda: list(store.fetch('Twitter', 'tweet', tweet_ids, fetch_tweets).values()))
 
     for tweet in tweets:
         if 'card_uri' in tweet.keys():
@@ -141,12 +159,16 @@ def get_cards(df: pd.DataFrame, account: Client.accounts, client: Client) -> pd.
     tweet_non_cards = pd.DataFrame(non_card_dict)
 
     if tweet_cards.card_uri.any():
-        url = f'/11/accounts/{account.id}/cards'
-        params = {'card_uris': ','.join(card_dict['card_uri'])}
+        def fetch_cards(card_uris: list) -> dict:
+            params = {'card_uris': ','.join(card_uris)}
+
+            response = Request(client, 'get', f'/11/accounts/{account.id}/cards', params = params).perform().body
 
-        response = Request(client, 'get', url, params = params).perform().body
+            return {card['card_uri']: card for card in response['data']}
 
-        for card in response['data']:
+        cards = archive.raw('cards', lambda: list(store.fetch('Twitter', 'card', card_dict['card_uri'], fetch_cards).values()))
+
+        for card in cards:
             card_info['ad_name'].append(card['name'])
             card_info['media_url'].append(card['components'][0]['media_metadata'][card['components'][0]['media_key']]['url'])
             card_info['destination_url'].append(card['components'][1]['destination']['url'])
@@ -165,6 +187,55 @@ def get_cards(df: pd.DataFrame, account: Client.accounts, client: Client) -> pd.
 
     return cards_final
 
+class StatsJobFailed(Exception):
+    '''Relatório assíncrono de métricas que terminou com status FAILED.'''
+
+
+def fetch_stats(account: Client.accounts, entity_ids: list, metric_groups: list, start_time: datetime.datetime, end_time: datetime.datetime) -> list:
+    '''Cria os relatórios assíncronos de um período, espera todos terminarem e retorna os dados.'''
+
+    job_ids = []
+    for chunk in split_list(entity_ids, 20):
+        job_ids.append(retry.call_api('Twitter', account.id, lambda: PromotedTweet.queue_async_stats_job(account, chunk, metric_groups, granularity = 'DAY',
+                                                    start_time = start_time, end_time = end_time), idempotent = False).id)
+
+    async_stats_job_results = retry.poll(
+        'Twitter',
+        lambda: retry.call_api('Twitter', account.id, lambda: list(PromotedTweet.async_stats_job_result(account, job_ids = job_ids))),
+        lambda results: all(trabalho.status in ('SUCCESS', 'FAILED') for trabalho in results),
+        lambda results: 'PROCESSANDO'
+        )
+
+    if any(trabalho.status == 'FAILED' for trabalho in async_stats_job_results):
+        raise StatsJobFailed(f'Relatório assíncrono do Twitter falhou de {start_time} até {end_time}')
+
+    async_data = []
+    for result in async_stats_job_results:
+        async_data.append(retry.call_api('Twitter', account.id, lambda: PromotedTweet.async_stats_job_data(account, url = result.url)))
+
+    return async_data
+
+def stats_chunks(start_date: Timestamp, end_date: Timestamp) -> list:
+    '''
+    Blocos de até STATS_WINDOW_DAYS dias dos relatórios de métricas, como (início, fim) em texto.
+    No replay valem os blocos da gravação, que não depende de STATS_WINDOW_DAYS; gravações
+    anteriores à lista de blocos usam o tamanho atual.
+    '''
+
+    if archive.is_replay():
+        try:
+            recorded = archive.raw('stats_chunks', lambda: None)
+        except archive.ArchiveMissing:
+            recorded = None
+
+        if recorded:
+            return [tuple(chunk) for chunk in recorded]
+
+    dates = pd.Series(pd.date_range(start = start_date, end = end_date))
+    dates = dates.groupby(np.arange(len(dates))//STATS_WINDOW_DAYS).agg(['first', 'last'])
+
+    return [(first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d')) for first, last in dates.itertuples(index = False)]
+
 def get_metrics(df: pd.DataFrame, account: Client.accounts, start_date: Timestamp, end_date: Timestamp):
     '''Puxa todas as métricas do tweet, por dia.'''
 
@@ -175,38 +246,24 @@ def get_metrics(df: pd.DataFrame, account: Client.accounts, start_date: Timestam
         METRIC_GROUP.MEDIA, METRIC_GROUP.VIDEO
         ]
 
-    dates = pd.Series(pd.date_range(start = start_date, end = end_date))
-    dates = dates.groupby(np.arange(len(dates))//30).agg(['first', 'last'])
+    chunks = stats_chunks(start_date, end_date)
 
     async_data_total = []
 
-    for init_date, end_date in dates.itertuples(index = False):
-        init_temp = init_date.strftime('%Y-%m-%d')
-        end_temp = end_date.strftime('%Y-%m-%d')
-        
+    for init_temp, end_temp in chunks:
         start_time = datetime.datetime.strptime('{}{}'.format(init_temp, 'T00:00:00Z'), '%Y-%m-%dT%H:%M:%SZ')
         end_time = datetime.datetime.strptime('{}{}'.format(end_temp, 'T00:00:00Z'), '%Y-%m-%dT%H:%M:%SZ') + datetime.timedelta(days=1)
         
-        job_ids = []
-        for chunk in split_list(entity_ids, 20):
-            job_ids.append(PromotedTweet.queue_async_stats_job(account, chunk, metric_groups, granularity = 'DAY',
-                                                        start_time = start_time, end_time = end_time).id)
-        time.sleep(30)
-        async_stats_job_results = list(PromotedTweet.async_stats_job_result(account, job_ids = job_ids))
-
-        while (pd.Series([trabalho.status for trabalho in async_stats_job_results]) != 'SUCCESS').any():
-            print('PROCESSANDO')
-            time.sleep(30)
-            async_stats_job_results = list(PromotedTweet.async_stats_job_result(account, job_ids = job_ids))
-
-        async_data = []
-        for result in async_stats_job_results:
-            async_data.append(PromotedTweet.async_stats_job_data(account, url = result.url))
+        async_data = archive.raw(f'stats_{init_temp}_{end_temp}', lambda: fetch_stats(account, entity_ids, metric_groups, start_time, end_time))
             
         async_data_total = async_data_total + async_data
         
         print(f'Coletado de {init_temp} até {end_temp}')
 
+    # A lista de blocos vai para o arquivo de respostas: o replay não depende de STATS_WINDOW_DAYS.
+    if archive.is_active() and not archive.is_replay():
+        archive.raw('stats_chunks', lambda: [list(chunk) for chunk in chunks])
+
     metrics_list = []
 
     for report in async_data_total:
@@ -237,8 +294,9 @@ def fix_df(df: pd.DataFrame) -> pd.DataFrame:
 
     df['date'] = df['date'].dt.tz_localize(None).dt.date
 
+    # line_item_id fica na base: um tweet promovido em vários line items tem uma linha por line item no mesmo dia.
     columns_to_drop = [
-        'id', 'line_item_id', 'entity_status', 'created_at', 'updated_at', 'card_uri', 'tweets_send', 'qualified_impressions',
+        'id', 'entity_status', 'created_at', 'updated_at', 'card_uri', 'tweets_send', 'qualified_impressions',
         'media_engagements', 'follows', 'video_3s100pct_views', 'app_clicks', 'retweets', 'video_cta_clicks', 'unfollows',
         'likes', 'video_content_starts', 'media_views', 'card_engagements', 'video_6s_views', 'poll_card_vote',
         'replies', 'video_15s_views', 'url_clicks', 'billed_engagements', 'carousel_swipes', 'billed_charge_local_micro'
@@ -281,19 +339,24 @@ def fix_df(df: pd.DataFrame) -> pd.DataFrame:
 
 def get_twitter(campaigns: list, start_date: str, end_date: str):
 
-    crendentials = get_credentials()
-    client = get_client()
-    account = client.accounts(crendentials['ACCOUNT_ID'])
+    with archive.context('Twitter', campaigns, start_date, end_date):
+        if archive.is_replay():
+            client = account = None
+        else:
+            crendentials = get_credentials()
+            client = get_client()
+            account = client.accounts(crendentials['ACCOUNT_ID'])
+
+        basic_info_df = get_tweets_basic_info(account)
 
-    basic_info_df = get_tweets_basic_info(account)
+        filtered_df = apply_campaign_filter(basic_info_df, campaigns)
+        cards_df = get_cards(filtered_df, account, client)
 
-    filtered_df = apply_campaign_filter(basic_info_df, campaigns)
-    cards_df = get_cards(filtered_df, account, client)
+        start_date = pd.to_datetime(start_date)
+        end_date = pd.to_datetime(end_date)
 
-    start_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
+        final_df = get_metrics(cards_df, account, start_date, end_date)
 
-    final_df = get_metrics(cards_df, account, start_date, end_date)
     df = fix_df(final_df)
 
     return df
@@ -0,0 +1,183 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import datetime
+import contextlib
+import contextvars
+
+# Arquivo das respostas cruas das APIs, para reprocessar sem chamar as plataformas de novo.
+# - '': desligado
+# - 'record': as respostas são chamadas normalmente e guardadas em ARCHIVE_DIR
+# - 'replay': as respostas são lidas de ARCHIVE_DIR, sem nenhuma chamada de rede
+ARCHIVE_MODE = os.environ.get('MARKETING_ARCHIVE_MODE', '')
+
+ARCHIVE_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'archive'))
+
+# Nome da pasta de cada janela gravada: {início}_{fim}.
+WINDOW_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})_(\d{4}-\d{2}-\d{2})$')
+
+# Plataforma, conta e intervalo da coleta em andamento nesta thread, definidos pela função principal do conector.
+_context = contextvars.ContextVar('archive_context', default = None)
+
+
+class ArchiveMissing(Exception):
+    '''Resposta pedida no modo replay que não está no arquivo.'''
+
+
+def set_mode(mode: str) -> None:
+
+    global ARCHIVE_MODE
+
+    if mode not in ('', 'record', 'replay'):
+        raise ValueError(f'Modo de arquivo desconhecido: {mode}')
+
+    ARCHIVE_MODE = mode
+
+    return
+
+def is_replay() -> bool:
+
+    return ARCHIVE_MODE == 'replay'
+
+def is_active() -> bool:
+    '''Se raw() guarda ou lê as respostas no arquivo (modo ligado e dentro de um context()).'''
+
+    return bool(ARCHIVE_MODE) and _context.get() is not None
+
+def safe_name(value) -> str:
+    '''Nome de conta/campanha usável como nome de pasta (sem |, espaços, barras...).'''
+
+    name = re.sub(r'[^\w.-]+', '_', str(value)).strip('_')
+
+    return name or '_'
+
+def account_folder(account) -> str:
+    '''Pasta de uma conta ou de uma lista de contas pedidas na mesma chamada (em ordem, separadas por vírgula).'''
+
+    if isinstance(account, (list, tuple)):
+        account = ','.join(sorted(str(item) for item in account))
+
+    return safe_name(account)
+
+@contextlib.contextmanager
+def context(platform: str, account, start_date: str, end_date: str):
+    '''
+    Define a chave das respostas guardadas dentro do bloco: {platform}/{account}/{start_date}_{end_date}.
+    account pode ser uma lista de contas (ex.: Twitter e Campaign Manager pedem várias campanhas por chamada).
+    '''
+
+    token = _context.set((platform, account_folder(account), f'{start_date}_{end_date}'))
+
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+def recorded_windows(platform: str, accounts, start_date: datetime.date, end_date: datetime.date) -> list:
+    '''
+    Janelas gravadas de uma conta entre start_date e end_date, usadas pelo replay no lugar da cobertura.
+    - accounts: conta ou lista de contas; de uma lista valem a pasta da chamada conjunta e as pastas
+      de cada conta (plataformas que gravam uma conta por vez, como TikTok e LinkedIn)
+    - saídas: lista de (início, fim) ordenada pelo fim, então uma janela gravada depois (ex.: os dias
+      de LOOKBACK_DAYS da execução seguinte) substitui os mesmos dias das janelas anteriores
+    '''
+
+    folders = [account_folder(accounts)]
+    if isinstance(accounts, (list, tuple)):
+        folders += [safe_name(account) for account in accounts]
+
+    windows = set()
+
+    for folder in dict.fromkeys(folders):
+        path = os.path.join(ARCHIVE_DIR, platform, folder)
+
+        if not os.path.isdir(path):
+            continue
+
+        for name in os.listdir(path):
+            match = WINDOW_PATTERN.match(name)
+            if not match:
+                continue
+
+            start, end = (datetime.datetime.strptime(date, '%Y-%m-%d').date() for date in match.groups())
+            if start_date <= start and end <= end_date:
+                windows.add((start, end))
+
+    return sorted(windows, key = lambda window: (window[1], window[0]))
+
+def archive_path(name: str, key: str = '') -> str:
+    '''Caminho, sem extensão, de uma resposta dentro do contexto atual.'''
+
+    platform, account, window = _context.get()
+
+    if key:
+        name = f'{name}-{hashlib.sha1(str(key).encode()).hexdigest()[:12]}'
+
+    return os.path.join(ARCHIVE_DIR, platform, account, window, name)
+
+def save(path: str, payload) -> None:
+    '''
+    Grava a resposta comprimida:
+    - lista -> .jsonl.gz (um item por linha)
+    - dicionário -> .json.gz
+    - bytes/texto (ex.: relatórios em csv) -> .csv.gz
+    '''
+
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+
+    if isinstance(payload, list):
+        file_path = f'{path}.jsonl.gz'
+        content = ''.join(json.dumps(item, default = str) + '\n' for item in payload).encode()
+    elif isinstance(payload, (bytes, str)):
+        file_path = f'{path}.csv.gz'
+        content = payload if isinstance(payload, bytes) else payload.encode()
+    else:
+        file_path = f'{path}.json.gz'
+        content = json.dumps(payload, default = str).encode()
+
+    temp_path = f'{file_path}.tmp'
+    with gzip.open(temp_path, 'wb') as f:
+        f.write(content)
+
+    os.replace(temp_path, file_path)
+
+    return
+
+def load(path: str):
+
+    if os.path.isfile(f'{path}.jsonl.gz'):
+        with gzip.open(f'{path}.jsonl.gz', 'rt', encoding = 'utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    if os.path.isfile(f'{path}.json.gz'):
+        with gzip.open(f'{path}.json.gz', 'rt', encoding = 'utf-8') as f:
+            return json.load(f)
+
+    if os.path.isfile(f'{path}.csv.gz'):
+        with gzip.open(f'{path}.csv.gz', 'rb') as f:
+            return f.read()
+
+    raise ArchiveMissing(f'Resposta não encontrada no arquivo: {path}')
+
+def raw(name: str, fetch, key: str = ''):
+    '''
+    Executa fetch() e devolve a resposta crua (lista, dicionário ou bytes já prontos para json).
+    - record: a resposta também é guardada no arquivo
+    - replay: fetch não é chamado e a resposta vem do arquivo
+    Fora de um context() a resposta não é guardada nem lida do arquivo.
+    '''
+
+    if not is_active():
+        return fetch()
+
+    path = archive_path(name, key)
+
+    if is_replay():
+        return load(path)
+
+    payload = fetch()
+    save(path, payload)
+
+    return payload
@@ -0,0 +1,112 @@
+import time
+import random
+import argparse
+
+import pandas as pd
+
+from api.api_facebook import fix_actions
+
+# Tipos de ação que aparecem nos insights do Facebook.
+ACTION_TYPES = [
+    'link_click', 'landing_page_view', 'post_engagement', 'page_engagement', 'post_reaction', 'comment',
+    'onsite_conversion.post_save', 'video_view', 'like', 'post', 'offsite_conversion.fb_pixel_purchase',
+    'offsite_conversion.fb_pixel_lead', 'omni_purchase', 'mobile_app_install', 'app_custom_event.fb_mobile_purchase'
+]
+
+
+def fix_actions_iterrows(df: pd.DataFrame) -> pd.DataFrame:
+    '''Implementação anterior do fix_actions (linha a linha), usada como referência do resultado e do tempo.'''
+
+    video_columns = [
+        'video_p25_watched_actions',
+        'video_p50_watched_actions',
+        'video_p75_watched_actions',
+        'video_p100_watched_actions'
+        ]
+
+    video_name = [
+        'w25_views',
+        'w50_views',
+        'w75_views',
+        'w100_views'
+    ]
+
+    for column in video_columns:
+        if column not in df.columns:
+            df[column] = 0
+        else:
+            df.loc[~df[column].isna(), column] = df.loc[~df[column].isna(), column].str[0].str['value']
+
+    df.fillna(0, inplace = True)
+    df.rename(columns = dict(zip(video_columns, video_name)), inplace = True)
+
+    actions_dict = {}
+    actions_list = []
+
+    for _, row in df.iterrows():
+        if isinstance(row['actions'], list):
+            for action in row['actions']:
+                actions_dict[action['action_type']] = action['value']
+            actions_list.append(actions_dict)
+            actions_dict = {}
+        else:
+            actions_list.append({'no_value': ''})
+
+    actions_df = pd.DataFrame(actions_list).fillna(0)
+
+    fixed_df = pd.concat([df, actions_df], axis = 1)
+
+    return fixed_df
+
+def synthetic_insights(rows: int, seed: int = 0) -> pd.DataFrame:
+    '''
+    Dataframe no formato que o fix_actions recebe em get_facebook_data (colunas montadas por insights_columns):
+    listas de ações e de visualizações de vídeo por linha. As métricas ficam em texto, já que o fix_actions não as lê.
+    Parte das linhas vem sem ações (e sem vídeo), como anúncios sem interação no dia.
+    '''
+
+    rng = random.Random(seed)
+    data = []
+
+    for i in range(rows):
+        row = {
+            'date_start': f'2022-01-{i % 28 + 1:02d}',
+            'ad_id': str(23850000000000000 + i % 5000),
+            'impressions': str(rng.randint(0, 100000)),
+            'clicks': str(rng.randint(0, 1000)),
+            'spend': f'{rng.random() * 100:.2f}'
+        }
+
+        if rng.random() < 0.9:
+            row['actions'] = [{'action_type': action, 'value': str(rng.randint(1, 500))} for action in rng.sample(ACTION_TYPES, rng.randint(1, 10))]
+            for column in ['video_p25_watched_actions', 'video_p50_watched_actions', 'video_p75_watched_actions', 'video_p100_watched_actions']:
+                if rng.random() < 0.7:
+                    row[column] = [{'action_type': 'video_view', 'value': str(rng.randint(0, 1000))}]
+
+        data.append(row)
+
+    return pd.DataFrame(data)
+
+def timed(function, df: pd.DataFrame) -> tuple:
+
+    start = time.perf_counter()
+    result = function(df.copy())
+
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compara o fix_actions com a implementação linha a linha em insights sintéticos.')
+    parser.add_argument('--rows', type = int, default = 100000)
+    args = parser.parse_args()
+
+    df = synthetic_insights(args.rows)
+
+    expected, old_time = timed(fix_actions_iterrows, df)
+    result, new_time = timed(fix_actions, df)
+
+    pd.testing.assert_frame_equal(result, expected)
+
+    print(f'{args.rows} linhas, {len(result.columns)} colunas (resultado idêntico)')
+    print(f'iterrows: {old_time:.2f}s')
+    print(f'fix_actions: {new_time:.2f}s ({old_time / new_time:.1f}x mais rápido)')
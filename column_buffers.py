@@ -0,0 +1,130 @@
+import array
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Tipo de cada coluna no buffer: int -> int64, float -> float64, category -> códigos int32 + valores distintos.
+# Colunas fora do mapa de tipos ficam como lista de objetos (ex.: listas de ações).
+TYPECODES = {
+    'int': 'q',
+    'float': 'd',
+    'category': 'i'
+}
+
+DTYPES = {
+    'int': np.int64,
+    'float': np.float64,
+    'category': np.int32
+}
+
+
+class ColumnBuffers:
+    '''
+    Colunas de um dataframe preenchidas linha a linha já no tipo final, sem guardar as linhas.
+    Valores ausentes viram 0 nas colunas numéricas, '' nas categóricas e None nas de objetos.
+    As colunas ficam na ordem em que aparecem pela primeira vez, como no pd.DataFrame(linhas).
+    '''
+
+    def __init__(self, types: dict):
+        self.types = types
+        self.columns = {}
+        self.categories = {}
+        self.length = 0
+
+    def __len__(self) -> int:
+
+        return self.length
+
+    def add_column(self, name: str) -> None:
+        '''Cria a coluna com o valor ausente nas linhas anteriores.'''
+
+        kind = self.types.get(name, 'object')
+
+        if kind == 'category':
+            self.categories[name] = {}
+            self.columns[name] = array.array('i', [self.code(name, None)]) * self.length if self.length else array.array('i')
+        elif kind in TYPECODES:
+            self.columns[name] = array.array(TYPECODES[kind], [0]) * self.length
+        else:
+            self.columns[name] = [None] * self.length
+
+        return
+
+    def code(self, name: str, value) -> int:
+
+        categories = self.categories[name]
+        value = '' if value is None else str(value)
+
+        if value not in categories:
+            categories[value] = len(categories)
+
+        return categories[value]
+
+    def append(self, row: dict) -> None:
+
+        for name in row:
+            if name not in self.columns:
+                self.add_column(name)
+
+        for name, column in self.columns.items():
+            value = row.get(name)
+            kind = self.types.get(name, 'object')
+
+            if kind == 'category':
+                column.append(self.code(name, value))
+            elif kind == 'int':
+                column.append(int(value or 0))
+            elif kind == 'float':
+                column.append(float(value or 0))
+            else:
+                column.append(value)
+
+        self.length += 1
+
+        return
+
+    def extend(self, rows) -> 'ColumnBuffers':
+
+        for row in rows:
+            self.append(row)
+
+        return self
+
+    def frame(self) -> pd.DataFrame:
+
+        data = {}
+
+        for name, column in self.columns.items():
+            kind = self.types.get(name, 'object')
+
+            if kind == 'category':
+                data[name] = pd.Categorical.from_codes(np.frombuffer(column, dtype = DTYPES[kind]), categories = list(self.categories[name]))
+            elif kind in DTYPES:
+                data[name] = np.frombuffer(column, dtype = DTYPES[kind])
+            else:
+                data[name] = pd.Series(column, dtype = object)
+
+        return pd.DataFrame(data, columns = list(self.columns))
+
+
+def concat(frames: list) -> pd.DataFrame:
+    '''Junta dataframes de ColumnBuffers mantendo as colunas categóricas (com a união das categorias).'''
+
+    frames = [frame for frame in frames if len(frame.columns)]
+
+    if not frames:
+        return pd.DataFrame()
+
+    if len(frames) == 1:
+        return frames[0]
+
+    df = pd.concat(frames, ignore_index = True)
+
+    for column in df.columns:
+        parts = [frame[column] for frame in frames if column in frame.columns]
+
+        if len(parts) == len(frames) and all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            df[column] = union_categoricals(parts)
+
+    return df
@@ -0,0 +1,69 @@
+import time
+import importlib
+import threading
+
+# Registro das funções de cada plataforma: nome -> (módulo, função).
+# O SDK de uma plataforma (facebook_business, google.ads, twitter_ads, googleapiclient...) só é
+# importado na primeira vez que uma campanha usa aquela plataforma.
+CONNECTORS = {
+    'Facebook': ('api.api_facebook', 'get_facebook'),
+    'GoogleAds': ('api.api_googleAds', 'get_googleAds'),
+    'CampaignManager': ('api.api_campaign_manager', 'get_CampaignManager'),
+    'Twitter': ('api.api_twitter', 'get_twitter'),
+    'TikTok': ('api.api_tiktok', 'get_tiktok'),
+    'Linkedin': ('api.api_linkedin', 'get_linkedin'),
+    'GoogleAnalyticsBM': ('api.api_googleAnalytics', 'get_googleAnalytics_bm'),
+    'GoogleAnalyticsCM': ('api.api_googleAnalytics', 'get_googleAnalytics_cm'),
+    'Adjust': ('api.api_adjust', 'get_adjust')
+}
+
+# Tempo, em segundos, que cada módulo levou para ser importado nesta execução.
+IMPORT_TIMES = {}
+
+_import_lock = threading.Lock()
+
+
+def get_connector(name: str):
+    '''Importa (se ainda não foi importado) o módulo da plataforma e retorna a sua função.'''
+
+    module_name, function_name = CONNECTORS[name]
+
+    # O import acontece dentro de threads do pipeline, o lock evita que dois imports do mesmo módulo se atropelem.
+    with _import_lock:
+        if module_name not in IMPORT_TIMES:
+            start_time = time.perf_counter()
+            importlib.import_module(module_name)
+            IMPORT_TIMES[module_name] = time.perf_counter() - start_time
+
+        module = importlib.import_module(module_name)
+
+    return getattr(module, function_name)
+
+
+class LazyConnector:
+    '''Função de uma plataforma que só importa o seu módulo quando é chamada.'''
+
+    def __init__(self, name: str):
+        self.name = name
+        self.__name__ = CONNECTORS[name][1]
+
+    def __call__(self, *args, **kwargs):
+        return get_connector(self.name)(*args, **kwargs)
+
+    def __repr__(self):
+        return f'LazyConnector({self.name!r})'
+
+
+def measure_import_times() -> dict:
+    '''
+    Importa todos os módulos registrados, um por vez, e retorna o tempo de cada um.
+    Dependências compartilhadas (ex.: googleapiclient) ficam na conta do primeiro módulo que as importa.
+    '''
+
+    for name, (module_name, _) in CONNECTORS.items():
+        try:
+            get_connector(name)
+        except ImportError as error:
+            print(f'{module_name}: não foi possível importar ({error})')
+
+    return dict(IMPORT_TIMES)
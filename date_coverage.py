@@ -0,0 +1,153 @@
+import os
+import json
+import datetime
+import threading
+
+DATE_FORMAT = '%Y-%m-%d'
+
+# Maior intervalo de dias que cada plataforma aceita em uma chamada. Plataformas fora daqui
+# (ou com None) recebem cada intervalo faltante em uma única chamada, já que seus módulos
+# dividem o período internamente quando precisam (ex.: Twitter em blocos de 30 dias).
+MAX_WINDOW_DAYS = {
+    'Facebook': 1110,           # insights aceitam no máximo 37 meses
+    'GoogleAnalytics': 500      # pageSize de 200 linhas por dia, limitado a 100.000 pela API
+}
+
+# Dias finais do período que são coletados de novo a cada execução, para plataformas que revisam
+# os números depois (atribuição do Facebook, conversões do Google Ads, reatribuições do Adjust).
+# Esses dias são substituídos inteiros na base salva.
+LOOKBACK_DAYS = {
+    'Facebook': 7,
+    'GoogleAds': 7,
+    'Adjust': 7
+}
+
+# As etapas de uma campanha rodam em threads e gravam no mesmo _coverage.json.
+_coverage_lock = threading.Lock()
+
+
+def merge_intervals(intervals: list) -> list:
+    '''Junta intervalos de dias ([início, fim], inclusivos) que se sobrepõem ou são vizinhos.'''
+
+    merged = []
+
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + datetime.timedelta(days = 1):
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return [tuple(interval) for interval in merged]
+
+def missing_intervals(covered: list, start_date: datetime.date, end_date: datetime.date) -> list:
+    '''Intervalos de dias entre start_date e end_date que não estão em covered.'''
+
+    missing = []
+    cursor = start_date
+
+    for covered_start, covered_end in merge_intervals(covered):
+        if covered_end < cursor:
+            continue
+        if covered_start > end_date:
+            break
+
+        if covered_start > cursor:
+            missing.append((cursor, covered_start - datetime.timedelta(days = 1)))
+
+        cursor = covered_end + datetime.timedelta(days = 1)
+
+    if cursor <= end_date:
+        missing.append((cursor, end_date))
+
+    return missing
+
+def split_window(start_date: datetime.date, end_date: datetime.date, max_days: int = None) -> list:
+    '''Divide um intervalo em janelas de no máximo max_days dias.'''
+
+    if not max_days:
+        return [(start_date, end_date)]
+
+    windows = []
+
+    while start_date <= end_date:
+        window_end = min(start_date + datetime.timedelta(days = max_days - 1), end_date)
+        windows.append((start_date, window_end))
+        start_date = window_end + datetime.timedelta(days = 1)
+
+    return windows
+
+def fetch_windows(platform: str, covered: list, start_date: datetime.date, end_date: datetime.date) -> list:
+    '''Janelas que precisam ser pedidas à plataforma para cobrir de start_date a end_date, incluindo os dias de LOOKBACK_DAYS.'''
+
+    windows = []
+
+    lookback = LOOKBACK_DAYS.get(platform)
+    if lookback:
+        lookback_start = end_date - datetime.timedelta(days = lookback - 1)
+        covered = [(start, min(end, lookback_start - datetime.timedelta(days = 1))) for start, end in covered if start < lookback_start]
+
+    for missing_start, missing_end in missing_intervals(covered, start_date, end_date):
+        windows += split_window(missing_start, missing_end, MAX_WINDOW_DAYS.get(platform))
+
+    return windows
+
+
+class Coverage:
+    '''
+    Dias já coletados com sucesso de cada base da campanha, guardados em data/_coverage.json.
+
+    Um dia entra na cobertura quando a chamada que o pediu termina, mesmo que a plataforma
+    não tenha devolvido nenhuma linha para ele. Assim um dia sem veiculação não é pedido de
+    novo a cada execução e um dia que falhou no meio do período continua faltando até ser coletado.
+    '''
+
+    def __init__(self, campaign_path: str):
+        self.path = os.path.abspath(os.path.join(campaign_path, 'data', '_coverage.json'))
+
+    def load(self) -> dict:
+
+        if not os.path.isfile(self.path):
+            return {}
+
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def has(self, table: str) -> bool:
+
+        return table in self.load()
+
+    def covered(self, table: str) -> list:
+
+        return [tuple(datetime.datetime.strptime(date, DATE_FORMAT).date() for date in interval) for interval in self.load().get(table, [])]
+
+    def add(self, table: str, start_date: datetime.date, end_date: datetime.date) -> None:
+        '''Marca os dias de start_date a end_date como coletados.'''
+
+        with _coverage_lock:
+            self.write(table, self.covered(table) + [(start_date, end_date)])
+
+        return
+
+    def write(self, table: str, intervals: list) -> None:
+
+        data = self.load()
+        data[table] = [[start.strftime(DATE_FORMAT), end.strftime(DATE_FORMAT)] for start, end in merge_intervals(intervals)]
+
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, indent = 1)
+
+        os.replace(temp_path, self.path)
+
+        return
+
+    def seed(self, table: str, dates: list) -> None:
+        '''Cria a cobertura de uma base antiga a partir dos dias que têm linhas salvas.'''
+
+        with _coverage_lock:
+            if not self.has(table):
+                self.write(table, [(date, date) for date in dates])
+
+        return
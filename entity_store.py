@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+
+# Metadados de entidades das plataformas (criativos, anúncios, cards, campanhas...), compartilhados
+# entre campanhas e execuções. Só as métricas precisam ser buscadas todo dia.
+ENTITY_STORE_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cache', 'entities.sqlite'))
+
+# Tempo, em segundos, depois do qual uma entidade guardada é buscada de novo na plataforma.
+# None: nunca expira.
+ENTITY_TTL = {
+    'creative': 90 * 24 * 60 * 60,
+    'ad': 12 * 60 * 60,             # o criativo de um anúncio pode ser trocado
+    'tweet': 30 * 24 * 60 * 60,
+    'card': 30 * 24 * 60 * 60,
+    'reference': 30 * 24 * 60 * 60,
+    'campaign': 24 * 60 * 60        # campanhas podem ser renomeadas
+}
+
+DEFAULT_ENTITY_TTL = 30 * 24 * 60 * 60
+
+
+class EntityStore:
+    '''
+    Banco SQLite com as entidades de cada plataforma, guardadas como json pelo id da plataforma.
+    - fetched_at: quando a entidade foi buscada na plataforma (define a validade)
+    - last_seen: última vez que a entidade apareceu nos dados de alguma campanha
+    '''
+
+    def __init__(self, path: str = ENTITY_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+
+        with self.connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS entities (platform TEXT, kind TEXT, id TEXT, payload TEXT, fetched_at REAL, last_seen REAL, PRIMARY KEY (platform, kind, id))')
+
+    @contextlib.contextmanager
+    def connect(self):
+        '''Conexão com o banco: confirma a transação no fim do bloco (ou desfaz, em caso de erro) e fecha a conexão.'''
+
+        # Vários processos podem gravar ao mesmo tempo: o timeout faz cada um esperar a sua vez.
+        conn = sqlite3.connect(self.path, timeout = 120)
+
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, platform: str, kind: str, ids: list, ttl: int = None) -> dict:
+        '''Entidades guardadas e ainda válidas, {id: entidade}. As encontradas têm o last_seen atualizado.'''
+
+        ids = [str(id) for id in dict.fromkeys(ids)]
+        oldest = time.time() - ttl if ttl else 0
+        found = {}
+
+        with self.connect() as conn:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = conn.execute(
+                    f'SELECT id, payload FROM entities WHERE platform = ? AND kind = ? AND fetched_at >= ? AND id IN ({",".join("?" * len(chunk))})',
+                    (platform, kind, oldest, *chunk)
+                    ).fetchall()
+                found.update((id, json.loads(payload)) for id, payload in rows)
+
+            conn.executemany('UPDATE entities SET last_seen = ? WHERE platform = ? AND kind = ? AND id = ?', [(time.time(), platform, kind, id) for id in found])
+
+        return found
+
+    def put_many(self, platform: str, kind: str, entities: dict) -> None:
+
+        now = time.time()
+
+        with self.connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO entities (platform, kind, id, payload, fetched_at, last_seen) VALUES (?, ?, ?, ?, ?, ?)',
+                [(platform, kind, str(id), json.dumps(payload, default = str), now, now) for id, payload in entities.items()]
+                )
+
+        return
+
+    def fetch(self, platform: str, kind: str, ids: list, fetch_missing) -> dict:
+        '''
+        Entidades dos ids pedidos, buscando na plataforma só as que não estão guardadas ou já venceram (ENTITY_TTL).
+        - fetch_missing: função que recebe a lista de ids faltantes e retorna {id: entidade}
+        - saídas: {id (texto): entidade}, na ordem dos ids pedidos; ids que a plataforma não devolveu ficam de fora
+        '''
+
+        ids = [str(id) for id in dict.fromkeys(ids)]
+        entities = self.get_many(platform, kind, ids, ENTITY_TTL.get(kind, DEFAULT_ENTITY_TTL))
+
+        missing = [id for id in ids if id not in entities]
+        if missing:
+            fetched = {str(id): entity for id, entity in fetch_missing(missing).items()}
+            self.put_many(platform, kind, fetched)
+            entities.update(fetched)
+
+        return {id: entities[id] for id in ids if id in entities}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> EntityStore:
+    '''Banco de entidades do processo, criado na primeira chamada.'''
+
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            _store = EntityStore()
+
+    return _store
@@ -0,0 +1,120 @@
+import datetime
+import threading
+
+import pandas as pd
+
+from date_coverage import merge_intervals, missing_intervals
+
+# Coluna da base de cada plataforma que identifica a conta (ou campanha, no Campaign Manager) de cada linha.
+# Com ela é possível pedir várias contas em uma única chamada e separar o resultado depois.
+# Plataformas com None são pedidas uma conta por vez.
+PLANNED_PLATFORMS = {
+    'Facebook': 'account_name',
+    'GoogleAds': 'account_name',
+    'TikTok': None,
+    'CampaignManager': 'campaign'
+}
+
+
+class FetchPlanner:
+    '''
+    Cache em memória das bases de cada (plataforma, conta) durante uma execução.
+
+    Campanhas que usam a mesma conta pedem os dados uma única vez: o planner guarda os intervalos
+    de datas já coletados de cada conta, pede à API apenas as datas que faltam (juntando na mesma
+    chamada as contas que precisam do mesmo intervalo) e devolve a cada campanha o recorte das
+    suas contas e datas.
+    '''
+
+    def __init__(self):
+        self.cache = {}
+        self.locks = {platform: threading.Lock() for platform in PLANNED_PLATFORMS}
+
+    def missing_windows(self, platform: str, keys: list, start_date: datetime.date, end_date: datetime.date) -> dict:
+        '''Agrupa as contas pelo intervalo de datas que ainda falta coletar de cada uma.'''
+
+        windows = {}
+
+        for key in keys:
+            cached = self.cache.get((platform, key))
+            covered = cached['intervals'] if cached else []
+
+            for window in missing_intervals(covered, start_date, end_date):
+                windows.setdefault(window, []).append(key)
+
+        return windows
+
+    def store(self, platform: str, key: str, df: pd.DataFrame, start_date: datetime.date, end_date: datetime.date) -> None:
+
+        cached = self.cache.get((platform, key))
+
+        if cached is None:
+            self.cache[(platform, key)] = {'intervals': [(start_date, end_date)], 'df': df}
+            return
+
+        cached['df'] = pd.concat([cached['df'], df], axis = 0, ignore_index = True)
+        cached['intervals'] = merge_intervals(cached['intervals'] + [(start_date, end_date)])
+
+        return
+
+    def fetch(self, platform: str, function, keys: list, start_date: str, end_date: str, *args) -> pd.DataFrame:
+        '''
+        Devolve a base das contas no intervalo pedido, chamando a API só para o que não está no cache.
+        - entradas:
+            - nome da plataforma
+            - função da plataforma (get_facebook, get_googleAds...)
+            - contas (ou campanhas, no Campaign Manager)
+            - data inicial e final
+            - argumentos que vêm antes das contas na função da plataforma (ex.: campaign_path no Campaign Manager)
+
+        - saídas:
+            - dataframe com as linhas das contas pedidas entre as datas pedidas
+        '''
+
+        split_column = PLANNED_PLATFORMS[platform]
+
+        start = pd.to_datetime(start_date).date()
+        end = pd.to_datetime(end_date).date()
+
+        with self.locks[platform]:
+            for (window_start, window_end), window_keys in self.missing_windows(platform, keys, start, end).items():
+                init = window_start.strftime('%Y-%m-%d')
+                final = window_end.strftime('%Y-%m-%d')
+
+                if split_column:
+                    print(f'[{platform}] Coletando {len(window_keys)} conta(s) em uma chamada [{init}] -> [{final}]')
+                    df = function(*args, window_keys, init, final)
+
+                    for key in window_keys:
+                        key_df = df[df[split_column].astype(str).str.lower() == key.lower()] if split_column in df.columns else df.iloc[0:0]
+                        self.store(platform, key, key_df, window_start, window_end)
+
+                else:
+                    for key in window_keys:
+                        self.store(platform, key, function(*args, [key], init, final), window_start, window_end)
+
+            frames = [self.cache[(platform, key)]['df'] for key in keys]
+
+        df = pd.concat(frames, axis = 0, ignore_index = True)
+
+        if 'date' in df.columns and not df.empty:
+            dates = pd.to_datetime(df['date'])
+            df = df[(dates >= pd.Timestamp(start)) & (dates <= pd.Timestamp(end))]
+
+        return df.reset_index(drop = True)
+
+    def wrap(self, platform: str, function):
+        '''Retorna uma função com a mesma assinatura da função da plataforma que passa pelo planner.'''
+
+        if platform not in PLANNED_PLATFORMS:
+            return function
+
+        def planned(*args):
+            *prefix, keys, start_date, end_date = args
+            return self.fetch(platform, function, keys, start_date, end_date, *prefix)
+
+        return planned
+
+
+# Um planner por processo: campanhas atualizadas no mesmo processo compartilham as coletas.
+PLANNER = FetchPlanner()
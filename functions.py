@@ -4,7 +4,58 @@ import numpy as np
 import datetime
 import os
 
-from api.api_adjust import get_adjust
+from connectors import LazyConnector
+from storage import get_storage, export_excel, EXPORT_PREP_EXCEL
+from date_coverage import Coverage, fetch_windows
+
+import archive
+
+get_adjust = LazyConnector('Adjust')
+
+def concat_dates(frames: list) -> pd.DataFrame:
+    '''Junta a base salva com os intervalos coletados, ordenada por data.'''
+
+    frames = [df for df in frames if isinstance(df, pd.DataFrame)]
+
+    if not frames:
+        return pd.DataFrame()
+
+    df = pd.concat(frames, axis = 0, ignore_index = True)
+
+    # Algumas plataformas (ex.: Twitter) entregam datetime.date e a base salva volta como datetime.
+    if 'date' in df.columns:
+        df['date'] = pd.to_datetime(df['date'])
+        df.sort_values('date', inplace = True, ignore_index = True)
+
+    return df
+
+def drop_windows(df: pd.DataFrame, windows: list) -> pd.DataFrame:
+    '''Remove da base salva os dias que foram coletados de novo.'''
+
+    if not isinstance(df, pd.DataFrame) or df.empty or not windows:
+        return df
+
+    dates = pd.to_datetime(df['date']).dt.date
+    keep = pd.Series(True, index = df.index)
+
+    for window_start, window_end in windows:
+        keep &= (dates < window_start) | (dates > window_end)
+
+    return df[keep]
+
+def plan_windows(platform: str, accounts, covered: list, init_date: datetime.date, end_date: datetime.date) -> list:
+    '''
+    Janelas pedidas à plataforma: os dias que faltam na cobertura e os de LOOKBACK_DAYS.
+    No replay valem as janelas gravadas da conta no arquivo de respostas, inclusive dias já cobertos,
+    para refazer as transformações sobre todo o histórico gravado; sem gravação da conta vale a cobertura.
+    '''
+
+    if archive.is_replay():
+        windows = archive.recorded_windows(platform, accounts, init_date, end_date)
+        if windows:
+            return windows
+
+    return fetch_windows(platform, covered, init_date, end_date)
 
 def merge_params(bm_df: pd.DataFrame, parametric_df: pd.DataFrame, campaign_path: str, bm: str, content: bool) -> pd.DataFrame:
 
@@ -68,41 +119,39 @@ def update_adjust(campaign_path:str , init_date: datetime.time) -> pd.DataFrame:
     yesterday = datetime.datetime.today().date() - datetime.timedelta(days = 1)
 
     print('Atualizando Adjust')
-    adjust_file = os.path.abspath(os.path.join(campaign_path, 'source', 'adjust_prep.xlsx'))
-    
-    if os.path.isfile(adjust_file):
-        adjust_saved = pd.read_excel(adjust_file, sheet_name = 'adjust_prep', parse_dates = ['date'])
+    storage = get_storage(campaign_path)
+    coverage = Coverage(campaign_path)
+    table = 'adjust_prep'
 
-        adjust_saved[[column for column in adjust_saved.columns if '_id' in column]] = adjust_saved[[column for column in adjust_saved.columns if '_id' in column]].astype(str)
-        adjust_saved['date'] = pd.to_datetime(adjust_saved['date'])
-        
-        adjust_init = (adjust_saved['date'].max().date() + datetime.timedelta(days = 1)).strftime('%Y-%m-%d')
-        adjust_end = yesterday.strftime('%Y-%m-%d')
+    adjust_saved = None
 
-        if adjust_saved['date'].max().date() == yesterday:
-            print('Adjust já atualizado!')
-            adjust_data = adjust_saved
+    if storage.exists(table):
+        adjust_saved = storage.read(table)
+        coverage.seed(table, storage.dates(table))
 
-        else:
-            print(f'Atualizando Adjust [{adjust_init}] -> [{adjust_end}]')
+    windows = plan_windows('Adjust', 'report', coverage.covered(table), init_date, yesterday)
+    adjust_frames = [drop_windows(adjust_saved, windows)]
 
-            adjust_temp = get_adjust(adjust_init, adjust_end)
-            adjust_data = pd.concat([adjust_saved, adjust_temp], axis = 0, ignore_index = True)
-            
-            adjust_data.sort_values('date', inplace = True, ignore_index = True)
-            adjust_data.to_excel(adjust_file, sheet_name = 'adjust_prep', index = False)
-            print('Adjust atualizado!')
+    if not windows:
+        print('Adjust já atualizado!')
 
-    else:
+    for window_start, window_end in windows:
+        adjust_init = window_start.strftime('%Y-%m-%d')
+        adjust_end = window_end.strftime('%Y-%m-%d')
+
+        print(f'Atualizando Adjust [{adjust_init}] -> [{adjust_end}]')
 
-        adjust_init = init_date.strftime('%Y-%m-%d')
-        adjust_end = yesterday.strftime('%Y-%m-%d')
+        adjust_temp = get_adjust(adjust_init, adjust_end)
+        storage.replace(table, adjust_temp, window_start, window_end)
+        coverage.add(table, window_start, window_end)
 
-        print(f'Atualizando adjust [{adjust_init}] -> [{adjust_end}]')
+        # No replay as janelas gravadas podem se sobrepor: a mais recente substitui os mesmos dias.
+        adjust_frames = [drop_windows(df, [(window_start, window_end)]) for df in adjust_frames]
+        adjust_frames.append(adjust_temp)
 
-        adjust_data = get_adjust(adjust_init, adjust_end)     
-        adjust_data.sort_values('date', inplace = True, ignore_index = False)
-        adjust_data.to_excel(adjust_file, sheet_name = 'adjust_prep', index = False)
+    adjust_data = concat_dates(adjust_frames)
+
+    if windows:
         print('Adjust atualizado!')
         
     return adjust_data
@@ -125,60 +174,56 @@ def update_bm(campaign_path: str, init_date: datetime.date, **kwargs) -> pd.Data
     bm_function = kwargs['bm_function']
 
     print(f'Atualizando {bm}.')
-    bm_file = os.path.abspath(os.path.join(campaign_path, 'data', f'{bm.lower()}_prep.xlsx'))
-    
-    if os.path.isfile(bm_file):
-        bm_saved = pd.read_excel(bm_file, sheet_name = f'{bm.lower()}_prep', parse_dates = ['date'])
-
-        bm_saved[[column for column in bm_saved.columns if '_id' in column]] = bm_saved[[column for column in bm_saved.columns if '_id' in column]].astype(str)
-        bm_saved['date'] = pd.to_datetime(bm_saved['date'])
-        
-        bm_init = (bm_saved['date'].max().date() + datetime.timedelta(days = 1)).strftime('%Y-%m-%d')
-        bm_end = yesterday.strftime('%Y-%m-%d')
+    storage = get_storage(campaign_path)
+    coverage = Coverage(campaign_path)
+    table = f'{bm.lower()}_prep'
 
-        if bm_saved['date'].max().date() == yesterday:
-            print(f'{bm} já atualizado!')
-            bm_data = bm_saved
-        
-        else:
-            print(f'Atualizando {bm} [{bm_init}] -> [{bm_end}]')
+    bm_saved = None
 
-            if is_accounts:
-                bm_temp = bm_function(bm_accounts, bm_init, bm_end)
-            
-            if is_campaigns:
-                
-                if bm == 'Twitter':
-                    bm_temp = bm_function(bm_campaigns, bm_init, bm_end)
+    if storage.exists(table):
+        bm_saved = storage.read(table)
+        coverage.seed(table, storage.dates(table))
 
-                if bm == 'CampaignManager':
-                    bm_temp = bm_function(campaign_path, bm_campaigns, bm_init, bm_end)
+    # Os dias que ainda não foram coletados com sucesso (inclusive buracos no meio do período)
+    # e os últimos LOOKBACK_DAYS dias, que são coletados de novo e substituídos na base.
+    windows = plan_windows(bm, bm_accounts if is_accounts else bm_campaigns, coverage.covered(table), init_date, yesterday)
+    bm_frames = [drop_windows(bm_saved, windows)]
 
-            bm_data = pd.concat([bm_saved, bm_temp], axis = 0, ignore_index = True)
+    if not windows:
+        print(f'{bm} já atualizado!')
 
-            bm_data.sort_values('date', inplace = True, ignore_index = False)
-            bm_data.to_excel(bm_file, sheet_name = f'{bm.lower()}_prep', index = False)
-            print(f'{bm} atualizado!')
+    for window_start, window_end in windows:
+        bm_init = window_start.strftime('%Y-%m-%d')
+        bm_end = window_end.strftime('%Y-%m-%d')
 
-    else:
-        bm_init = init_date.strftime('%Y-%m-%d')
-        bm_end = yesterday.strftime('%Y-%m-%d')
+        print(f'Atualizando {bm} [{bm_init}] -> [{bm_end}]')
 
-        print(f'Atualizando {bm} [{init_date}] -> [{bm_end}]')
         if is_accounts:
-            bm_data = bm_function(bm_accounts, bm_init, bm_end)
-            
+            bm_temp = bm_function(bm_accounts, bm_init, bm_end)
+        
         if is_campaigns:
+            
             if bm == 'Twitter':
-                bm_data = bm_function(bm_campaigns, bm_init, bm_end)
+                bm_temp = bm_function(bm_campaigns, bm_init, bm_end)
 
             if bm == 'CampaignManager':
-                bm_data = bm_function(campaign_path, bm_campaigns, bm_init, bm_end)
-                
-        bm_data.sort_values('date', inplace = True, ignore_index = False)
-        bm_data.to_excel(bm_file, sheet_name = f'{bm.lower()}_prep', index = False)
+                bm_temp = bm_function(campaign_path, bm_campaigns, bm_init, bm_end)
+
+        storage.replace(table, bm_temp, window_start, window_end)
+        coverage.add(table, window_start, window_end)
+
+        # No replay as janelas gravadas podem se sobrepor: a mais recente substitui os mesmos dias.
+        bm_frames = [drop_windows(df, [(window_start, window_end)]) for df in bm_frames]
+        bm_frames.append(bm_temp)
+
+    bm_data = concat_dates(bm_frames)
+
+    if windows:
         print(f'{bm} atualizado!')
 
+    if EXPORT_PREP_EXCEL:
+        export_excel(campaign_path, {table: bm_data})
+
     return bm_data
 
 def update_ga(campaign_path: str, view_id: str, init_date: datetime.date, **kwargs) -> pd.DataFrame:
@@ -195,58 +240,62 @@ def update_ga(campaign_path: str, view_id: str, init_date: datetime.date, **kwar
     ga_function = kwargs['ga_function']
 
     print(f'Atualizando Google Analytics [{ga.upper()}].')
-    ga_file = os.path.abspath(os.path.join(campaign_path, 'data', f'{ga}_googleAnalytics_prep.xlsx'))
-    
-    if os.path.isfile(ga_file):
-        ga_ov_saved = pd.read_excel(ga_file, sheet_name = 'ga_overview')
-        ga_ev_saved = pd.read_excel(ga_file, sheet_name = 'ga_events')
+    storage = get_storage(campaign_path)
+    coverage = Coverage(campaign_path)
+    ov_table = f'{ga}_ga_overview'
+    ev_table = f'{ga}_ga_events'
 
-        ga_ov_saved['ad_id'].fillna(0, inplace = True)
-        ga_ev_saved['ad_id'].fillna(0, inplace = True)
+    ga_ov_saved = ga_ev_saved = None
 
-        ga_ov_saved['ad_id'] = ga_ov_saved['ad_id'].astype(np.int64).astype(str)
-        ga_ov_saved['date'] = pd.to_datetime(ga_ov_saved['date'])
-        
-        ga_ev_saved['ad_id'] = ga_ev_saved['ad_id'].astype(np.int64).astype(str)
-        ga_ev_saved['date'] = pd.to_datetime(ga_ev_saved['date'])
+    if storage.exists(ov_table) and storage.exists(ev_table):
+        ga_ov_saved = storage.read(ov_table)
+        ga_ev_saved = storage.read(ev_table)
+        coverage.seed(ov_table, storage.dates(ov_table))
 
-        ga_init = (ga_ov_saved['date'].max().date() + datetime.timedelta(days = 1)).strftime('%Y-%m-%d')
-        ga_end = yesterday.strftime('%Y-%m-%d')
+    # Overview e events são sempre coletados juntos, então a cobertura do overview vale para os dois.
+    windows = plan_windows('GoogleAnalytics', view_id, coverage.covered(ov_table), init_date, yesterday)
+    ov_frames = [drop_windows(ga_ov_saved, windows)]
+    ev_frames = [drop_windows(ga_ev_saved, windows)]
 
-        if ga_ov_saved['date'].max().date() == yesterday:
-            print(f'Google Analytics [{ga.upper()}] já atualizado!')
-            ga_ov_data = ga_ov_saved
-            ga_ev_data = ga_ev_saved
-        
-        else:
-            print(f'Atualizando Google Analytics [{ga.upper()}] [{ga_init}] -> [{ga_end}]')
+    if not windows:
+        print(f'Google Analytics [{ga.upper()}] já atualizado!')
 
-            ga_ov_temp, ga_ev_temp = ga_function(view_id, campaigns, ga_init, ga_end)
-            ga_ov_data = pd.concat([ga_ov_saved, ga_ov_temp], axis = 0, ignore_index = True)
-            ga_ev_data = pd.concat([ga_ev_saved, ga_ev_temp], axis = 0, ignore_index = True)
+    for window_start, window_end in windows:
+        ga_init = window_start.strftime('%Y-%m-%d')
+        ga_end = window_end.strftime('%Y-%m-%d')
+
+        print(f'Atualizando Google Analytics [{ga.upper()}] [{ga_init}] -> [{ga_end}]')
 
-            writer = pd.ExcelWriter(ga_file)
-            ga_ov_data.to_excel(writer, index = False, sheet_name = 'ga_overview')
-            ga_ev_data.to_excel(writer, index = False, sheet_name = 'ga_events')
-            writer.save()
+        try:
+            ga_ov_temp, ga_ev_temp = ga_function(view_id, campaigns, ga_init, ga_end)
 
-            print(f'Google Analytics [{ga.upper()}] atualizado!')
+        except archive.ArchiveMissing:
+            # O GA de BM e o do Campaign Manager gravam na mesma pasta da view: no replay, uma janela
+            # gravada só pelo outro não tem as respostas destas campanhas.
+            if not archive.is_replay():
+                raise
+            print(f'Google Analytics [{ga.upper()}] [{ga_init}] -> [{ga_end}] não foi gravado para estas campanhas, janela pulada.')
+            continue
 
-    else:
-        
-        ga_init = init_date.strftime('%Y-%m-%d')
-        ga_end = yesterday.strftime('%Y-%m-%d')
+        storage.replace(ov_table, ga_ov_temp, window_start, window_end)
+        storage.replace(ev_table, ga_ev_temp, window_start, window_end)
+        coverage.add(ov_table, window_start, window_end)
 
-        print(f'Atualizando Google Analytics [{ga.upper()}] [{ga_init}] -> [{ga_end}]')
-        ga_ov_data, ga_ev_data = ga_function(view_id, campaigns, ga_init, ga_end)
+        # No replay as janelas gravadas podem se sobrepor: a mais recente substitui os mesmos dias.
+        ov_frames = [drop_windows(df, [(window_start, window_end)]) for df in ov_frames]
+        ev_frames = [drop_windows(df, [(window_start, window_end)]) for df in ev_frames]
+        ov_frames.append(ga_ov_temp)
+        ev_frames.append(ga_ev_temp)
 
-        writer = pd.ExcelWriter(ga_file)
-        ga_ov_data.to_excel(writer, index = False, sheet_name = 'ga_overview')
-        ga_ev_data.to_excel(writer, index = False, sheet_name = 'ga_events')
-        writer.save()
+    ga_ov_data = concat_dates(ov_frames)
+    ga_ev_data = concat_dates(ev_frames)
 
+    if windows:
         print(f'Google Analytics [{ga.upper()}] atualizado!')
 
+    if EXPORT_PREP_EXCEL:
+        export_excel(campaign_path, {ov_table: ga_ov_data, ev_table: ga_ev_data})
+
     return ga_ov_data, ga_ev_data
 
 def merge_ga(pr_df: pd.DataFrame, ga_overview: pd.DataFrame, ga_events: pd.DataFrame, **kwargs) -> tuple:
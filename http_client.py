@@ -0,0 +1,123 @@
+import time
+import threading
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import retry
+
+# Conexões mantidas abertas por host. Chamadas em sequência ao mesmo host (ex.: uma por criativo
+# no LinkedIn) reaproveitam a conexão em vez de abrir TCP + TLS de novo a cada requisição.
+POOL_SIZE = 10
+
+# (conexão, leitura) em segundos. Relatórios grandes (Adjust, TikTok) podem demorar para começar a responder.
+TIMEOUT = (10, 300)
+
+HEADERS = {
+    'Accept-Encoding': 'gzip, deflate'
+}
+
+# Métodos que podem ser repetidos sem efeito colateral na plataforma.
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Funções chamadas ao fim de cada requisição com (método, url, status, segundos).
+TIMING_HOOKS = []
+
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+def host(url: str) -> str:
+
+    return urllib.parse.urlsplit(url).netloc
+
+def get_session(url: str) -> requests.Session:
+    '''Sessão compartilhada do host da url, criada na primeira chamada.'''
+
+    name = host(url)
+
+    with _sessions_lock:
+        if name not in _sessions:
+            adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = POOL_SIZE)
+
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+            _sessions[name] = session
+
+    return _sessions[name]
+
+def record_timing(method: str, url: str, status: int, seconds: float) -> None:
+
+    with _timings_lock:
+        stats = _timings.setdefault(host(url), {'requests': 0, 'seconds': 0.0})
+        stats['requests'] += 1
+        stats['seconds'] += seconds
+
+    for hook in TIMING_HOOKS:
+        hook(method, url, status, seconds)
+
+    return
+
+def send(method: str, url: str, **kwargs) -> requests.Response:
+
+    start_time = time.perf_counter()
+    status = None
+
+    try:
+        response = get_session(url).request(method, url, **kwargs)
+        status = response.status_code
+    finally:
+        record_timing(method, url, status, time.perf_counter() - start_time)
+
+    # Erros temporários da plataforma viram exceção para que a chamada seja repetida (retry.py).
+    if response.status_code in retry.RETRY_STATUS:
+        response.raise_for_status()
+
+    return response
+
+def request(method: str, url: str, platform: str = '', account = '', **kwargs) -> requests.Response:
+    '''
+    Mesmos parâmetros de requests.request, usando a sessão do host e TIMEOUT como padrão.
+    - com platform, a chamada respeita o limite de chamadas da plataforma e da conta (rate_limit.py)
+    - erros temporários (5xx, conexão, timeout) são repetidos; POSTs só quando a requisição não chegou a ser enviada
+    '''
+
+    kwargs.setdefault('timeout', TIMEOUT)
+
+    return retry.call_api(platform, account, lambda: send(method, url, **kwargs), idempotent = method in IDEMPOTENT_METHODS)
+
+def get(url: str, platform: str = '', account = '', **kwargs) -> requests.Response:
+
+    return request('GET', url, platform, account, **kwargs)
+
+def post(url: str, platform: str = '', account = '', **kwargs) -> requests.Response:
+
+    return request('POST', url, platform, account, **kwargs)
+
+
+def reset_timings() -> None:
+
+    with _timings_lock:
+        _timings.clear()
+
+    return
+
+def timings() -> dict:
+    '''Número de requisições e tempo total por host desde o último reset_timings.'''
+
+    with _timings_lock:
+        return {name: dict(stats) for name, stats in _timings.items()}
+
+def print_timings() -> None:
+
+    for name, stats in sorted(timings().items()):
+        print(f"{name}: {stats['requests']} requisições, {stats['seconds']:.1f}s")
+
+    return
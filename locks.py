@@ -0,0 +1,35 @@
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+@contextlib.contextmanager
+def file_lock(path: str):
+    '''
+    Trava exclusiva entre processos, no arquivo {path}.lock (fcntl no Linux/Mac, msvcrt no Windows).
+    Cada abertura do arquivo é uma trava separada, então threads do mesmo processo também esperam umas pelas outras.
+    '''
+
+    with open(f'{path}.lock', 'a+') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        elif msvcrt:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            elif msvcrt:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+# Respostas de descoberta de contas (nome -> id) guardadas entre campanhas e execuções.
+CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cache', 'lookups'))
+
+# Validade, em segundos, das respostas de cada plataforma.
+LOOKUP_TTL = {
+    'Facebook': 24 * 60 * 60,
+    'GoogleAds': 24 * 60 * 60,
+    'TikTok': 24 * 60 * 60,
+    'LinkedIn': 24 * 60 * 60,
+    'CampaignManager': 7 * 24 * 60 * 60
+}
+
+DEFAULT_LOOKUP_TTL = 24 * 60 * 60
+
+_cache_lock = threading.Lock()
+
+
+def cache_path(namespace: str, key: str) -> str:
+
+    return os.path.join(CACHE_DIR, f'{namespace}-{hashlib.sha1(str(key).encode()).hexdigest()[:12]}.json')
+
+def read(namespace: str, key: str) -> dict:
+
+    path = cache_path(namespace, key)
+
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+def write(namespace: str, key: str, value) -> None:
+
+    path = cache_path(namespace, key)
+    os.makedirs(CACHE_DIR, exist_ok = True)
+
+    # Cada processo grava no seu temporário; o os.replace deixa o arquivo sempre inteiro.
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'key': key, 'saved_at': time.time(), 'value': value}, f)
+
+    os.replace(temp_path, path)
+
+    return
+
+def cached(namespace: str, key: str, fetch, valid = None, ttl: int = None):
+    '''
+    Resposta de fetch() guardada em disco por ttl segundos (LOOKUP_TTL da plataforma por padrão).
+    - namespace: plataforma da chamada
+    - key: identifica a chamada dentro da plataforma
+    - valid: função que recebe a resposta guardada e diz se ela ainda serve (ex.: todas as contas
+      pedidas estão nela). Quando não serve, a resposta é pedida de novo mesmo dentro do ttl.
+    '''
+
+    ttl = LOOKUP_TTL.get(namespace, DEFAULT_LOOKUP_TTL) if ttl is None else ttl
+
+    with _cache_lock:
+        entry = read(namespace, key)
+
+    if entry is not None and time.time() - entry['saved_at'] < ttl and (valid is None or valid(entry['value'])):
+        return entry['value']
+
+    value = fetch()
+
+    with _cache_lock:
+        write(namespace, key, value)
+
+    return value
+
+def invalidate(namespace: str = None, key: str = None) -> None:
+    '''Apaga as respostas guardadas: todas, as de uma plataforma ou uma só.'''
+
+    if not os.path.isdir(CACHE_DIR):
+        return
+
+    with _cache_lock:
+        if namespace is not None and key is not None:
+            paths = [cache_path(namespace, key)]
+        else:
+            paths = [os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR) if namespace is None or name.startswith(f'{namespace}-')]
+
+        for path in paths:
+            if os.path.isfile(path):
+                os.remove(path)
+
+    return
@@ -1,262 +1,427 @@
+import time
+STARTUP_TIME = time.perf_counter()
+
 import pandas as pd
 
 import os
+import argparse
+import traceback
+import contextlib
 
 import datetime
 
-from api.api_facebook import get_facebook
-from api.api_googleAds import get_googleAds
-from api.api_campaign_manager import get_CampaignManager
-from api.api_twitter import get_twitter
-from api.api_tiktok import get_tiktok
-from api.api_linkedin import get_linkedin
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from api.api_googleAnalytics import get_googleAnalytics_bm
-from api.api_googleAnalytics import get_googleAnalytics_cm
+from connectors import LazyConnector, IMPORT_TIMES, measure_import_times
 
 from functions import *
+from pipeline import Stage, Pipeline
+from manifest import table_summary
+from outputs import output_formats, output_files, write_output
+from fetch_planner import PLANNER, PLANNED_PLATFORMS
+from warehouse import merge_ga_sql
+
+import storage
+import archive
+import http_client
+import lookup_cache
 
 import warnings
 warnings.filterwarnings('ignore')
 
-def main():
+# Tempo gasto importando o main.py e suas dependências, sem os SDKs das plataformas.
+STARTUP_TIME = time.perf_counter() - STARTUP_TIME
 
-    main_dir = os.path.dirname(os.path.abspath(__file__))
-    campaign_dir = os.path.abspath(os.path.join(main_dir, '..', 'campanhas'))
-    paramet_dir = os.path.abspath(os.path.join(main_dir, '..', 'parametrização'))
+def is_campaign_active(campaign: pd.Series) -> bool:
+    '''Verifica se a campanha está sendo veiculada (ou terminou ontem).'''
 
-    campaigns = pd.read_excel(os.path.abspath(os.path.join(campaign_dir, 'campanhas.xlsx')))
-    campaigns.fillna('', inplace = True)
+    today = datetime.datetime.today().date()
 
-    list_campaings = []
+    return campaign['data_inicio'].date() < today <= campaign['data_fim'].date() + datetime.timedelta(days = 1)
 
-    for _, campaign in campaigns.iterrows():
+# Plataformas na ordem em que entram na base final.
+# - column: coluna da planilha de campanhas com as contas/campanhas separadas por vírgula
+# - kwarg: argumento do update_bm que recebe os valores da coluna
+# - param_name: nome da plataforma no merge_params
+# - content: se a base é separada entre anúncios com e sem content antes do merge com a parametrização
+# - ga: nome da plataforma no merge_ga (None quando o GA usado é o do Campaign Manager)
+# - prep_only: colunas que só ficam na base salva (chave natural das linhas, warehouse.NATURAL_KEYS) e saem antes do concat_pr
+PLATFORMS = {
+    'Facebook': {'column': 'facebook', 'kwarg': 'accounts', 'function': LazyConnector('Facebook'), 'param_name': 'facebook', 'content': True, 'ga': 'facebook', 'prep_only': ['publisher_platform']},
+    'GoogleAds': {'column': 'google', 'kwarg': 'accounts', 'function': LazyConnector('GoogleAds'), 'param_name': 'googleAds', 'content': True, 'ga': 'google', 'prep_only': []},
+    'TikTok': {'column': 'tiktok', 'kwarg': 'accounts', 'function': LazyConnector('TikTok'), 'param_name': 'TikTok', 'content': False, 'ga': 'tiktok', 'prep_only': []},
+    'Linkedin': {'column': 'linkedin', 'kwarg': 'accounts', 'function': LazyConnector('Linkedin'), 'param_name': 'Linkedin', 'content': False, 'ga': 'linkedin', 'prep_only': []},
+    'Twitter': {'column': 'twitter', 'kwarg': 'campaigns', 'function': LazyConnector('Twitter'), 'param_name': 'twitter', 'content': True, 'ga': 'twitter', 'prep_only': ['line_item_id']},
+    'CampaignManager': {'column': 'campaign_manager', 'kwarg': 'campaigns', 'function': LazyConnector('CampaignManager'), 'param_name': None, 'content': False, 'ga': None, 'prep_only': []}
+}
 
-        is_active = False
-        is_updated = False
-        have_bm = False
-        have_cm = False
+# Plataformas cujas campanhas são usadas no filtro do Google Analytics de BM.
+GA_BM_PLATFORMS = ['GoogleAds', 'Facebook']
 
-        is_facebook = False
-        is_google = False
-        is_twitter = False
-        is_tiktok = False
-        is_linkedin = False
-        is_analytics = False
+def fetch_platform(campaign_path: str, init_date: datetime.date, bm: str, values: list) -> pd.DataFrame:
+    '''Atualiza a base de uma plataforma.'''
 
-        campaign_name = campaign['campanha']
-        campaign_path = os.path.abspath(os.path.join(campaign_dir, campaign_name.lower()))
+    platform = PLATFORMS[bm]
+    bm_kwargs = {platform['kwarg']: values}
 
-        campaign_param_path = os.path.abspath(os.path.join(paramet_dir, campaign['nome_parametrizacao'] + '.xlsm'))
+    # Contas compartilhadas com outras campanhas do mesmo processo são coletadas uma vez só.
+    bm_function = PLANNER.wrap(bm, platform['function'])
 
-        if not os.path.isfile(campaign_param_path):
-            campaign_param_path = os.path.abspath(os.path.join(paramet_dir, campaign['nome_parametrizacao'] + '.xlsx'))
-        
-        campaign_start = campaign['data_inicio'].date()
-        campaign_end = campaign['data_fim'].date()
+    df = update_bm(campaign_path, init_date, bm = bm, bm_function = bm_function, **bm_kwargs)
 
-        today = datetime.datetime.today().date()
-        yesterday = today - datetime.timedelta(days = 1)
+    if bm != 'CampaignManager':
+        df.fillna('', inplace = True)
 
-        init_date = campaign_start
-        end_date = yesterday
+    return df
 
-        if campaign_start < today <= campaign_end + datetime.timedelta(days = 1):
-            is_active = True
+def merge_platform(bm: str, campaign_path: str, df: pd.DataFrame, param: pd.DataFrame) -> pd.DataFrame:
+    '''Junta a base de uma plataforma com a parametrização da campanha.'''
 
-            if not os.path.isdir(campaign_path):
-                os.mkdir(campaign_path)
-                os.mkdir(os.path.join(campaign_path, 'data'))
-                os.mkdir(os.path.join(campaign_path, 'source'))
-            
-            if is_active:
-                param = pd.read_excel(campaign_param_path, sheet_name = 'mas_parametrizacao')
-                param.drop(columns = ['id_parametro.1', 'term'], inplace = True)
-                param.fillna('', inplace = True)
+    platform = PLATFORMS[bm]
+    # O merge_params altera o dataframe recebido e a base da plataforma também é usada por outras etapas;
+    # o drop devolve uma cópia, já sem as colunas que só existem na base salva.
+    df = df.drop(columns = platform['prep_only'], errors = 'ignore')
 
-                param.rename(columns = {'Nome do criativo (para programação nas plataformas)': 'ad_name'}, inplace = True)
-                
-                facebook_accounts = campaign['facebook'].split(',') if campaign['facebook'] else False
-                google_accounts = campaign['google'].split(',') if campaign['google'] else False
-                tiktok_accounts = campaign['tiktok'].split(',') if campaign['tiktok'] else False
-                linkedin_accounts = campaign['linkedin'].split(',') if campaign['linkedin'] else False
-                twitter_campaigns = campaign['twitter'].split(',') if campaign['twitter'] else False
-                cm_campaigns = campaign['campaign_manager'].split(',') if campaign['campaign_manager'] else False
+    if bm == 'CampaignManager':
+        pr_df = merge_cm_params(df, param, campaign_path)
 
-                view_id = str(int(campaign['ga'])) if campaign['ga'] else ''
+    elif platform['content']:
+        no_content_df = df[df['content'] == '']
+        content_df = df.drop(df[df['content'] == ''].index)
 
-                if view_id:
-                    is_analytics = True
+        content_pr = merge_params(content_df, param, campaign_path, platform['param_name'], content = True)
+        no_content_pr = merge_params(no_content_df, param, campaign_path, platform['param_name'], content = False)
 
-                print(f'Atualizando campanha: {campaign_name}')
+        pr_df = pd.concat([content_pr, no_content_pr], axis = 0, ignore_index = True)
 
-                source_folder = os.path.abspath(os.path.join(campaign_path, 'source'))
-                pr = os.path.abspath(os.path.join(source_folder, 'concat_pr.xlsx'))
-                gaov = os.path.abspath(os.path.join(source_folder, 'concat_ga.xlsx'))
+    else:
+        pr_df = merge_params(df, param, campaign_path, platform['param_name'], content = False)
 
-                if os.path.isfile(gaov):
-                    temp_gaov = pd.read_excel(gaov, sheet_name = 'concat_gaov')
+    pr_df.sort_values('date', inplace = True, ignore_index = True)
 
-                    if temp_gaov.date.max() == yesterday:
-                        is_updated = True
-                        print(f'{campaign_name} já atualizado!')
+    return pr_df
 
-                concat_pr = []
-                concat_ov = []
-                concat_ev = []
+def fetch_ga_bm(campaign_path: str, view_id: str, init_date: datetime.date, bm_names: list, *bm_frames) -> tuple:
+    '''Atualiza o Google Analytics de BM com as campanhas das bases de Facebook e Google Ads.'''
 
-                if not is_updated:
-                    if facebook_accounts:
-                        have_bm = True
-                        is_facebook = True
+    bm_campaigns = []
 
-                        facebook = update_bm(campaign_path, init_date, bm = 'Facebook', accounts = facebook_accounts, bm_function = get_facebook)
-                        facebook.fillna('', inplace = True)
+    for bm, bm_df in zip(bm_names, bm_frames):
+        bm_campaigns += list(bm_df.campaign.str.replace('  ', ' ').unique()) if bm == 'GoogleAds' else list(bm_df.campaign.unique())
 
-                        no_content_facebook = facebook[facebook['content'] == '']
-                        content_facebook = facebook.drop(facebook[facebook['content'] == ''].index)
+    return update_ga(campaign_path, view_id, init_date, ga = 'bm', campaigns = bm_campaigns, ga_function = LazyConnector('GoogleAnalyticsBM'))
 
-                        content_facebook_pr = merge_params(content_facebook, param, campaign_path, 'facebook', content = True)
-                        no_content_facebook_pr = merge_params(no_content_facebook, param, campaign_path, 'facebook', content = False)
+def fetch_ga_cm(campaign_path: str, view_id: str, init_date: datetime.date, cm_campaigns: list) -> tuple:
+    '''Atualiza o Google Analytics do Campaign Manager.'''
 
-                        facebook_pr = pd.concat([content_facebook_pr, no_content_facebook_pr], axis = 0, ignore_index = True)
-                        facebook_pr.sort_values('date', inplace = True, ignore_index = True)
-                        concat_pr.append(facebook_pr)
+    return update_ga(campaign_path, view_id, init_date, ga = 'cm', campaigns = cm_campaigns, ga_function = LazyConnector('GoogleAnalyticsCM'))
 
-                    if google_accounts:
-                        have_bm = True
-                        is_google = True
+def merge_platform_ga(bm: str, campaign_path: str, pr_df: pd.DataFrame, overview: pd.DataFrame, events: pd.DataFrame) -> tuple:
+    '''Junta a base parametrizada de uma plataforma com o Google Analytics.'''
 
-                        googleAds = update_bm(campaign_path, init_date, bm = 'GoogleAds', accounts = google_accounts, bm_function = get_googleAds)
-                        googleAds.fillna('', inplace = True)
-
-                        no_content_googleAds = googleAds[googleAds['content'] == '']
-                        content_googleAds = googleAds.drop(googleAds[googleAds['content'] == ''].index)  
-
-                        content_googleAds_pr = merge_params(content_googleAds, param, campaign_path, 'googleAds', content = True)
-                        no_content_googleAds_pr = merge_params(no_content_googleAds, param, campaign_path, 'googleAds', content = False)
-
-                        googleAds_pr = pd.concat([content_googleAds_pr, no_content_googleAds_pr], axis = 0, ignore_index = True)
-                        googleAds_pr.sort_values('date', inplace = True, ignore_index = True)
-                        concat_pr.append(googleAds_pr)
-
-                    if tiktok_accounts:
-                        have_bm = True
-                        is_tiktok = True
-
-                        tiktok = update_bm(campaign_path, init_date, bm = 'TikTok', accounts = tiktok_accounts, bm_function = get_tiktok)
-                        tiktok.fillna('', inplace = True)
-
-                        tiktok_pr = merge_params(tiktok, param, campaign_path, 'TikTok', content = False)
-
-                        tiktok_pr.sort_values('date', inplace = True, ignore_index = True)
-                        concat_pr.append(tiktok_pr)
-
-                    if linkedin_accounts:
-                        have_bm = True
-                        is_linkedin = True
-
-                        linkedin = update_bm(campaign_path, init_date, bm = 'Linkedin', accounts = linkedin_accounts, bm_function = get_linkedin)
-                        linkedin.fillna('', inplace = True)
-
-                        linkedin_pr = merge_params(linkedin, param, campaign_path, 'Linkedin', content = False)
-
-                        linkedin_pr.sort_values('date', inplace = True, ignore_index = True)
-                        concat_pr.append(linkedin_pr)
-
-                    if twitter_campaigns:
-                        have_bm = True
-                        is_twitter = True
-
-                        twitter = update_bm(campaign_path, init_date, bm = 'Twitter', campaigns = twitter_campaigns, bm_function = get_twitter)
-                        twitter.fillna('', inplace = True)
-
-                        no_content_twitter = twitter[twitter['content'] == '']
-                        content_twitter = twitter.drop(twitter[twitter['content'] == ''].index)   
-                        
-                        content_twitter_pr = merge_params(content_twitter, param, campaign_path, 'twitter', content = True)
-                        no_content_twitter_pr = merge_params(no_content_twitter, param, campaign_path, 'twitter', content = False)
-                    
-                        twitter_pr = pd.concat([content_twitter_pr, no_content_twitter_pr], axis = 0, ignore_index = True)
-                        twitter_pr.sort_values('date', inplace = True, ignore_index = True)
-                        concat_pr.append(twitter_pr)
+    # Com as bases no banco, a junção é feita em SQL sobre as tabelas do GA da campanha.
+    if storage.STORAGE_BACKEND == 'sqlite':
+        return merge_ga_sql(pr_df, campaign_path, 'cm' if bm == 'CampaignManager' else PLATFORMS[bm]['ga'])
 
-                    if cm_campaigns:
-                        have_cm = True
+    # O merge com o GA altera o dataframe recebido, por isso é feito sobre uma cópia.
+    pr_df = pr_df.copy()
 
-                        campaign_manager = update_bm(campaign_path, init_date, bm = 'CampaignManager', campaigns = cm_campaigns, bm_function = get_CampaignManager)
-                        campaign_manager_pr = merge_cm_params(campaign_manager, param, campaign_path)
+    if bm == 'CampaignManager':
+        return merge_ga_cm(pr_df, overview, events)
 
-                        campaign_manager_pr.sort_values('date', inplace = True, ignore_index = True)
-                        concat_pr.append(campaign_manager_pr)
+    return merge_ga(pr_df, overview, events, bm = PLATFORMS[bm]['ga'])
 
-                    print('Criando base de BM.')
-                    concat_pr_all = pd.concat(concat_pr, axis = 0, ignore_index = True)
-                    concat_pr_all.to_excel(pr, index = False, sheet_name = 'concat_pr')
+def write_concat_pr(source_folder: str, file_format: str, *prs) -> None:
 
-                    if have_bm and is_analytics:
-                        bm_campaigns = []
-                        bm_campaigns += list(googleAds.campaign.str.replace('  ', ' ').unique())
-                        bm_campaigns += list(facebook.campaign.unique())
-
-                        bm_overview, bm_events = update_ga(campaign_path, view_id, init_date, ga = 'bm', campaigns = bm_campaigns, ga_function = get_googleAnalytics_bm)
+    print('Criando base de BM.')
+    write_output(source_folder, 'concat_pr', {'concat_pr': list(prs)}, file_format)
 
-                        if is_facebook:
-                            facebook_ov, facebook_ev = merge_ga(facebook_pr, bm_overview, bm_events, bm = 'facebook')
-                            concat_ov.append(facebook_ov)
-                            concat_ev.append(facebook_ev)
-                            
-                        if is_google:
-                            googleAds_ov, googleAds_ev = merge_ga(googleAds_pr, bm_overview, bm_events, bm = 'google')
-                            concat_ov.append(googleAds_ov)
-                            concat_ev.append(googleAds_ev)
-                        
-                        if is_tiktok:
-                            tiktok_ov, tiktok_ev = merge_ga(tiktok_pr, bm_overview, bm_events, bm = 'tiktok')
-                            concat_ov.append(tiktok_ov)
-                            concat_ev.append(tiktok_ev)
-
-                        if is_linkedin:
-                            linkedin_ov, linkedin_ev = merge_ga(linkedin_pr, bm_overview, bm_events, bm = 'linkedin')
-                            concat_ov.append(linkedin_ov)
-                            concat_ev.append(linkedin_ev)
-
-                        if is_twitter:
-                            twitter_ov, twitter_ev = merge_ga(twitter_pr, bm_overview, bm_events, bm = 'twitter')
-                            concat_ov.append(twitter_ov)
-                            concat_ev.append(twitter_ev)
-
-                    if have_cm and is_analytics:
-                        cm_overview, cm_events = update_ga(campaign_path, view_id, init_date, ga = 'cm', campaigns = cm_campaigns, ga_function = get_googleAnalytics_cm)
-                        campaign_manager_ov, campaign_manager_ev = merge_ga_cm(campaign_manager_pr, cm_overview, cm_events)
-                        concat_ov.append(campaign_manager_ov)
-                        concat_ev.append(campaign_manager_ev)
-                    
-                    if is_analytics:
-                        concat_gaov = pd.concat(concat_ov, axis = 0, ignore_index = True)
-                        concat_gaev = pd.concat(concat_ev, axis = 0, ignore_index = True)
-
-                        print('Criando base de GA.')
-
-                        if campaign_name == 'Cultura' or campaign_name == 'Circuito Agro':
-                            concat_gaov.to_csv(os.path.abspath(os.path.join(source_folder, 'concat_ga.csv')), encoding = 'utf-8', index = False)
-
-                        else:
-                            writer = pd.ExcelWriter(gaov)
-                            concat_gaov.to_excel(writer, index = False, sheet_name = 'concat_gaov')
-                            concat_gaev.to_excel(writer, index = False, sheet_name = 'concat_gaev')
-                            writer.save()
-
-                        
-                    if campaign_name == 'Soluções Digitais':
-                        adjust = update_adjust(campaign_path, init_date)
-
-                        adjust_os = os.path.abspath(os.path.join(source_folder, 'adjust_prep.xlsx'))
-                        adjust.to_excel(adjust_os, index = False, sheet_name = 'adjust_prep')
-
-            print(20*'-')
     return
 
+def write_concat_ga(source_folder: str, file_format: str, *ga_frames) -> None:
+
+    print('Criando base de GA.')
+    write_output(source_folder, 'concat_ga', {'concat_gaov': list(ga_frames[0::2]), 'concat_gaev': list(ga_frames[1::2])}, file_format)
+
+    return
+
+def write_adjust(campaign_path: str, init_date: datetime.date, source_folder: str, file_format: str) -> None:
+
+    adjust = update_adjust(campaign_path, init_date)
+    write_output(source_folder, 'adjust_prep', {'adjust_prep': [adjust]}, file_format)
+
+    return
+
+def campaign_stages(campaign_path: str, init_date: datetime.date, platform_values: dict, view_id: str, file_formats: dict) -> list:
+    '''
+    Monta as etapas de atualização de uma campanha a partir das plataformas configuradas.
+
+    Dependências:
+    - {plataforma} -> {plataforma}_pr -> concat_pr
+    - bases de Facebook/Google Ads -> ga_bm, ({plataforma}_pr + ga_bm) -> {plataforma}_gaov/gaev -> concat_ga
+    - ga_cm, (CampaignManager_pr + ga_cm) -> CampaignManager_gaov/gaev -> concat_ga
+    '''
+
+    source_folder = os.path.abspath(os.path.join(campaign_path, 'source'))
+
+    is_analytics = bool(view_id)
+    have_bm = any(bm != 'CampaignManager' for bm in platform_values)
+    have_cm = 'CampaignManager' in platform_values
+
+    stages = []
+
+    for bm, values in platform_values.items():
+        stages.append(Stage(f'update_{bm}', fetch_platform, outputs = [bm], params = (campaign_path, init_date, bm, values), fetch = True))
+        stages.append(Stage(f'merge_params_{bm}', merge_platform, inputs = [bm, 'param'], outputs = [f'{bm}_pr'], params = (bm, campaign_path)))
+
+    pr_files = output_files(source_folder, 'concat_pr', ['concat_pr'], file_formats['concat_pr'])
+    stages.append(Stage('concat_pr', write_concat_pr, inputs = [f'{bm}_pr' for bm in platform_values], params = (source_folder, file_formats['concat_pr']), targets = list(pr_files.values())))
+
+    if not is_analytics:
+        return stages
+
+    ga_frames = []
+
+    if have_bm:
+        bm_names = [bm for bm in GA_BM_PLATFORMS if bm in platform_values]
+        stages.append(Stage('update_ga_bm', fetch_ga_bm, inputs = bm_names, outputs = ['ga_bm_overview', 'ga_bm_events'], params = (campaign_path, view_id, init_date, bm_names), fetch = True))
+
+        for bm in platform_values:
+            if bm != 'CampaignManager':
+                stages.append(Stage(f'merge_ga_{bm}', merge_platform_ga, inputs = [f'{bm}_pr', 'ga_bm_overview', 'ga_bm_events'], outputs = [f'{bm}_gaov', f'{bm}_gaev'], params = (bm, campaign_path)))
+                ga_frames += [f'{bm}_gaov', f'{bm}_gaev']
+
+    if have_cm:
+        stages.append(Stage('update_ga_cm', fetch_ga_cm, outputs = ['ga_cm_overview', 'ga_cm_events'], params = (campaign_path, view_id, init_date, platform_values['CampaignManager']), fetch = True))
+        stages.append(Stage('merge_ga_CampaignManager', merge_platform_ga, inputs = ['CampaignManager_pr', 'ga_cm_overview', 'ga_cm_events'], outputs = ['CampaignManager_gaov', 'CampaignManager_gaev'], params = ('CampaignManager', campaign_path)))
+        ga_frames += ['CampaignManager_gaov', 'CampaignManager_gaev']
+
+    ga_files = output_files(source_folder, 'concat_ga', ['concat_gaov', 'concat_gaev'], file_formats['concat_ga'])
+    stages.append(Stage('concat_ga', write_concat_ga, inputs = ga_frames, params = (source_folder, file_formats['concat_ga']), targets = list(ga_files.values())))
+
+    return stages
+
+def update_campaign(campaign: pd.Series, campaign_dir: str, paramet_dir: str, refetch: bool = False) -> None:
+    '''
+    Atualiza todas as bases de uma campanha ativa.
+
+    As etapas são montadas em campaign_stages e executadas pelo Pipeline: etapas independentes
+    rodam ao mesmo tempo, as coletas rodam sempre e a escrita dos arquivos finais é pulada quando
+    as bases não mudaram desde a última execução. Com refetch a campanha roda inteira mesmo que já
+    esteja atualizada até ontem.
+    '''
+
+    is_updated = False
+
+    campaign_name = campaign['campanha']
+    campaign_path = os.path.abspath(os.path.join(campaign_dir, campaign_name.lower()))
+
+    campaign_param_path = os.path.abspath(os.path.join(paramet_dir, campaign['nome_parametrizacao'] + '.xlsm'))
+
+    if not os.path.isfile(campaign_param_path):
+        campaign_param_path = os.path.abspath(os.path.join(paramet_dir, campaign['nome_parametrizacao'] + '.xlsx'))
+
+    campaign_start = campaign['data_inicio'].date()
+
+    today = datetime.datetime.today().date()
+    yesterday = today - datetime.timedelta(days = 1)
+
+    init_date = campaign_start
+
+    if not os.path.isdir(campaign_path):
+        os.mkdir(campaign_path)
+        os.mkdir(os.path.join(campaign_path, 'data'))
+        os.mkdir(os.path.join(campaign_path, 'source'))
+
+    param = pd.read_excel(campaign_param_path, sheet_name = 'mas_parametrizacao')
+    param.drop(columns = ['id_parametro.1', 'term'], inplace = True)
+    param.fillna('', inplace = True)
+
+    param.rename(columns = {'Nome do criativo (para programação nas plataformas)': 'ad_name'}, inplace = True)
+
+    platform_values = {bm: campaign[platform['column']].split(',') for bm, platform in PLATFORMS.items() if campaign[platform['column']]}
+
+    view_id = str(int(campaign['ga'])) if campaign['ga'] else ''
+
+    print(f'Atualizando campanha: {campaign_name}')
+
+    source_folder = os.path.abspath(os.path.join(campaign_path, 'source'))
+    file_formats = output_formats(campaign)
+    gaov = output_files(source_folder, 'concat_ga', ['concat_gaov', 'concat_gaev'], file_formats['concat_ga'])['concat_gaov']
+
+    # Só o manifesto é lido; sem manifesto válido a campanha roda e as etapas sem mudança são puladas pelo pipeline.
+    gaov_summary = table_summary(gaov, 'concat_gaov')
+
+    if not refetch and gaov_summary and gaov_summary['max_date'] == yesterday.strftime('%Y-%m-%d'):
+        is_updated = True
+        print(f'{campaign_name} já atualizado!')
+
+    if not is_updated:
+        stages = campaign_stages(campaign_path, init_date, platform_values, view_id, file_formats)
+
+        if campaign_name == 'Soluções Digitais':
+            adjust_files = output_files(source_folder, 'adjust_prep', ['adjust_prep'], file_formats['adjust_prep'])
+            stages.append(Stage('update_adjust', write_adjust, params = (campaign_path, init_date, source_folder, file_formats['adjust_prep']), fetch = True, targets = list(adjust_files.values())))
+
+        markers_path = os.path.abspath(os.path.join(campaign_path, 'data', 'pipeline_markers.json'))
+        Pipeline(stages, markers_path = markers_path, force = refetch).run({'param': param})
+
+    return
+
+def run_campaign(campaign: pd.Series, campaign_dir: str, paramet_dir: str, log_dir: str = '', refetch: bool = False) -> dict:
+    '''
+    Executa a atualização de uma campanha sem deixar que um erro interrompa as demais.
+    - entradas:
+        - linha da planilha de campanhas
+        - pasta das campanhas
+        - pasta das parametrizações
+        - pasta de logs, quando informada a saída da campanha é escrita em um arquivo próprio
+        - refetch: roda a campanha inteira, mesmo já atualizada e sem mudança nas bases
+
+    - saídas:
+        - dicionário com o nome da campanha, status, tempo de execução, erro e arquivo de log
+    '''
+
+    campaign_name = campaign['campanha']
+    result = {'campanha': campaign_name, 'status': 'ok', 'tempo': 0, 'erro': '', 'log': ''}
+
+    with contextlib.ExitStack() as stack:
+        if log_dir:
+            today = datetime.datetime.today().date()
+            result['log'] = os.path.abspath(os.path.join(log_dir, f'{today}_{campaign_name.lower()}.log'))
+
+            log_file = stack.enter_context(open(result['log'], 'w', encoding = 'utf-8'))
+            stack.enter_context(contextlib.redirect_stdout(log_file))
+            stack.enter_context(contextlib.redirect_stderr(log_file))
+
+        start_time = time.time()
+        http_client.reset_timings()
+
+        try:
+            update_campaign(campaign, campaign_dir, paramet_dir, refetch)
+
+        except Exception as error:
+            traceback.print_exc()
+            result['status'] = 'erro'
+            result['erro'] = repr(error)
+
+        result['tempo'] = round(time.time() - start_time)
+        http_client.print_timings()
+        print(20*'-')
+
+    return result
+
+def run_campaign_group(campaigns: list, campaign_dir: str, paramet_dir: str, log_dir: str = '', refetch: bool = False) -> list:
+    '''Executa em sequência, no mesmo processo, campanhas que compartilham contas.'''
+
+    return [run_campaign(campaign, campaign_dir, paramet_dir, log_dir, refetch) for campaign in campaigns]
+
+def group_campaigns(campaigns: list) -> list:
+    '''
+    Agrupa as campanhas que usam alguma conta em comum nas plataformas do FetchPlanner.
+    Campanhas do mesmo grupo rodam no mesmo processo e assim cada conta é coletada uma vez só.
+    '''
+
+    groups = []
+
+    for campaign in campaigns:
+        keys = {(bm, value.lower()) for bm in PLANNED_PLATFORMS for value in campaign[PLATFORMS[bm]['column']].split(',') if value}
+        shared = [group for group in groups if group['keys'] & keys]
+
+        merged = {'keys': keys, 'campaigns': [campaign]}
+        for group in shared:
+            merged['keys'] |= group['keys']
+            merged['campaigns'] = group['campaigns'] + merged['campaigns']
+            groups.remove(group)
+
+        groups.append(merged)
+
+    return [group['campaigns'] for group in groups]
+
+def print_summary(results: list) -> None:
+    '''Mostra o resumo de sucessos e falhas da execução.'''
+
+    failures = [result for result in results if result['status'] != 'ok']
+
+    print(f'Campanhas atualizadas: {len(results) - len(failures)} de {len(results)}')
+
+    for result in sorted(results, key = lambda x: x['campanha']):
+        print(f"[{result['status']}] {result['campanha']} ({result['tempo']}s) {result['erro']} {result['log']}".rstrip())
+
+    return
+
+def print_startup_times() -> None:
+    '''Mostra o tempo de import do main.py e de cada módulo de plataforma.'''
+
+    print(f'main.py: {STARTUP_TIME:.2f}s')
+
+    for module_name, seconds in measure_import_times().items():
+        print(f'{module_name}: {seconds:.2f}s')
+
+    print(f'Total: {STARTUP_TIME + sum(IMPORT_TIMES.values()):.2f}s')
+
+    return
+
+def main(workers: int = 1, refetch: bool = False):
+
+    main_dir = os.path.dirname(os.path.abspath(__file__))
+    campaign_dir = os.path.abspath(os.path.join(main_dir, '..', 'campanhas'))
+    paramet_dir = os.path.abspath(os.path.join(main_dir, '..', 'parametrização'))
+
+    campaigns = pd.read_excel(os.path.abspath(os.path.join(campaign_dir, 'campanhas.xlsx')))
+    campaigns.fillna('', inplace = True)
+
+    active_campaigns = [campaign for _, campaign in campaigns.iterrows() if is_campaign_active(campaign)]
+
+    results = []
+
+    if workers <= 1:
+        for campaign in active_campaigns:
+            results.append(run_campaign(campaign, campaign_dir, paramet_dir, refetch = refetch))
+
+    else:
+        # Cada grupo de campanhas roda em um processo próprio, com a saída de cada campanha isolada em um arquivo de log.
+        log_dir = os.path.abspath(os.path.join(campaign_dir, 'logs'))
+        os.makedirs(log_dir, exist_ok = True)
+
+        groups = group_campaigns(active_campaigns)
+
+        print(f'Atualizando {len(active_campaigns)} campanhas ({len(groups)} grupos de contas) com {workers} processos. Logs em {log_dir}')
+
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            futures = [executor.submit(run_campaign_group, group, campaign_dir, paramet_dir, log_dir, refetch) for group in groups]
+
+            for future in as_completed(futures):
+                for result in future.result():
+                    print(f"[{result['status']}] {result['campanha']} ({result['tempo']}s)")
+                    results.append(result)
+
+    print(20*'-')
+    print_summary(results)
+
+    return results
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description = 'Atualiza as bases das campanhas ativas.')
+    parser.add_argument('-w', '--workers', type = int, default = 1, help = 'número de campanhas atualizadas em paralelo (padrão: 1, sequencial)')
+    parser.add_argument('--startup-time', action = 'store_true', help = 'mede o tempo de import do main.py e de cada plataforma e sai')
+    parser.add_argument('--archive', choices = ['record', 'replay'], help = 'guarda as respostas cruas das APIs (record) ou reprocessa a partir delas, sem chamar as plataformas (replay)')
+    parser.add_argument('--refetch', action = 'store_true', help = 'atualiza as campanhas já atualizadas até ontem e reescreve os arquivos finais mesmo sem mudança nas bases')
+    parser.add_argument('--refresh-lookups', action = 'store_true', help = 'apaga as contas guardadas em cache e busca de novo os ids nas plataformas')
+    args = parser.parse_args()
+
+    if args.refresh_lookups:
+        lookup_cache.invalidate()
+
+    if args.archive:
+        # A variável de ambiente também vale para os processos das campanhas em paralelo.
+        os.environ['MARKETING_ARCHIVE_MODE'] = args.archive
+        archive.set_mode(args.archive)
+
+    if args.startup_time:
+        print_startup_times()
+
+    else:
+        main(workers = args.workers, refetch = args.refetch)
@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+import datetime
+
+import pandas as pd
+
+# Cada arquivo de saída ou base ganha um {arquivo}.manifest.json com o resumo de cada aba/tabela.
+MANIFEST_SUFFIX = '.manifest.json'
+
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def schema_hash(df: pd.DataFrame) -> str:
+    '''Hash das colunas e tipos do dataframe.'''
+
+    return hashlib.sha1(repr([(column, str(dtype)) for column, dtype in df.dtypes.items()]).encode()).hexdigest()
+
+
+class Summary:
+    '''
+    Resumo de uma tabela montado parte por parte, para tabelas que são escritas em blocos.
+    - rows: número de linhas
+    - min_date / max_date: menor e maior data (None quando não há coluna date ou linhas)
+    - days: número de linhas de cada dia
+    - schema_hash / content_hash
+    '''
+
+    def __init__(self):
+        self.rows = 0
+        self.days = {}
+        self.schema_hash = None
+        self.digest = None
+
+    def update(self, df: pd.DataFrame) -> None:
+
+        if self.digest is None:
+            self.schema_hash = schema_hash(df)
+            self.digest = hashlib.sha1(self.schema_hash.encode())
+
+        self.rows += int(df.shape[0])
+        self.digest.update(pd.util.hash_pandas_object(df, index = False).values.tobytes())
+
+        if 'date' in df.columns and not df.empty:
+            dates = pd.to_datetime(df['date']).dt.strftime(DATE_FORMAT)
+            for date, rows in dates.value_counts().items():
+                self.days[date] = self.days.get(date, 0) + int(rows)
+
+        return
+
+    def result(self) -> dict:
+
+        if self.digest is None:
+            self.update(pd.DataFrame())
+
+        days = dict(sorted(self.days.items()))
+
+        return {
+            'rows': self.rows,
+            'min_date': min(days) if days else None,
+            'max_date': max(days) if days else None,
+            'days': days,
+            'schema_hash': self.schema_hash,
+            'content_hash': self.digest.hexdigest()
+        }
+
+
+def describe(df: pd.DataFrame) -> dict:
+    '''Resumo de uma tabela inteira guardado no manifesto (ver Summary).'''
+
+    summary = Summary()
+    summary.update(df)
+
+    return summary.result()
+
+def manifest_path(file_path: str) -> str:
+
+    return f'{file_path}{MANIFEST_SUFFIX}'
+
+def write_manifest(file_path: str, tables: dict) -> None:
+    '''Grava o manifesto de um arquivo com o resumo de cada tabela ({nome: resumo ou dataframe}).'''
+
+    manifest = {
+        'file': os.path.basename(file_path),
+        'written_at': datetime.datetime.now().isoformat(timespec = 'seconds'),
+        'tables': {name: describe(table) if isinstance(table, pd.DataFrame) else table for name, table in tables.items()}
+    }
+
+    temp_path = f'{manifest_path(file_path)}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent = 1)
+
+    os.replace(temp_path, manifest_path(file_path))
+
+    return
+
+def read_manifest(file_path: str) -> dict:
+    '''
+    Lê o manifesto de um arquivo. Retorna None quando não há manifesto ou quando o arquivo
+    foi alterado depois dele (ex.: editado à mão), e nesse caso o arquivo precisa ser lido.
+    '''
+
+    path = manifest_path(file_path)
+
+    if not os.path.isfile(path) or not os.path.exists(file_path):
+        return None
+
+    if os.path.getmtime(file_path) > os.path.getmtime(path):
+        return None
+
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def table_summary(file_path: str, table: str) -> dict:
+    '''Resumo de uma tabela do manifesto, ou None quando o manifesto não é válido.'''
+
+    manifest = read_manifest(file_path)
+
+    if manifest is None:
+        return None
+
+    return manifest['tables'].get(table)
@@ -0,0 +1,199 @@
+import os
+
+import pandas as pd
+
+from manifest import Summary, write_manifest
+from storage import infer_dtype, merge_dtype
+
+# Arquivos finais de cada campanha.
+OUTPUTS = ['concat_pr', 'concat_ga', 'adjust_prep']
+
+# Formato de cada arquivo final: 'xlsx', 'csv' ou 'parquet'.
+# A coluna formato_saida da planilha de campanhas vale para todos os arquivos da campanha; sem ela vale
+# OUTPUT_FORMATS ({campanha: {arquivo: formato}}) e depois DEFAULT_OUTPUT_FORMAT.
+DEFAULT_OUTPUT_FORMAT = 'xlsx'
+
+# Cultura e Circuito Agro sempre receberam o GA em concat_ga.csv; o concat_pr continua em xlsx.
+OUTPUT_FORMATS = {
+    'Cultura': {'concat_ga': 'csv'},
+    'Circuito Agro': {'concat_ga': 'csv'}
+}
+
+# Linhas convertidas e escritas por vez. As partes (bases de cada plataforma) já estão inteiras na memória;
+# os blocos evitam a cópia de um pd.concat de todas elas e a conversão da tabela inteira de uma vez.
+CHUNK_ROWS = 50000
+
+EXCEL_DATETIME_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+
+# Tipo no parquet de cada tipo do schema das bases (storage.infer_dtype).
+ARROW_TYPES = {
+    'int64': 'int64',
+    'float64': 'float64',
+    'bool': 'bool',
+    'datetime64[ns]': 'timestamp[ns]',
+    'object': 'string'
+}
+
+
+def output_formats(campaign: pd.Series) -> dict:
+    '''Formato de cada arquivo final da campanha: {arquivo: formato}.'''
+
+    configured = str(campaign.get('formato_saida', '')).strip().lower()
+    formats = OUTPUT_FORMATS.get(campaign['campanha'], {})
+
+    return {output: configured or formats.get(output, DEFAULT_OUTPUT_FORMAT) for output in OUTPUTS}
+
+def output_files(folder: str, name: str, tables: list, file_format: str) -> dict:
+    '''
+    Arquivo de cada tabela de uma saída.
+    - xlsx: todas as tabelas em {name}.xlsx, uma aba por tabela
+    - csv/parquet: a primeira tabela em {name}.{formato} e as demais em {tabela}.{formato}
+    '''
+
+    if file_format == 'xlsx':
+        return {table: os.path.abspath(os.path.join(folder, f'{name}.xlsx')) for table in tables}
+
+    return {table: os.path.abspath(os.path.join(folder, f'{name if i == 0 else table}.{file_format}')) for i, table in enumerate(tables)}
+
+def union_columns(frames: list) -> list:
+    '''Colunas de todas as partes, na ordem em que aparecem (a mesma do pd.concat).'''
+
+    columns = []
+    seen = set()
+
+    for df in frames:
+        for column in df.columns:
+            if column not in seen:
+                seen.add(column)
+                columns.append(column)
+
+    return columns
+
+def iter_chunks(frames: list, columns: list):
+    '''Percorre as partes em blocos de CHUNK_ROWS linhas, todos com as mesmas colunas.'''
+
+    for df in frames:
+        for start in range(0, df.shape[0], CHUNK_ROWS):
+            yield df.iloc[start:start + CHUNK_ROWS].reindex(columns = columns)
+
+
+def write_xlsx(file_path: str, tables: dict) -> dict:
+
+    import xlsxwriter
+
+    summaries = {}
+
+    # constant_memory grava cada linha no disco assim que a próxima começa.
+    workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True, 'strings_to_urls': False})
+    datetime_format = workbook.add_format({'num_format': EXCEL_DATETIME_FORMAT})
+
+    for sheet_name, frames in tables.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        columns = union_columns(frames)
+        summaries[sheet_name] = Summary()
+
+        worksheet.write_row(0, 0, columns)
+        row = 1
+
+        for chunk in iter_chunks(frames, columns):
+            summaries[sheet_name].update(chunk)
+
+            values = chunk.astype(object).where(chunk.notnull(), None).values.tolist()
+            for row_values in values:
+                for col, value in enumerate(row_values):
+                    if value is None:
+                        continue
+                    if isinstance(value, pd.Timestamp):
+                        worksheet.write_datetime(row, col, value.to_pydatetime(), datetime_format)
+                    else:
+                        worksheet.write(row, col, value)
+                row += 1
+
+    workbook.close()
+
+    return {name: summary.result() for name, summary in summaries.items()}
+
+def write_csv(file_path: str, frames: list) -> dict:
+
+    columns = union_columns(frames)
+    summary = Summary()
+
+    with open(file_path, 'w', encoding = 'utf-8', newline = '') as f:
+        pd.DataFrame(columns = columns).to_csv(f, index = False)
+
+        for chunk in iter_chunks(frames, columns):
+            summary.update(chunk)
+            chunk.to_csv(f, header = False, index = False)
+
+    return summary.result()
+
+def write_parquet(file_path: str, frames: list) -> dict:
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = union_columns(frames)
+    summary = Summary()
+
+    # O schema vem de todas as partes (uma coluna pode estar vazia ou ausente na primeira).
+    dtypes = {}
+    for df in frames:
+        for column in df.columns:
+            dtype = infer_dtype(df[column])
+            dtypes[column] = merge_dtype(dtypes[column], dtype) if column in dtypes else dtype
+
+    schema = pa.schema([(column, ARROW_TYPES[dtypes[column]]) for column in columns])
+
+    with pq.ParquetWriter(file_path, schema) as writer:
+        for chunk in iter_chunks(frames, columns):
+            summary.update(chunk)
+
+            # Colunas de texto podem misturar tipos entre as partes (ex.: ids numéricos e texto); no parquet ficam texto.
+            chunk = chunk.copy()
+            for column in columns:
+                if dtypes[column] == 'object':
+                    chunk[column] = chunk[column].astype(object).where(chunk[column].isnull(), chunk[column].astype(str))
+
+            writer.write_table(pa.Table.from_pandas(chunk, schema = schema, preserve_index = False))
+
+    return summary.result()
+
+
+def write_output(folder: str, name: str, tables: dict, file_format: str) -> list:
+    '''
+    Escreve uma saída da campanha em blocos de CHUNK_ROWS linhas, sem juntar as partes em um único dataframe.
+    As partes continuam inteiras na memória durante a escrita; o que se evita é a cópia do pd.concat.
+    - entradas:
+        - pasta e nome do arquivo (sem extensão)
+        - tabelas: {nome da tabela/aba: lista de dataframes que formam a tabela}
+        - formato: 'xlsx', 'csv' ou 'parquet'
+
+    - saídas:
+        - lista dos arquivos escritos
+
+    Cada arquivo é escrito em {arquivo}.tmp e renomeado no final, então quem lê o arquivo
+    (ex.: dashboards) nunca encontra um arquivo pela metade. Cada arquivo ganha o seu manifesto.
+    '''
+
+    files = output_files(folder, name, list(tables), file_format)
+    written = []
+
+    for file_path in dict.fromkeys(files.values()):
+        file_tables = {table: frames for table, frames in tables.items() if files[table] == file_path}
+        temp_path = f'{file_path}.tmp'
+
+        if file_format == 'xlsx':
+            summaries = write_xlsx(temp_path, file_tables)
+        elif file_format == 'csv':
+            summaries = {table: write_csv(temp_path, frames) for table, frames in file_tables.items()}
+        elif file_format == 'parquet':
+            summaries = {table: write_parquet(temp_path, frames) for table, frames in file_tables.items()}
+        else:
+            raise ValueError(f'Formato de saída desconhecido: {file_format}')
+
+        os.replace(temp_path, file_path)
+        write_manifest(file_path, summaries)
+
+        written.append(file_path)
+
+    return written
@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+
+class Stage:
+    '''
+    Etapa do pipeline de uma campanha.
+    - name: nome único da etapa
+    - function: função executada, chamada como function(*params, *valores das entradas)
+    - inputs: nomes dos artefatos que a etapa consome
+    - outputs: nomes dos artefatos que a etapa produz (a função retorna uma tupla quando há mais de um)
+    - params: argumentos fixos da etapa, também usados para decidir se ela precisa rodar de novo
+    - fetch: a etapa busca dados fora do pipeline (APIs das plataformas) e por isso roda sempre
+    - targets: arquivos escritos pela etapa; se algum não existir a etapa roda mesmo sem mudança nas entradas
+
+    Só etapas que apenas escrevem arquivos (targets, sem outputs) podem ser puladas: o resultado das
+    demais não é guardado entre execuções e precisa ser produzido de novo para as etapas seguintes.
+    '''
+
+    def __init__(self, name: str, function, inputs: list = None, outputs: list = None, params: tuple = (), fetch: bool = False, targets: list = None):
+        self.name = name
+        self.function = function
+        self.inputs = inputs or []
+        self.outputs = outputs or []
+        self.params = tuple(params)
+        self.fetch = fetch
+        self.targets = targets or []
+
+    def can_skip(self) -> bool:
+
+        return not self.fetch and not self.outputs and bool(self.targets)
+
+
+def fingerprint(value) -> str:
+    '''Gera um hash do valor, usado para saber se as entradas de uma etapa mudaram.'''
+
+    digest = hashlib.sha1()
+
+    if isinstance(value, pd.DataFrame):
+        digest.update(repr(list(value.columns)).encode())
+        digest.update(repr(list(value.dtypes.astype(str))).encode())
+        digest.update(pd.util.hash_pandas_object(value, index = True).values.tobytes())
+
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            digest.update(fingerprint(item).encode())
+
+    elif isinstance(value, dict):
+        for item_key in sorted(value, key = str):
+            digest.update(repr(item_key).encode())
+            digest.update(fingerprint(value[item_key]).encode())
+
+    else:
+        digest.update(repr(value).encode())
+
+    return digest.hexdigest()
+
+
+class Pipeline:
+    '''
+    Executa etapas que dependem umas das outras pelos artefatos que consomem e produzem.
+
+    As etapas cujas entradas estão prontas rodam ao mesmo tempo em threads. Ao terminar, cada etapa
+    que escreve arquivos grava em markers_path o hash das entradas com que rodou (só o hash, não os
+    dados); na execução seguinte, com as mesmas entradas e os arquivos ainda no lugar, ela é pulada.
+    Com force as marcas são ignoradas e todas as etapas rodam. Ao final é mostrado o caminho crítico.
+    '''
+
+    def __init__(self, stages: list, markers_path: str = '', max_workers: int = None, force: bool = False):
+        self.stages = {stage.name: stage for stage in stages}
+        self.markers_path = markers_path
+        self.force = force
+        self.max_workers = max_workers or max(len(stages), 1)
+
+        self.producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f'O artefato {output} é produzido por {self.producers[output]} e {stage.name}.')
+                self.producers[output] = stage.name
+
+        self.durations = {}
+        self.skipped = []
+
+    def load_markers(self) -> dict:
+        '''Hash das entradas da última execução concluída de cada etapa; marcas ilegíveis são descartadas.'''
+
+        if not self.markers_path or not os.path.isfile(self.markers_path):
+            return {}
+
+        try:
+            with open(self.markers_path, 'r', encoding = 'utf-8') as f:
+                markers = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        return markers if isinstance(markers, dict) else {}
+
+    def save_markers(self, markers: dict) -> None:
+
+        if not self.markers_path:
+            return
+
+        temp_path = f'{self.markers_path}.tmp'
+        with open(temp_path, 'w', encoding = 'utf-8') as f:
+            json.dump(markers, f, indent = 2, sort_keys = True)
+
+        os.replace(temp_path, self.markers_path)
+
+    def run(self, context: dict = None) -> dict:
+        '''
+        Executa o pipeline.
+        - entradas:
+            - artefatos iniciais (ex.: a parametrização da campanha)
+
+        - saídas:
+            - dicionário com todos os artefatos produzidos
+        '''
+
+        context = dict(context or {})
+
+        for stage in self.stages.values():
+            missing = [name for name in stage.inputs if name not in context and name not in self.producers]
+            if missing:
+                raise ValueError(f'A etapa {stage.name} depende de artefatos que ninguém produz: {missing}')
+
+        markers = self.load_markers()
+        pending = dict(self.stages)
+        running = {}
+
+        self.durations = {}
+        self.skipped = []
+
+        try:
+            with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+                while pending or running:
+
+                    for name, stage in list(pending.items()):
+                        if not all(input_name in context for input_name in stage.inputs):
+                            continue
+
+                        del pending[name]
+                        values = [context[input_name] for input_name in stage.inputs]
+                        stage_hash = fingerprint([stage.params, values]) if stage.can_skip() else None
+
+                        if stage_hash and not self.force and markers.get(name) == stage_hash and all(os.path.exists(target) for target in stage.targets):
+                            print(f'[{name}] entradas sem mudança, arquivos mantidos.')
+                            self.skipped.append(name)
+                            self.durations[name] = 0
+                            continue
+
+                        running[executor.submit(self.execute, stage, values)] = (stage, stage_hash)
+
+                    if not running:
+                        if pending:
+                            raise RuntimeError(f'Etapas sem como rodar: {list(pending)}')
+                        break
+
+                    done, _ = wait(running, return_when = FIRST_COMPLETED)
+
+                    for future in done:
+                        stage, stage_hash = running.pop(future)
+                        outputs, self.durations[stage.name] = future.result()
+
+                        context.update(outputs)
+                        if stage_hash:
+                            markers[stage.name] = stage_hash
+
+        finally:
+            self.save_markers(markers)
+
+        self.report()
+
+        return context
+
+    def execute(self, stage: Stage, values: list) -> tuple:
+
+        start_time = time.time()
+        result = stage.function(*stage.params, *values)
+        duration = time.time() - start_time
+
+        if len(stage.outputs) == 1:
+            result = (result,)
+
+        outputs = dict(zip(stage.outputs, result)) if stage.outputs else {}
+
+        return outputs, duration
+
+    def critical_path(self) -> tuple:
+        '''Retorna a sequência de etapas de maior duração somada e a duração total.'''
+
+        finish = {}
+        previous = {}
+
+        def visit(name):
+            if name in finish:
+                return finish[name]
+
+            parents = {self.producers[input_name] for input_name in self.stages[name].inputs if input_name in self.producers}
+            start = 0
+            previous[name] = None
+
+            for parent in parents:
+                if visit(parent) > start:
+                    start = finish[parent]
+                    previous[name] = parent
+
+            finish[name] = start + self.durations.get(name, 0)
+
+            return finish[name]
+
+        if not self.stages:
+            return [], 0
+
+        last = max(self.stages, key = visit)
+
+        path = []
+        while last:
+            path.append(last)
+            last = previous[last]
+
+        return path[::-1], finish[path[0]]
+
+    def report(self) -> None:
+
+        path, total = self.critical_path()
+        steps = ' -> '.join(f'{name} ({self.durations.get(name, 0):.0f}s)' for name in path)
+
+        print(f'Caminho crítico ({total:.0f}s): {steps}')
+
+        if self.skipped:
+            print(f'Etapas puladas: {", ".join(self.skipped)}')
+
+        return
@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import contextlib
+import contextvars
+
+import locks
+
+# Requisições por segundo e rajada máxima de cada plataforma, por conta. O ritmo é reduzido
+# automaticamente quando a plataforma informa uso alto da cota e volta ao máximo aos poucos.
+RATE_LIMITS = {
+    'Facebook': (4, 10),
+    'TikTok': (8, 10),
+    'LinkedIn': (5, 10),
+    'Adjust': (1, 2),
+    'GoogleAds': (8, 10),
+    'GoogleAnalytics': (8, 10)
+}
+
+DEFAULT_RATE_LIMIT = (4, 10)
+
+# Estado dos baldes, compartilhado entre os processos das campanhas em paralelo.
+RATE_LIMIT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cache', 'rate_limits'))
+
+# Estado parado há mais que isso é descartado: o ritmo reduzido de uma execução anterior não vale para a próxima.
+STATE_TTL = 60 * 60
+
+# % de uso da cota (cabeçalhos do Facebook) a partir do qual o ritmo da conta começa a cair.
+USAGE_HIGH = 75
+
+MIN_RATE = 0.05
+
+# Multiplicador do ritmo a cada resposta com uso abaixo de USAGE_HIGH, até voltar ao máximo.
+RECOVERY = 1.2
+
+# Pausa, em segundos, quando a plataforma acusa excesso de chamadas sem dizer quanto esperar.
+DEFAULT_PAUSE = 60
+
+MAX_THROTTLE_RETRIES = 5
+
+# Cabeçalhos de uso do Facebook (valores em % da cota).
+FACEBOOK_USAGE_HEADERS = ['x-app-usage', 'x-ad-account-usage', 'x-business-use-case-usage']
+FACEBOOK_USAGE_FIELDS = ['call_count', 'total_cputime', 'total_time', 'acc_id_util_pct']
+
+# Códigos de erro de excesso de chamadas.
+FACEBOOK_THROTTLE_CODES = {4, 17, 32, 613, 80000, 80001, 80002, 80003, 80004, 80005, 80006, 80008, 80009, 80014}
+TIKTOK_THROTTLE_CODES = {40100}
+# Plataformas que indicam o excesso de chamadas no corpo da resposta, com o menor status http em que o corpo
+# é lido: o TikTok responde 200 com o código do erro; o Facebook responde 400 com {'error': {'code': ...}}.
+JSON_THROTTLE_PLATFORMS = {'TikTok': 0, 'Facebook': 400}
+THROTTLE_STATUS = {429}
+GOOGLE_THROTTLE_REASONS = ['rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded', 'RESOURCE_EXHAUSTED', 'RESOURCE_TEMPORARILY_EXHAUSTED']
+
+
+class TokenBucket:
+    '''
+    Limite de chamadas de uma conta: cada chamada consome uma ficha, e as fichas voltam no ritmo atual.
+    O estado do balde (fichas, ritmo, pausa) fica em um arquivo em RATE_LIMIT_DIR, lido e gravado sob trava,
+    então todas as threads e todos os processos (campanhas em paralelo) que usam a conta dividem o mesmo
+    balde, e uma pausa vale para todos.
+    '''
+
+    def __init__(self, rate: float, capacity: int, path: str):
+        self.max_rate = rate
+        self.capacity = capacity
+        self.path = path
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def state(self):
+        '''Estado do balde, gravado de volta no fim do bloco.'''
+
+        with self.lock, locks.file_lock(self.path):
+            now = time.time()
+
+            try:
+                with open(self.path, 'r') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = None
+
+            if not state or now - state['updated'] > STATE_TTL:
+                state = {'tokens': self.capacity, 'rate': self.max_rate, 'updated': now, 'paused_until': 0}
+
+            yield state
+
+            with open(self.path, 'w') as f:
+                json.dump(state, f)
+
+    def acquire(self) -> None:
+
+        while True:
+            with self.state() as state:
+                now = time.time()
+
+                if now < state['paused_until']:
+                    wait = state['paused_until'] - now
+                else:
+                    state['tokens'] = min(self.capacity, state['tokens'] + (now - state['updated']) * state['rate'])
+                    state['updated'] = now
+
+                    if state['tokens'] >= 1:
+                        state['tokens'] -= 1
+                        return
+
+                    wait = (1 - state['tokens']) / state['rate']
+
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        '''Segura todas as chamadas da conta por alguns segundos.'''
+
+        with self.state() as state:
+            now = time.time()
+            state['paused_until'] = max(state['paused_until'], now + seconds)
+            state['tokens'] = 0
+            state['updated'] = max(now, state['paused_until'])
+
+        return
+
+    def report_usage(self, usage: float) -> None:
+        '''Ajusta o ritmo pelo % de uso da cota informado pela plataforma.'''
+
+        with self.state() as state:
+            if usage >= USAGE_HIGH:
+                state['rate'] = max(MIN_RATE, self.max_rate * (100 - usage) / (100 - USAGE_HIGH))
+            else:
+                state['rate'] = min(self.max_rate, state['rate'] * RECOVERY)
+
+        return
+
+    def slow_down(self) -> None:
+        '''Corta o ritmo pela metade depois de um erro de excesso de chamadas.'''
+
+        with self.state() as state:
+            state['rate'] = max(MIN_RATE, state['rate'] / 2)
+
+        return
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+# Plataforma e conta das requisições http feitas pelo SDK dentro de scope().
+_scope = contextvars.ContextVar('rate_limit_scope', default = None)
+
+
+def bucket(platform: str, account: str = '') -> TokenBucket:
+
+    key = (platform, str(account))
+
+    with _buckets_lock:
+        if key not in _buckets:
+            os.makedirs(RATE_LIMIT_DIR, exist_ok = True)
+            path = os.path.join(RATE_LIMIT_DIR, f'{platform}-{hashlib.sha1(str(account).encode()).hexdigest()[:12]}.json')
+            _buckets[key] = TokenBucket(*RATE_LIMITS.get(platform, DEFAULT_RATE_LIMIT), path)
+
+    return _buckets[key]
+
+
+def usage_from_headers(headers) -> tuple:
+    '''(maior % de uso, segundos até a cota voltar) dos cabeçalhos de uso do Facebook.'''
+
+    headers = {str(name).lower(): value for name, value in dict(headers or {}).items()}
+    usage = 0
+    wait = 0
+
+    for name in FACEBOOK_USAGE_HEADERS:
+        if not headers.get(name):
+            continue
+
+        try:
+            data = json.loads(headers[name])
+        except ValueError:
+            continue
+
+        # x-business-use-case-usage: {id do negócio: [uso de cada tipo de chamada]}
+        entries = [entry for items in data.values() for entry in items] if name == 'x-business-use-case-usage' else [data]
+
+        for entry in entries:
+            entry_usage = max([float(entry.get(field) or 0) for field in FACEBOOK_USAGE_FIELDS])
+            usage = max(usage, entry_usage)
+
+            wait = max(wait, 60 * float(entry.get('estimated_time_to_regain_access') or 0))
+            if entry_usage >= 100:
+                wait = max(wait, float(entry.get('reset_time_duration') or 0))
+
+    return usage, wait
+
+def response_headers(result):
+    '''Cabeçalhos de uma resposta do requests ou de um objeto de SDK que os expõe, ou None.'''
+
+    headers = getattr(result, 'headers', None)
+
+    if callable(headers):
+        try:
+            headers = headers()
+        except Exception:
+            return None
+
+    return headers if hasattr(headers, 'items') else None
+
+def response_json(response):
+    '''
+    json de uma resposta http, ou None. O json é lido uma vez só: o .json() da resposta passa a
+    devolver o mesmo objeto, sem ler o corpo de novo no chamador.
+    '''
+
+    try:
+        payload = response.json()
+    except ValueError:
+        return None
+
+    response.json = lambda **kwargs: payload
+
+    return payload
+
+def throttled_response(platform: str, response, payload = None) -> float:
+    '''
+    Segundos de pausa quando a resposta http indica excesso de chamadas, ou None.
+    - payload: json da resposta (response_json), para as plataformas que indicam o excesso no corpo (TikTok, Facebook)
+    '''
+
+    if response.status_code in THROTTLE_STATUS:
+        try:
+            return float(response.headers.get('Retry-After', DEFAULT_PAUSE))
+        except ValueError:
+            return DEFAULT_PAUSE
+
+    if platform == 'TikTok' and isinstance(payload, dict) and payload.get('code') in TIKTOK_THROTTLE_CODES:
+        return DEFAULT_PAUSE
+
+    if platform == 'Facebook' and isinstance(payload, dict) and isinstance(payload.get('error'), dict) and payload['error'].get('code') in FACEBOOK_THROTTLE_CODES:
+        _, wait = usage_from_headers(response.headers)
+        return wait or DEFAULT_PAUSE
+
+    return None
+
+def throttled_error(error: Exception) -> float:
+    '''Segundos de pausa quando o erro de um SDK indica excesso de chamadas ou cota esgotada, ou None.'''
+
+    # facebook_business: FacebookRequestError
+    if callable(getattr(error, 'api_error_code', None)):
+        if error.api_error_code() not in FACEBOOK_THROTTLE_CODES:
+            return None
+
+        _, wait = usage_from_headers(error.http_headers() if callable(getattr(error, 'http_headers', None)) else {})
+
+        return wait or DEFAULT_PAUSE
+
+    # googleapiclient (Analytics): HttpError; google-ads: GoogleAdsException / ResourceExhausted
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    message = f'{error} {getattr(error, "failure", "")}'
+
+    if status in THROTTLE_STATUS or type(error).__name__ == 'ResourceExhausted' or any(reason in message for reason in GOOGLE_THROTTLE_REASONS):
+        return DEFAULT_PAUSE
+
+    return None
+
+
+def call(platform: str, account, fetch):
+    '''
+    Executa fetch() dentro do limite de chamadas da plataforma e da conta.
+    - o ritmo da conta é ajustado pelos cabeçalhos de uso da resposta
+    - quando a plataforma acusa excesso de chamadas, a conta inteira é pausada e a chamada é repetida
+    '''
+
+    limiter = bucket(platform, account)
+
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        limiter.acquire()
+
+        try:
+            result = fetch()
+        except Exception as error:
+            wait = throttled_error(error)
+            if wait is None or attempt == MAX_THROTTLE_RETRIES:
+                raise
+        else:
+            wait = None
+            if hasattr(result, 'status_code'):
+                payload = response_json(result) if platform in JSON_THROTTLE_PLATFORMS and result.status_code >= JSON_THROTTLE_PLATFORMS[platform] else None
+                wait = throttled_response(platform, result, payload)
+
+            if wait is None or attempt == MAX_THROTTLE_RETRIES:
+                headers = response_headers(result)
+                if headers is not None:
+                    usage, regain = usage_from_headers(headers)
+                    limiter.report_usage(usage)
+                    if regain:
+                        limiter.pause(regain)
+
+                return result
+
+        print(f'{" ".join(str(name) for name in (platform, account) if name)}: limite de chamadas atingido, aguardando {wait:.0f}s')
+        limiter.slow_down()
+        limiter.pause(wait)
+
+def scope(platform: str, account, fetch):
+    '''
+    Executa fetch() de um SDK cujas requisições http passam uma a uma pelo limite de chamadas
+    (gancho instalado no cliente do SDK com call_in_scope, ex.: facebook_init). Aqui só fica definida
+    a conta dessas requisições: um cursor de várias páginas gasta uma ficha por página, e o uso da cota
+    é lido dos cabeçalhos de cada resposta.
+    '''
+
+    token = _scope.set((platform, account))
+
+    try:
+        return fetch()
+    finally:
+        _scope.reset(token)
+
+def call_in_scope(platform: str, send):
+    '''Requisição http de um SDK dentro do limite da conta definida por scope() (fora dele, no limite da plataforma).'''
+
+    current = _scope.get()
+    account = current[1] if current and current[0] == platform else ''
+
+    return call(platform, account, send)
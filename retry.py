@@ -0,0 +1,168 @@
+import time
+import random
+
+import rate_limit
+
+# Espera entre as consultas de relatórios assíncronos: (intervalo mínimo, intervalo máximo, tempo máximo total), em segundos.
+POLL_POLICIES = {
+    'CampaignManager': (10, 60, 5 * 60),
+    'Facebook': (5, 60, 60 * 60),
+    'Twitter': (5, 60, 60 * 60),
+    'TikTok': (1, 30, 30 * 60)
+}
+
+DEFAULT_POLL_POLICY = (5, 60, 30 * 60)
+
+# Novas tentativas depois de erros temporários: (tentativas, intervalo mínimo, intervalo máximo), em segundos.
+RETRY_POLICIES = {
+    'Facebook': (5, 5, 120),
+    'GoogleAds': (5, 5, 120),
+    'GoogleAnalytics': (5, 5, 120),
+    'Adjust': (3, 10, 120)
+}
+
+DEFAULT_RETRY_POLICY = (4, 2, 60)
+
+# Status http e erros (nomes das classes) que indicam falha temporária.
+RETRY_STATUS = {500, 502, 503, 504}
+TRANSIENT_ERRORS = {
+    'ConnectionError', 'Timeout', 'TimeoutError', 'ChunkedEncodingError', 'IncompleteRead', 'RemoteDisconnected',
+    'ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded', 'ServerError'
+}
+TRANSIENT_GRPC_CODES = {'UNAVAILABLE', 'INTERNAL', 'DEADLINE_EXCEEDED'}
+
+
+class PollTimeout(Exception):
+    '''Relatório assíncrono que não ficou pronto dentro do tempo máximo.'''
+
+
+def next_sleep_interval(previous_sleep_interval: int, min_interval: int, max_interval: int) -> int:
+    '''Próximo intervalo de espera: sorteado entre o anterior e o triplo dele, limitado a max_interval.'''
+
+    low = previous_sleep_interval or min_interval
+    high = previous_sleep_interval * 3 or min_interval
+
+    return min(max_interval, random.randint(low, high))
+
+def poll(platform: str, check, is_done, describe = None):
+    '''
+    Consulta um relatório assíncrono até ficar pronto, com espera crescente e aleatória entre as consultas.
+    - entradas:
+        - plataforma (define os intervalos em POLL_POLICIES)
+        - check: função que consulta o relatório
+        - is_done: função que recebe a consulta e diz se o relatório terminou (com sucesso ou não)
+        - describe: função que recebe a consulta e retorna o status exibido enquanto espera
+
+    - saídas:
+        - última consulta do relatório
+
+    Passado o tempo máximo da plataforma levanta PollTimeout.
+    '''
+
+    min_interval, max_interval, max_elapsed = POLL_POLICIES.get(platform, DEFAULT_POLL_POLICY)
+
+    sleep = 0
+    start_time = time.monotonic()
+
+    while True:
+        result = check()
+
+        if is_done(result):
+            return result
+
+        if time.monotonic() - start_time > max_elapsed:
+            raise PollTimeout(f'{platform}: tempo de processamento ultrapassou {max_elapsed}s')
+
+        sleep = next_sleep_interval(sleep, min_interval, max_interval)
+        print(f'[{describe(result) if describe else platform}] Dormindo por {sleep} segundos.')
+        time.sleep(sleep)
+
+
+def error_status(error: Exception):
+    '''Status http de um erro do requests, do googleapiclient ou do SDK do Facebook, ou None.'''
+
+    response = getattr(error, 'response', None)
+    if hasattr(response, 'status_code'):
+        return response.status_code
+
+    resp = getattr(error, 'resp', None)
+    if hasattr(resp, 'status'):
+        return int(resp.status)
+
+    if callable(getattr(error, 'http_status', None)):
+        return error.http_status()
+
+    return None
+
+def grpc_code(error: Exception) -> str:
+    '''Código grpc de um erro do google-ads (o próprio erro ou o erro que ele embrulha).'''
+
+    for candidate in (error, getattr(error, 'error', None)):
+        if callable(getattr(candidate, 'code', None)):
+            try:
+                return candidate.code().name
+            except Exception:
+                continue
+
+    return ''
+
+def is_transient(error: Exception) -> bool:
+
+    if callable(getattr(error, 'api_transient_error', None)) and error.api_transient_error():
+        return True
+
+    if error_status(error) in RETRY_STATUS:
+        return True
+
+    if grpc_code(error) in TRANSIENT_GRPC_CODES:
+        return True
+
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+def never_sent(error: Exception) -> bool:
+    '''Erros em que a requisição com certeza não chegou à plataforma (sem conexão aberta).'''
+
+    names = {cls.__name__ for cls in type(error).__mro__}
+
+    return bool(names & {'ConnectTimeout', 'ConnectionRefusedError'}) or 'NewConnectionError' in str(error)
+
+def call(platform: str, fetch, idempotent: bool = True):
+    '''
+    Executa fetch() e repete a chamada depois de erros temporários (5xx, conexão, timeout),
+    com espera crescente e aleatória entre as tentativas (RETRY_POLICIES).
+    Chamadas que criam algo na plataforma (idempotent = False, ex.: criar um relatório assíncrono)
+    só são repetidas quando a requisição não chegou a ser enviada, para não criar o mesmo relatório duas vezes.
+    '''
+
+    attempts, min_interval, max_interval = RETRY_POLICIES.get(platform, DEFAULT_RETRY_POLICY)
+
+    sleep = 0
+
+    for attempt in range(attempts):
+        try:
+            return fetch()
+        except Exception as error:
+            retriable = is_transient(error) if idempotent else never_sent(error)
+
+            if not retriable or attempt == attempts - 1:
+                raise
+
+            sleep = next_sleep_interval(sleep, min_interval, max_interval)
+            print(f'{platform or "http"}: {type(error).__name__} na tentativa {attempt + 1} de {attempts}, tentando de novo em {sleep}s')
+            time.sleep(sleep)
+
+def call_api(platform: str, account, fetch, idempotent: bool = True):
+    '''Chamada de API dentro do limite de chamadas da conta (rate_limit.py) e com novas tentativas em erros temporários.'''
+
+    if not platform:
+        return call(platform, fetch, idempotent)
+
+    return call(platform, lambda: rate_limit.call(platform, account, fetch), idempotent)
+
+def call_sdk(platform: str, account, fetch, idempotent: bool = True):
+    '''
+    Como call_api, para SDKs em que cada requisição http já passa pelo limite de chamadas (rate_limit.scope),
+    ex.: o Facebook, em que um cursor de várias páginas gasta uma ficha por página.
+    '''
+
+    return call(platform, lambda: rate_limit.scope(platform, account, fetch), idempotent)
@@ -0,0 +1,395 @@
+import os
+import json
+import hashlib
+import datetime
+
+import pandas as pd
+
+from manifest import describe, write_manifest, table_summary, schema_hash
+
+# Formato em que as bases *_prep de cada campanha são guardadas: 'parquet', 'sqlite' (banco único em warehouse.py)
+# ou 'excel' (formato antigo).
+STORAGE_BACKEND = 'parquet'
+
+# Quando verdadeiro, cada base atualizada também é exportada para o .xlsx do formato antigo.
+EXPORT_PREP_EXCEL = False
+
+# Arquivo e aba de cada base no formato antigo, relativos à pasta da campanha.
+# Bases que não estão aqui ficam em data/{nome}.xlsx, na aba {nome}.
+EXCEL_TABLES = {
+    'bm_ga_overview': (os.path.join('data', 'bm_googleAnalytics_prep.xlsx'), 'ga_overview'),
+    'bm_ga_events': (os.path.join('data', 'bm_googleAnalytics_prep.xlsx'), 'ga_events'),
+    'cm_ga_overview': (os.path.join('data', 'cm_googleAnalytics_prep.xlsx'), 'ga_overview'),
+    'cm_ga_events': (os.path.join('data', 'cm_googleAnalytics_prep.xlsx'), 'ga_events'),
+    'adjust_prep': (os.path.join('source', 'adjust_prep.xlsx'), 'adjust_prep')
+}
+
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def infer_dtype(series: pd.Series) -> str:
+    '''Tipo da coluna no schema: int64, float64, bool, datetime64[ns] ou object (texto).'''
+
+    if pd.api.types.is_bool_dtype(series):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(series):
+        return 'int64'
+    if pd.api.types.is_float_dtype(series):
+        return 'float64'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime64[ns]'
+
+    return 'object'
+
+def merge_dtype(old: str, new: str) -> str:
+    '''Tipo que comporta os valores antigos e os novos de uma coluna.'''
+
+    if old == new:
+        return old
+    if {old, new} <= {'int64', 'float64', 'bool'}:
+        return 'float64'
+
+    return 'object'
+
+def apply_schema(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    '''Deixa o dataframe com as colunas e tipos do schema, preenchendo colunas ausentes.'''
+
+    df = df.copy()
+
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            df[column] = '' if dtype == 'object' else (pd.NaT if dtype.startswith('datetime') else 0)
+
+        if dtype == 'object':
+            df[column] = df[column].fillna('').astype(str)
+        elif dtype in ('int64', 'bool'):
+            df[column] = df[column].fillna(0).astype(dtype)
+        elif dtype.startswith('datetime'):
+            df[column] = pd.to_datetime(df[column])
+        else:
+            df[column] = df[column].astype(dtype)
+
+    return df[list(schema)]
+
+
+class ExcelStorage:
+    '''Formato antigo: cada base é uma planilha inteira, relida e regravada a cada atualização.'''
+
+    def __init__(self, campaign_path: str):
+        self.campaign_path = campaign_path
+
+    def location(self, name: str) -> tuple:
+
+        file_name, sheet_name = EXCEL_TABLES.get(name, (os.path.join('data', f'{name}.xlsx'), name))
+
+        return os.path.abspath(os.path.join(self.campaign_path, file_name)), sheet_name
+
+    def exists(self, name: str) -> bool:
+
+        return os.path.isfile(self.location(name)[0])
+
+    def read(self, name: str, start_date: datetime.date = None, end_date: datetime.date = None) -> pd.DataFrame:
+
+        file_path, sheet_name = self.location(name)
+        df = pd.read_excel(file_path, sheet_name = sheet_name)
+
+        # O Excel não guarda os tipos: ids voltam como números (com NaN nos vazios) e datas como texto.
+        for column in [column for column in df.columns if '_id' in column]:
+            if pd.api.types.is_float_dtype(df[column]):
+                df[column] = df[column].fillna(0).astype('int64')
+            df[column] = df[column].astype(str)
+
+        df['date'] = pd.to_datetime(df['date'])
+
+        if start_date:
+            df = df[df['date'] >= pd.Timestamp(start_date)]
+        if end_date:
+            df = df[df['date'] <= pd.Timestamp(end_date)]
+
+        return df.reset_index(drop = True)
+
+    def dates(self, name: str) -> list:
+
+        if not self.exists(name):
+            return []
+
+        # O manifesto evita abrir a planilha inteira só para saber os dias salvos.
+        file_path, sheet_name = self.location(name)
+        summary = table_summary(file_path, sheet_name)
+
+        if summary is not None:
+            return [datetime.datetime.strptime(date, DATE_FORMAT).date() for date in sorted(summary['days'])]
+
+        return sorted(self.read(name)['date'].dt.date.unique())
+
+    def max_date(self, name: str) -> datetime.date:
+
+        dates = self.dates(name)
+
+        return dates[-1] if dates else None
+
+    def append(self, name: str, df: pd.DataFrame) -> None:
+
+        self.replace(name, df)
+
+        return
+
+    def replace(self, name: str, df: pd.DataFrame, start_date: datetime.date = None, end_date: datetime.date = None) -> None:
+        '''Troca as linhas salvas entre start_date e end_date pelas do dataframe (sem datas, só acrescenta).'''
+
+        file_path, sheet_name = self.location(name)
+
+        sheets = pd.read_excel(file_path, sheet_name = None) if os.path.isfile(file_path) else {}
+        saved = self.read(name) if sheet_name in sheets else pd.DataFrame()
+
+        # Janela sem dados (dataframe sem colunas): só os dias salvos do intervalo são apagados.
+        has_rows = not df.empty and 'date' in df.columns
+
+        if not has_rows and sheet_name not in sheets:
+            return
+
+        if start_date and not saved.empty:
+            dates = saved['date'].dt.date
+            saved = saved[(dates < start_date) | (dates > end_date)]
+
+        sheets[sheet_name] = pd.concat([saved, df] if has_rows else [saved], axis = 0, ignore_index = True).sort_values('date', ignore_index = True)
+
+        with pd.ExcelWriter(file_path) as writer:
+            for sheet, sheet_df in sheets.items():
+                sheet_df.to_excel(writer, index = False, sheet_name = sheet)
+
+        write_manifest(file_path, sheets)
+
+        return
+
+
+class ParquetStorage:
+    '''
+    Cada base é uma pasta data/{nome} com um arquivo parquet por dia e um _schema.json.
+
+    A atualização diária grava apenas os dias novos e a leitura abre apenas os dias pedidos.
+    O schema guarda o tipo de cada coluna, então ids continuam texto e números continuam números
+    sem precisar de conversões depois da leitura. Colunas novas (ex.: uma nova ação do Facebook)
+    entram no schema e são preenchidas nos dias antigos durante a leitura.
+    '''
+
+    def __init__(self, campaign_path: str):
+        self.campaign_path = campaign_path
+        self.legacy = ExcelStorage(campaign_path)
+
+    def folder(self, name: str) -> str:
+
+        return os.path.abspath(os.path.join(self.campaign_path, 'data', name))
+
+    def schema_path(self, name: str) -> str:
+
+        return os.path.join(self.folder(name), '_schema.json')
+
+    def partition_path(self, name: str, date: datetime.date) -> str:
+
+        return os.path.join(self.folder(name), f'{date.strftime(DATE_FORMAT)}.parquet')
+
+    def exists(self, name: str) -> bool:
+        '''Se a base existe, em parquet ou ainda no Excel do formato antigo (sem converter nada).'''
+
+        return os.path.isfile(self.schema_path(name)) or self.legacy.exists(name)
+
+    def migrate(self, name: str) -> None:
+        '''Converte para parquet a base que ainda está no Excel do formato antigo; chamado na primeira leitura ou gravação.'''
+
+        if os.path.isfile(self.schema_path(name)) or not self.legacy.exists(name):
+            return
+
+        print(f'Convertendo {name} de Excel para parquet.')
+        self.append(name, self.legacy.read(name))
+
+        return
+
+    def schema(self, name: str) -> dict:
+
+        if not os.path.isfile(self.schema_path(name)):
+            return {}
+
+        with open(self.schema_path(name), 'r') as f:
+            return json.load(f)
+
+    def dates(self, name: str) -> list:
+
+        if not self.exists(name):
+            return []
+
+        self.migrate(name)
+
+        summary = table_summary(self.folder(name), name)
+
+        if summary is not None:
+            return [datetime.datetime.strptime(date, DATE_FORMAT).date() for date in sorted(summary['days'])]
+
+        files = [file_name for file_name in os.listdir(self.folder(name)) if file_name.endswith('.parquet')]
+
+        return sorted(datetime.datetime.strptime(file_name[:-len('.parquet')], DATE_FORMAT).date() for file_name in files)
+
+    def max_date(self, name: str) -> datetime.date:
+
+        dates = self.dates(name)
+
+        return dates[-1] if dates else None
+
+    def read(self, name: str, start_date: datetime.date = None, end_date: datetime.date = None) -> pd.DataFrame:
+
+        self.migrate(name)
+
+        schema = self.schema(name)
+        dates = [date for date in self.dates(name) if (not start_date or date >= start_date) and (not end_date or date <= end_date)]
+
+        frames = [pd.read_parquet(self.partition_path(name, date)) for date in dates]
+
+        if not frames:
+            return apply_schema(pd.DataFrame(), schema)
+
+        df = pd.concat(frames, axis = 0, ignore_index = True)
+
+        return apply_schema(df, schema)
+
+    def write_schema(self, name: str, schema: dict) -> None:
+
+        temp_path = f'{self.schema_path(name)}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(schema, f, indent = 1)
+
+        os.replace(temp_path, self.schema_path(name))
+
+        return
+
+    def day_hashes(self, name: str) -> dict:
+        '''Linhas e hash de cada dia salvo, lidos do manifesto ou, se ele não for válido, dos próprios arquivos.'''
+
+        summary = table_summary(self.folder(name), name)
+
+        if summary is not None and 'day_hashes' in summary:
+            return {date: (summary['days'][date], summary['day_hashes'][date]) for date in summary['days']}
+
+        schema = self.schema(name)
+        days = {}
+
+        for file_name in sorted(os.listdir(self.folder(name))):
+            if file_name.endswith('.parquet'):
+                day_df = apply_schema(pd.read_parquet(os.path.join(self.folder(name), file_name)), schema)
+                days[file_name[:-len('.parquet')]] = (int(day_df.shape[0]), describe(day_df)['content_hash'])
+
+        return days
+
+    def write_manifest(self, name: str, days: dict) -> None:
+        '''Manifesto da base em data/{nome}.manifest.json, montado a partir do resumo de cada dia.'''
+
+        days = dict(sorted(days.items()))
+        content = hashlib.sha1(''.join(day_hash for _, day_hash in days.values()).encode())
+
+        write_manifest(self.folder(name), {name: {
+            'rows': sum(rows for rows, _ in days.values()),
+            'min_date': min(days) if days else None,
+            'max_date': max(days) if days else None,
+            'days': {date: rows for date, (rows, _) in days.items()},
+            'schema_hash': schema_hash(apply_schema(pd.DataFrame(), self.schema(name))),
+            'content_hash': content.hexdigest(),
+            'day_hashes': {date: day_hash for date, (_, day_hash) in days.items()}
+        }})
+
+        return
+
+    def write_days(self, name: str, df: pd.DataFrame) -> dict:
+        '''Grava um arquivo por dia do dataframe e retorna as linhas e o hash de cada dia gravado.'''
+
+        os.makedirs(self.folder(name), exist_ok = True)
+
+        # Plataformas sem dados no período devolvem um dataframe sem colunas: nenhum dia é gravado.
+        if df.empty or 'date' not in df.columns:
+            return {}
+
+        # Algumas plataformas (ex.: Twitter) entregam a data como datetime.date, que o parquet guardaria como texto.
+        df = df.copy()
+        df['date'] = pd.to_datetime(df['date'])
+
+        schema = self.schema(name)
+        for column in df.columns:
+            dtype = infer_dtype(df[column])
+            schema[column] = merge_dtype(schema[column], dtype) if column in schema else dtype
+
+        self.write_schema(name, schema)
+
+        df = apply_schema(df, schema)
+        written = {}
+
+        for date, day_df in df.groupby(df['date'].dt.date):
+            temp_path = f'{self.partition_path(name, date)}.tmp'
+            day_df.to_parquet(temp_path, index = False)
+            os.replace(temp_path, self.partition_path(name, date))
+
+            written[date.strftime(DATE_FORMAT)] = (int(day_df.shape[0]), describe(day_df.reset_index(drop = True))['content_hash'])
+
+        return written
+
+    def append(self, name: str, df: pd.DataFrame) -> None:
+        '''Grava os dias do dataframe, substituindo os dias que já existiam.'''
+
+        days = self.day_hashes(name) if os.path.isdir(self.folder(name)) else {}
+        days.update(self.write_days(name, df))
+
+        self.write_manifest(name, days)
+
+        return
+
+    def replace(self, name: str, df: pd.DataFrame, start_date: datetime.date, end_date: datetime.date) -> None:
+        '''
+        Troca os dias de start_date a end_date pelos do dataframe. Cada dia é trocado de uma vez
+        (arquivo temporário + os.replace) e dias que não vieram no dataframe são apagados; com um
+        dataframe vazio (janela sem dados) os dias do intervalo são só apagados.
+        '''
+
+        stale = [date for date in self.dates(name) if start_date <= date <= end_date]
+        days = self.day_hashes(name) if os.path.isdir(self.folder(name)) else {}
+
+        written = self.write_days(name, df)
+        days.update(written)
+
+        for date in stale:
+            if date.strftime(DATE_FORMAT) not in written:
+                os.remove(self.partition_path(name, date))
+                days.pop(date.strftime(DATE_FORMAT), None)
+
+        self.write_manifest(name, days)
+
+        return
+
+
+BACKENDS = {
+    'excel': ExcelStorage,
+    'parquet': ParquetStorage
+}
+
+def get_storage(campaign_path: str):
+    '''Retorna o armazenamento das bases da campanha no formato configurado em STORAGE_BACKEND.'''
+
+    if STORAGE_BACKEND == 'sqlite':
+        # Import aqui dentro porque warehouse.py usa as funções de schema deste módulo.
+        from warehouse import WarehouseStorage
+        return WarehouseStorage(campaign_path)
+
+    return BACKENDS[STORAGE_BACKEND](campaign_path)
+
+def export_excel(campaign_path: str, tables: dict) -> None:
+    '''Exporta bases ({nome: dataframe}) para os .xlsx do formato antigo, como etapa final de apresentação.'''
+
+    files = {}
+    for name, df in tables.items():
+        file_path, sheet_name = ExcelStorage(campaign_path).location(name)
+        files.setdefault(file_path, {})[sheet_name] = df
+
+    for file_path, sheets in files.items():
+        with pd.ExcelWriter(file_path) as writer:
+            for sheet_name, df in sheets.items():
+                df.to_excel(writer, index = False, sheet_name = sheet_name)
+
+        write_manifest(file_path, sheets)
+
+    return
@@ -0,0 +1,68 @@
+import os
+import shutil
+import datetime
+
+import pandas as pd
+import pytest
+
+import archive
+import functions
+from date_coverage import Coverage
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(archive, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    yield str(tmp_path / 'archive')
+    archive.set_mode('')
+
+def campaign(tmp_path) -> str:
+
+    path = tmp_path / 'campanha'
+    os.makedirs(path / 'data')
+    os.makedirs(path / 'source')
+
+    return str(path)
+
+def connector(spend: int):
+    '''Conector de exemplo: grava a resposta da janela no arquivo e devolve uma linha por dia com o gasto informado.'''
+
+    def get_data(accounts, init, end):
+        days = pd.date_range(init, end).strftime('%Y-%m-%d')
+
+        with archive.context('Facebook', accounts, init, end):
+            rows = archive.raw('insights', lambda: [{'date': day, 'account_name': accounts[0], 'spend': spend} for day in days])
+
+        return pd.DataFrame(rows)
+
+    return get_data
+
+
+def test_replay_rebuilds_history_from_two_recorded_runs(tmp_path, archive_dir):
+
+    campaign_path = campaign(tmp_path)
+    yesterday = datetime.datetime.today().date() - datetime.timedelta(days = 1)
+    init_date = yesterday - datetime.timedelta(days = 20)
+
+    # Primeira execução grava o período inteiro; a segunda, no mesmo dia, só os dias de LOOKBACK_DAYS, com números revisados.
+    archive.set_mode('record')
+    functions.update_bm(campaign_path, init_date, bm = 'Facebook', accounts = ['conta'], bm_function = connector(1))
+    functions.update_bm(campaign_path, init_date, bm = 'Facebook', accounts = ['conta'], bm_function = connector(2))
+
+    recorded = archive.recorded_windows('Facebook', ['conta'], init_date, yesterday)
+    assert len(recorded) == 2
+
+    # Sem a base salva nem a cobertura, o replay refaz o período inteiro a partir das duas gravações
+    # (o gasto 0 do conector nunca aparece, porque no replay as respostas vêm do arquivo).
+    shutil.rmtree(os.path.join(campaign_path, 'data'))
+    os.makedirs(os.path.join(campaign_path, 'data'))
+
+    archive.set_mode('replay')
+    df = functions.update_bm(campaign_path, init_date, bm = 'Facebook', accounts = ['conta'], bm_function = connector(0))
+
+    assert df['date'].dt.date.tolist() == [init_date + datetime.timedelta(days = i) for i in range(21)]
+    assert df.set_index(df['date'].dt.date)['spend'].to_dict() == {
+        day: 2 if day >= recorded[-1][0] else 1 for day in df['date'].dt.date
+    }
+    assert Coverage(campaign_path).covered('facebook_prep') == [(init_date, yesterday)]
@@ -0,0 +1,39 @@
+import os
+import datetime
+
+import pandas as pd
+
+import functions
+from date_coverage import Coverage, LOOKBACK_DAYS
+
+
+def campaign(tmp_path) -> str:
+
+    os.makedirs(tmp_path / 'data', exist_ok = True)
+    os.makedirs(tmp_path / 'source', exist_ok = True)
+
+    return str(tmp_path)
+
+
+def test_update_bm_marks_empty_window_as_fetched(tmp_path):
+
+    campaign_path = campaign(tmp_path)
+    yesterday = datetime.datetime.today().date() - datetime.timedelta(days = 1)
+    init_date = yesterday - datetime.timedelta(days = 10)
+    calls = []
+
+    def connector(accounts, init, end):
+        calls.append((init, end))
+        return pd.DataFrame()
+
+    df = functions.update_bm(campaign_path, init_date, bm = 'Linkedin', accounts = ['conta'], bm_function = connector)
+
+    assert df.empty
+    assert Coverage(campaign_path).covered('linkedin_prep') == [(init_date, yesterday)]
+
+    # O LinkedIn não tem LOOKBACK_DAYS: com a janela marcada, nada é pedido de novo.
+    calls.clear()
+    functions.update_bm(campaign_path, init_date, bm = 'Linkedin', accounts = ['conta'], bm_function = connector)
+
+    assert 'Linkedin' not in LOOKBACK_DAYS
+    assert calls == []
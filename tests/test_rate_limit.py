@@ -0,0 +1,47 @@
+import json
+
+import rate_limit
+
+
+class Response:
+    '''Resposta http mínima para o rate_limit (status, cabeçalhos e corpo json).'''
+
+    def __init__(self, status_code: int, payload: dict, headers: dict = None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers or {}
+        self.json_calls = 0
+
+    def json(self, **kwargs):
+        self.json_calls += 1
+        return json.loads(json.dumps(self.payload))
+
+
+def test_facebook_throttle_code_in_body_pauses(monkeypatch, tmp_path):
+
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_DIR', str(tmp_path))
+    monkeypatch.setattr(rate_limit, '_buckets', {})
+    monkeypatch.setattr(rate_limit.TokenBucket, 'pause', lambda self, seconds: None)
+
+    responses = [Response(400, {'error': {'code': 80004, 'message': 'There have been too many calls'}}), Response(200, {'data': []})]
+
+    result = rate_limit.call('Facebook', 'act_1', lambda: responses.pop(0))
+
+    assert result.status_code == 200
+    assert responses == []
+
+def test_facebook_other_errors_are_not_throttling():
+
+    response = Response(400, {'error': {'code': 190, 'message': 'Error validating access token'}})
+
+    assert rate_limit.throttled_response('Facebook', response, rate_limit.response_json(response)) is None
+
+def test_facebook_success_body_is_not_parsed(monkeypatch, tmp_path):
+
+    monkeypatch.setattr(rate_limit, 'RATE_LIMIT_DIR', str(tmp_path))
+    monkeypatch.setattr(rate_limit, '_buckets', {})
+
+    response = Response(200, {'data': []})
+    rate_limit.call('Facebook', 'act_1', lambda: response)
+
+    assert response.json_calls == 0
@@ -0,0 +1,70 @@
+import os
+import datetime
+
+import pandas as pd
+
+from storage import ExcelStorage, ParquetStorage
+
+DAY_1 = datetime.date(2022, 1, 1)
+DAY_2 = datetime.date(2022, 1, 2)
+
+
+def campaign(tmp_path) -> str:
+
+    os.makedirs(tmp_path / 'data', exist_ok = True)
+    os.makedirs(tmp_path / 'source', exist_ok = True)
+
+    return str(tmp_path)
+
+def sample() -> pd.DataFrame:
+
+    return pd.DataFrame({'date': ['2022-01-01', '2022-01-02'], 'ad_id': ['1', '2'], 'impressions': [10, 20]})
+
+
+def test_replace_with_empty_frame_removes_window_days(tmp_path):
+
+    storage = ParquetStorage(campaign(tmp_path))
+    storage.append('facebook_prep', sample())
+
+    storage.replace('facebook_prep', pd.DataFrame(), DAY_2, DAY_2)
+
+    assert storage.dates('facebook_prep') == [DAY_1]
+    assert storage.read('facebook_prep')['ad_id'].tolist() == ['1']
+
+def test_replace_with_empty_frame_on_new_table(tmp_path):
+
+    storage = ParquetStorage(campaign(tmp_path))
+
+    storage.replace('linkedin_prep', pd.DataFrame(), DAY_1, DAY_2)
+
+    assert storage.dates('linkedin_prep') == []
+
+def test_exists_does_not_convert_excel(tmp_path):
+
+    path = campaign(tmp_path)
+    sample().to_excel(os.path.join(path, 'data', 'twitter_prep.xlsx'), sheet_name = 'twitter_prep', index = False)
+
+    storage = ParquetStorage(path)
+
+    assert storage.exists('twitter_prep')
+    assert not os.path.isdir(storage.folder('twitter_prep'))
+
+    assert storage.dates('twitter_prep') == [DAY_1, DAY_2]
+    assert os.path.isfile(storage.schema_path('twitter_prep'))
+
+def test_excel_replace_with_empty_frame_removes_window_days(tmp_path):
+
+    storage = ExcelStorage(campaign(tmp_path))
+    storage.replace('tiktok_prep', sample())
+
+    storage.replace('tiktok_prep', pd.DataFrame(), DAY_2, DAY_2)
+
+    assert storage.read('tiktok_prep')['ad_id'].tolist() == ['1']
+
+def test_excel_replace_with_empty_frame_on_new_table(tmp_path):
+
+    storage = ExcelStorage(campaign(tmp_path))
+
+    storage.replace('tiktok_prep', pd.DataFrame(), DAY_1, DAY_2)
+
+    assert not storage.exists('tiktok_prep')
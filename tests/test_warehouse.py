@@ -0,0 +1,46 @@
+import os
+import datetime
+
+import pandas as pd
+
+from warehouse import Warehouse, WarehouseStorage
+
+DAY_1 = datetime.date(2022, 1, 1)
+DAY_2 = datetime.date(2022, 1, 2)
+
+
+def storage(tmp_path) -> WarehouseStorage:
+
+    campaign_path = os.path.join(str(tmp_path), 'campanha')
+    os.makedirs(campaign_path)
+
+    return WarehouseStorage(campaign_path, Warehouse(os.path.join(str(tmp_path), 'warehouse', 'marketing.sqlite')))
+
+
+def test_replace_with_empty_frame_removes_window_days(tmp_path):
+
+    tables = storage(tmp_path)
+    tables.append('adjust_prep', pd.DataFrame({'date': ['2022-01-01', '2022-01-02'], 'installs': [1, 2]}))
+
+    tables.replace('adjust_prep', pd.DataFrame(), DAY_2, DAY_2)
+
+    assert tables.dates('adjust_prep') == [DAY_1]
+
+def test_replace_with_empty_frame_on_new_table(tmp_path):
+
+    tables = storage(tmp_path)
+
+    tables.replace('adjust_prep', pd.DataFrame(), DAY_1, DAY_2)
+
+    assert tables.dates('adjust_prep') == []
+
+def test_exists_does_not_load_excel(tmp_path):
+
+    tables = storage(tmp_path)
+    os.makedirs(os.path.join(tables.campaign_path, 'data'))
+    pd.DataFrame({'date': ['2022-01-01', '2022-01-02'], 'ad_id': ['1', '2']}).to_excel(os.path.join(tables.campaign_path, 'data', 'tiktok_prep.xlsx'), sheet_name = 'tiktok_prep', index = False)
+
+    assert tables.exists('tiktok_prep')
+    assert tables.warehouse.dates('tiktok_prep', tables.campaign) == []
+
+    assert tables.dates('tiktok_prep') == [DAY_1, DAY_2]
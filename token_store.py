@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+import locks
+
+# Credenciais de todas as plataformas, uma por arquivo.
+TOKENS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tokens'))
+
+# Um token é renovado quando falta menos que isso para expirar (o token longo do Facebook dura 60 dias).
+REFRESH_MARGIN = 7 * 24 * 60 * 60
+
+_lock = threading.RLock()
+_tokens = {}
+_shared = {}
+_thread_shared = threading.local()
+
+
+def token_path(name: str) -> str:
+
+    return os.path.join(TOKENS_DIR, name)
+
+@contextlib.contextmanager
+def file_lock(name: str):
+    '''
+    Trava o arquivo de credenciais entre threads e entre os processos das campanhas em paralelo,
+    para que só um deles renove o token e grave o arquivo.
+    '''
+
+    with _lock:
+        with locks.file_lock(token_path(name)):
+            yield
+
+def read(name: str) -> dict:
+
+    with open(token_path(name), 'r') as f:
+        return json.load(f)
+
+def write_text(name: str, content: str) -> None:
+    '''Grava o arquivo de credenciais em um temporário e renomeia, para que nunca seja lido pela metade.'''
+
+    path = token_path(name)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+
+    with open(temp_path, 'w') as f:
+        f.write(content)
+
+    os.replace(temp_path, path)
+
+    return
+
+def load(name: str) -> dict:
+    '''Credenciais do arquivo, lidas uma vez por processo.'''
+
+    with _lock:
+        if name not in _tokens:
+            _tokens[name] = read(name)
+
+        return dict(_tokens[name])
+
+def expires_soon(credentials: dict, margin: int = REFRESH_MARGIN) -> bool:
+    '''Sem expires_at (arquivos antigos) o token é tratado como vencendo, para ser renovado uma vez e ganhar a data.'''
+
+    return float(credentials.get('expires_at') or 0) - time.time() < margin
+
+def get(name: str, refresh = None, margin: int = REFRESH_MARGIN) -> dict:
+    '''
+    Credenciais de uma plataforma, renovadas só quando o token está perto de expirar.
+    - entradas:
+        - nome do arquivo em TOKENS_DIR
+        - refresh: função que recebe as credenciais e retorna os campos novos (ex.: access_token e
+          expires_at, em segundos desde 1970). Sem refresh as credenciais só são lidas.
+
+    - saídas:
+        - dicionário com as credenciais
+    '''
+
+    credentials = load(name)
+
+    if refresh is None or not expires_soon(credentials, margin):
+        return credentials
+
+    with file_lock(name):
+        # Outro processo pode ter renovado o token enquanto este esperava a trava.
+        credentials = read(name)
+
+        if expires_soon(credentials, margin):
+            credentials.update(refresh(credentials))
+            write_text(name, json.dumps(credentials))
+
+        _tokens[name] = credentials
+
+    return dict(credentials)
+
+def shared(key: str, build, per_thread: bool = False):
+    '''
+    Objeto montado uma vez por processo a partir das credenciais (ex.: serviço de uma API).
+    Com per_thread, cada thread tem o seu, para clientes que não podem ser usados por
+    várias threads ao mesmo tempo (ex.: httplib2 do Google Analytics).
+    '''
+
+    if per_thread:
+        objects = _thread_shared.__dict__
+        if key not in objects:
+            objects[key] = build()
+
+        return objects[key]
+
+    with _lock:
+        if key not in _shared:
+            _shared[key] = build()
+
+        return _shared[key]
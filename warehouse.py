@@ -0,0 +1,425 @@
+import os
+import sqlite3
+import datetime
+import contextlib
+
+import pandas as pd
+
+from storage import apply_schema, infer_dtype, merge_dtype
+
+# Banco local (arquivo, sem servidor) com as bases de todas as campanhas.
+WAREHOUSE_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'warehouse', 'marketing.sqlite'))
+
+# Chave natural de cada base. Gravar de novo uma linha com a mesma chave substitui a anterior.
+# A coluna _campaign (campanha da planilha de controle) entra em todas as chaves.
+NATURAL_KEYS = {
+    'facebook_prep': ['date', 'ad_id', 'publisher_platform'],
+    'googleads_prep': ['date', 'ad_id'],
+    'tiktok_prep': ['date', 'ad_id'],
+    'linkedin_prep': ['date', 'creative_id'],
+    'twitter_prep': ['date', 'tweet_id', 'line_item_id'],
+    'campaignmanager_prep': ['date', 'cm_creative_id', 'placement_id'],
+    'bm_ga_overview': ['date', 'campaign', 'source', 'medium', 'content', 'campaign_id', 'ad_id'],
+    'bm_ga_events': ['date', 'ad_id', 'campaign', 'source', 'medium', 'content', 'eventcategory', 'eventaction', 'eventlabel'],
+    'cm_ga_overview': ['date', 'campaign', 'source', 'cm_placement', 'cm_creative', 'cm_placement_id', 'ad_id', 'cm_creative_id'],
+    'cm_ga_events': ['date', 'campaign', 'source', 'ad_id', 'cm_creative', 'cm_creative_id', 'eventcategory', 'eventaction', 'eventlabel'],
+    'adjust_prep': ['date', 'app', 'partner_name', 'network', 'campaign_id', 'adgroup_id', 'creative_id']
+}
+
+SQL_TYPES = {
+    'int64': 'INTEGER',
+    'bool': 'INTEGER',
+    'float64': 'REAL'
+}
+
+
+def quote(name: str) -> str:
+
+    return '"' + name.replace('"', '""') + '"'
+
+
+class Warehouse:
+    '''
+    Banco SQLite com as bases de plataformas, GA e Adjust de todas as campanhas.
+
+    Cada base é uma tabela com a coluna _campaign, um índice único na chave natural (usado no upsert)
+    e índices por data e por campanha. Os tipos das colunas ficam na tabela _schema para que a leitura
+    devolva o dataframe com os mesmos tipos da gravação.
+    '''
+
+    def __init__(self, path: str = WAREHOUSE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+
+        with self.connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS _schema (table_name TEXT, column_name TEXT, dtype TEXT, PRIMARY KEY (table_name, column_name))')
+
+    @contextlib.contextmanager
+    def connect(self):
+        '''Conexão com o banco: confirma a transação no fim do bloco (ou desfaz, em caso de erro) e fecha a conexão.'''
+
+        # Vários processos podem gravar ao mesmo tempo: o timeout faz cada um esperar a sua vez.
+        conn = sqlite3.connect(self.path, timeout = 120)
+
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def schema(self, table: str, conn: sqlite3.Connection = None) -> dict:
+
+        if conn is None:
+            with self.connect() as conn:
+                return self.schema(table, conn)
+
+        rows = conn.execute('SELECT column_name, dtype FROM _schema WHERE table_name = ? ORDER BY rowid', (table,)).fetchall()
+
+        return dict(rows)
+
+    def ensure_key(self, conn: sqlite3.Connection, table: str, keys: list) -> None:
+        '''Índice único da chave natural; tabelas criadas com uma chave antiga têm o índice recriado com a atual.'''
+
+        key_columns = ['_campaign'] + keys
+        index = quote(table + '_key')
+        current = [row[2] for row in conn.execute(f'PRAGMA index_info({index})').fetchall()]
+
+        if current == key_columns:
+            return
+
+        conn.execute(f'DROP INDEX IF EXISTS {index}')
+        conn.execute(f'CREATE UNIQUE INDEX {index} ON {quote(table)} ({", ".join(quote(column) for column in key_columns)})')
+
+        return
+
+    def ensure_table(self, conn: sqlite3.Connection, table: str, df: pd.DataFrame) -> dict:
+        '''Cria a tabela (ou adiciona colunas novas) e atualiza o schema com os tipos do dataframe.'''
+
+        keys = NATURAL_KEYS.get(table, ['date'])
+        schema = self.schema(table, conn)
+
+        new_schema = dict(schema)
+        for column in df.columns:
+            dtype = infer_dtype(df[column])
+            new_schema[column] = merge_dtype(schema[column], dtype) if column in schema else dtype
+
+        for column in keys:
+            new_schema.setdefault(column, 'object')
+
+        if not schema:
+            columns = ', '.join(f'{quote(column)} {SQL_TYPES.get(dtype, "TEXT")}' for column, dtype in new_schema.items())
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {quote(table)} (_campaign TEXT, {columns})')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {quote(table + "_date")} ON {quote(table)} (date)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {quote(table + "_campaign_date")} ON {quote(table)} (_campaign, date)')
+
+            if 'campaign' in new_schema:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS {quote(table + "_campaign_name")} ON {quote(table)} (campaign)')
+
+        else:
+            for column in [column for column in new_schema if column not in schema]:
+                conn.execute(f'ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} {SQL_TYPES.get(new_schema[column], "TEXT")}')
+
+        self.ensure_key(conn, table, keys)
+
+        conn.executemany('INSERT OR REPLACE INTO _schema (table_name, column_name, dtype) VALUES (?, ?, ?)', [(table, column, dtype) for column, dtype in new_schema.items()])
+
+        return new_schema
+
+    def delete_dates(self, conn: sqlite3.Connection, table: str, campaign: str, dates: tuple) -> None:
+
+        conn.execute(f'DELETE FROM {quote(table)} WHERE _campaign = ? AND date BETWEEN ? AND ?', (campaign, *(date.strftime('%Y-%m-%d') for date in dates)))
+
+        return
+
+    def upsert(self, table: str, campaign: str, df: pd.DataFrame, replace_dates: tuple = None) -> None:
+        '''
+        Grava as linhas do dataframe; linhas com a mesma chave natural são substituídas.
+        Com replace_dates (início, fim) as linhas da campanha nesse intervalo são apagadas antes, na mesma transação.
+        '''
+
+        # Janela sem dados (dataframe sem colunas): só as linhas do intervalo são apagadas.
+        if df.empty or 'date' not in df.columns:
+            if replace_dates and self.schema(table):
+                with self.connect() as conn:
+                    self.delete_dates(conn, table, campaign, replace_dates)
+            return
+
+        df = df.copy()
+        df['date'] = pd.to_datetime(df['date'])
+
+        with self.connect() as conn:
+            schema = self.ensure_table(conn, table, df)
+
+            if replace_dates:
+                self.delete_dates(conn, table, campaign, replace_dates)
+
+            df = apply_schema(df, schema)
+
+            for column, dtype in schema.items():
+                if dtype.startswith('datetime'):
+                    df[column] = df[column].dt.strftime('%Y-%m-%d')
+
+            keys = ['_campaign'] + NATURAL_KEYS.get(table, ['date'])
+            columns = ['_campaign'] + list(schema)
+            df.insert(0, '_campaign', campaign)
+
+            updates = ', '.join(f'{quote(column)} = excluded.{quote(column)}' for column in columns if column not in keys)
+            sql = f'''
+                INSERT INTO {quote(table)} ({", ".join(quote(column) for column in columns)})
+                VALUES ({", ".join("?" for _ in columns)})
+                ON CONFLICT ({", ".join(quote(column) for column in keys)}) DO {f"UPDATE SET {updates}" if updates else "NOTHING"}
+            '''
+
+            rows = df[columns].astype(object).where(df[columns].notnull(), None).values.tolist()
+            conn.executemany(sql, rows)
+
+        return
+
+    def query(self, sql: str, params: tuple = ()) -> pd.DataFrame:
+
+        with self.connect() as conn:
+            return pd.read_sql_query(sql, conn, params = params)
+
+    def read(self, table: str, campaign: str, start_date: datetime.date = None, end_date: datetime.date = None) -> pd.DataFrame:
+
+        schema = self.schema(table)
+
+        if not schema:
+            return pd.DataFrame()
+
+        sql = f'SELECT {", ".join(quote(column) for column in schema)} FROM {quote(table)} WHERE _campaign = ?'
+        params = [campaign]
+
+        if start_date:
+            sql += ' AND date >= ?'
+            params.append(start_date.strftime('%Y-%m-%d'))
+        if end_date:
+            sql += ' AND date <= ?'
+            params.append(end_date.strftime('%Y-%m-%d'))
+
+        return apply_schema(self.query(sql + ' ORDER BY date', tuple(params)), schema)
+
+    def dates(self, table: str, campaign: str) -> list:
+
+        if not self.schema(table):
+            return []
+
+        dates = self.query(f'SELECT DISTINCT date FROM {quote(table)} WHERE _campaign = ? ORDER BY date', (campaign,))
+
+        return [datetime.datetime.strptime(date, '%Y-%m-%d').date() for date in dates['date']]
+
+
+class WarehouseStorage:
+    '''Armazenamento das bases de uma campanha no Warehouse, com a mesma interface do storage.py.'''
+
+    def __init__(self, campaign_path: str, warehouse: Warehouse = None):
+        self.campaign_path = campaign_path
+        self.campaign = os.path.basename(os.path.normpath(campaign_path))
+        self.warehouse = warehouse or Warehouse()
+
+    def legacy(self):
+        '''Base no Excel do formato antigo. Import aqui dentro porque storage.py importa este módulo.'''
+
+        from storage import ExcelStorage
+
+        return ExcelStorage(self.campaign_path)
+
+    def exists(self, name: str) -> bool:
+        '''Se a base existe, no banco ou ainda no Excel do formato antigo (sem carregar nada).'''
+
+        return bool(self.warehouse.dates(name, self.campaign)) or self.legacy().exists(name)
+
+    def migrate(self, name: str) -> None:
+        '''Carrega no banco a base que ainda está no Excel do formato antigo; chamado na primeira leitura ou gravação.'''
+
+        if self.warehouse.dates(name, self.campaign) or not self.legacy().exists(name):
+            return
+
+        print(f'Carregando {name} de Excel para o banco.')
+        self.append(name, self.legacy().read(name))
+
+        return
+
+    def dates(self, name: str) -> list:
+
+        self.migrate(name)
+
+        return self.warehouse.dates(name, self.campaign)
+
+    def max_date(self, name: str) -> datetime.date:
+
+        dates = self.dates(name)
+
+        return dates[-1] if dates else None
+
+    def read(self, name: str, start_date: datetime.date = None, end_date: datetime.date = None) -> pd.DataFrame:
+
+        self.migrate(name)
+
+        return self.warehouse.read(name, self.campaign, start_date, end_date)
+
+    def append(self, name: str, df: pd.DataFrame) -> None:
+
+        self.warehouse.upsert(name, self.campaign, df)
+
+        return
+
+    def replace(self, name: str, df: pd.DataFrame, start_date: datetime.date, end_date: datetime.date) -> None:
+
+        self.migrate(name)
+        self.warehouse.upsert(name, self.campaign, df, replace_dates = (start_date, end_date))
+
+        return
+
+
+# Fontes do GA de cada plataforma e as chaves usadas para juntar a plataforma ao GA (mesmas regras do merge_ga e merge_ga_cm).
+# - join: colunas da junção linha a linha entre plataforma e GA
+# - fallback: colunas usadas para completar as linhas do GA que não existem na plataforma
+GA_JOINS = {
+    'facebook': {'sources': ['fb', 'ig'], 'join': ['date', 'source', 'content'], 'fallback': ['source', 'content']},
+    'google': {'sources': ['google'], 'join': ['date', 'ad_id'], 'fallback': ['ad_id']},
+    'twitter': {'sources': ['twitter'], 'join': ['date', 'source', 'content'], 'fallback': ['source', 'content']},
+    'tiktok': {'sources': ['tiktok'], 'join': ['date', 'source', 'content'], 'fallback': ['source', 'content']},
+    'linkedin': {'sources': ['linkedin'], 'join': ['date', 'source', 'content'], 'fallback': ['source', 'content']},
+    'cm': {'sources': None, 'join': ['date', 'source', 'cm_creative_id'], 'fallback': ['source', 'cm_creative_id']}
+}
+
+EVENT_COLUMNS = ['eventcategory', 'eventaction', 'eventlabel', 'totalevents', 'uniqueevents', 'sessionswithevent']
+
+
+def temp_table(conn: sqlite3.Connection, name: str, df: pd.DataFrame) -> None:
+    '''Cria uma tabela temporária (visível só nesta conexão) com o dataframe e a coluna _row com a posição de cada linha.'''
+
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.strftime('%Y-%m-%d')
+
+    columns = ['_row'] + list(df.columns)
+    df.insert(0, '_row', range(len(df)))
+
+    conn.execute(f'DROP TABLE IF EXISTS temp.{quote(name)}')
+    conn.execute(f'CREATE TEMP TABLE {quote(name)} ({", ".join(quote(column) for column in columns)})')
+    conn.executemany(f'INSERT INTO temp.{quote(name)} VALUES ({", ".join("?" for _ in columns)})', df.astype(object).where(df.notnull(), None).values.tolist())
+
+    return
+
+def merge_ga_sql(pr_df: pd.DataFrame, campaign_path: str, bm: str, warehouse: Warehouse = None) -> tuple:
+    '''
+    Versão em SQL do merge_ga / merge_ga_cm, lendo o GA direto do Warehouse.
+    - entradas:
+        - base da plataforma já com a parametrização
+        - pasta da campanha
+        - plataforma ('facebook', 'google', 'twitter', 'tiktok', 'linkedin' ou 'cm')
+
+    - saídas:
+        - overview e eventos do GA juntados à plataforma, com as mesmas colunas do merge_ga
+    '''
+
+    warehouse = warehouse or Warehouse()
+    campaign = os.path.basename(os.path.normpath(campaign_path))
+    rules = GA_JOINS[bm]
+    ga = 'cm' if bm == 'cm' else 'bm'
+
+    join_keys = rules['join']
+    fallback_keys = rules['fallback']
+
+    ov_table = quote(f'{ga}_ga_overview')
+    ev_table = quote(f'{ga}_ga_events')
+    ov_schema = warehouse.schema(f'{ga}_ga_overview')
+    ev_schema = warehouse.schema(f'{ga}_ga_events')
+
+    pr_df = pr_df.copy()
+    pr_df['date'] = pd.to_datetime(pr_df['date'])
+
+    pr_columns = list(pr_df.columns)
+    bm_metrics = [column for column in pr_columns if pr_df[column].dtypes not in ['object', 'datetime64[ns]']]
+    ga_metrics = [column for column in ov_schema if ov_schema[column] != 'object' and not ov_schema[column].startswith('datetime') and 'event' not in column]
+
+    # Mesmas regras de colunas do merge_ga: na junção linha a linha ficam as colunas da plataforma e as do GA que
+    # não existem nela; nas linhas do GA sem par na plataforma as colunas da plataforma vêm da primeira linha com o mesmo fallback.
+    ov_columns = list(ov_schema) + ['ga_id']
+    join_ov_columns = [column for column in ov_columns if column not in pr_columns]
+    not_bm_ov_columns = [column for column in ov_columns if column not in pr_columns + ['check_join'] or column in fallback_keys]
+    pr_fallback_columns = [column for column in pr_columns if column not in fallback_keys] + ['check_join']
+
+    def key_expression(alias: str) -> str:
+        return " || '__' || ".join(f'{alias}.{quote(column)}' for column in join_keys)
+
+    def select_columns(schema: dict) -> str:
+        # O GA do Campaign Manager guarda o id do criativo como texto de um número; o merge_ga_cm compara como inteiro.
+        return ', '.join('CAST(CAST(cm_creative_id AS INTEGER) AS TEXT) AS cm_creative_id' if bm == 'cm' and column == 'cm_creative_id' else quote(column) for column in schema)
+
+    source_filter = ''
+    params = [campaign]
+    if rules['sources']:
+        source_filter = f' AND source IN ({", ".join("?" for _ in rules["sources"])})'
+        params += rules['sources']
+
+    ga_join = ' AND '.join(f'pr.{quote(column)} = ov.{quote(column)}' for column in join_keys)
+    fallback_join = ' AND '.join(f'first_pr.{quote(column)} = ov.{quote(column)}' for column in fallback_keys)
+
+    not_bm_select = [f'ov.{quote(column)}' for column in not_bm_ov_columns]
+    not_bm_select += [f'0 AS {quote(column)}' if column in bm_metrics else f'first_pr.{quote(column)}' for column in pr_fallback_columns]
+
+    # No merge_ga as métricas da plataforma são zeradas antes de testar impressions, então só há erro_ga quando impressions não é métrica.
+    not_bm_juncao = "'bm_ausente'" if 'impressions' in bm_metrics else "CASE WHEN first_pr.impressions IS NULL THEN 'erro_ga' ELSE 'bm_ausente' END"
+
+    with warehouse.connect() as conn:
+        temp_table(conn, 'pr', pr_df)
+
+        for name, table, schema in [('ov', ov_table, ov_schema), ('ev', ev_table, ev_schema)]:
+            conn.execute(f'DROP TABLE IF EXISTS temp.{name}')
+            conn.execute(f'''
+                CREATE TEMP TABLE {name} AS
+                SELECT t.*, {key_expression('t')} AS ga_id
+                FROM (SELECT rowid AS _row, {select_columns(schema)} FROM {table} WHERE _campaign = ?{source_filter}) AS t
+            ''', params)
+
+        join_ov = pd.read_sql_query(f'''
+            SELECT pr.*, {", ".join(f"ov.{quote(column)}" for column in join_ov_columns)},
+                CASE WHEN ov.sessions IS NULL THEN 'ga_ausente' ELSE 'ok' END AS juncao
+            FROM pr LEFT JOIN ov ON {ga_join}
+            ORDER BY pr._row, ov._row
+        ''', conn)
+
+        not_bm = pd.read_sql_query(f'''
+            WITH first_pr AS (
+                SELECT pr.*, {key_expression('pr')} AS check_join
+                FROM pr
+                WHERE pr._row IN (SELECT MIN(_row) FROM pr GROUP BY {", ".join(quote(column) for column in fallback_keys)})
+            )
+            SELECT {", ".join(not_bm_select)}, {not_bm_juncao} AS juncao
+            FROM ov LEFT JOIN first_pr ON {fallback_join}
+            WHERE NOT EXISTS (SELECT 1 FROM pr WHERE {ga_join})
+            ORDER BY ov._row
+        ''', conn)
+
+        join_ov.drop(columns = ['_row'], inplace = True)
+
+        gaoverview = pd.concat([join_ov, not_bm], axis = 0, ignore_index = True)
+        gaoverview.drop(columns = [column for column in EVENT_COLUMNS if column in gaoverview.columns], inplace = True)
+        gaoverview['date'] = pd.to_datetime(gaoverview['date'])
+
+        temp_table(conn, 'gaov', gaoverview)
+
+        gaov_columns = [column for column in gaoverview.columns if column not in ['ga_id'] + bm_metrics + ga_metrics]
+        gaevents = pd.read_sql_query(f'''
+            SELECT {", ".join(f"ev.{quote(column)}" for column in EVENT_COLUMNS)}, ev.ga_id,
+                {", ".join(f"gaov.{quote(column)}" for column in gaov_columns)}
+            FROM ev LEFT JOIN gaov ON ev.ga_id = gaov.ga_id
+            ORDER BY ev._row, gaov._row
+        ''', conn)
+
+        for name in ['pr', 'ov', 'ev', 'gaov']:
+            conn.execute(f'DROP TABLE temp.{name}')
+
+    gaevents['date'] = pd.to_datetime(gaevents['date'])
+
+    # No pandas as métricas viram float sempre que a junção deixa algum vazio; aqui ficam float sempre.
+    for df in [gaoverview, gaevents]:
+        for column in [column for column in bm_metrics + ga_metrics if column in df.columns]:
+            df[column] = pd.to_numeric(df[column]).astype('float64')
+
+    return gaoverview, gaevents